@@ -2,36 +2,58 @@
 Main Flask application entry point for the Library Management System.
 
 This module provides the application factory pattern for creating Flask app instances.
-Routes are organized in separate blueprint modules in the routes package.
+Routes are organized in separate blueprint modules in the routes package,
+CLI commands in the commands module.
 """
 
+import os
+from typing import Dict, Optional
+
 from flask import Flask
-from database import init_database, add_sample_data
+from database import init_database, add_sample_data, register_request_scope
 from routes import register_blueprints
+from routes.api_encoding import FastJSONProvider
+from commands import register_commands
 
 
-def create_app():
+def create_app(config: Optional[Dict] = None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        config: Settings to apply on top of the defaults, e.g.
+            {'LOAD_SAMPLE_DATA': True}
+    
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
+    app.json = FastJSONProvider(app)  # orjson when installed
+    
+    # Sample books are only added when asked for, by config or LIBRARY_SAMPLE_DATA=1
+    app.config['LOAD_SAMPLE_DATA'] = os.environ.get('LIBRARY_SAMPLE_DATA', '').lower() in ('1', 'true', 'yes')
+    app.config.update(config or {})
     
-    # Initialize the database
+    # Initialize the database (a single version check once it is up to date)
     init_database()
     
     # Add sample data for testing and demonstration
-    add_sample_data()
+    if app.config['LOAD_SAMPLE_DATA']:
+        add_sample_data()
+    
+    # One database connection and transaction per request
+    register_request_scope(app)
     
     # Register all route blueprints
     register_blueprints(app)
     
+    # Register CLI commands (flask import-books, ...)
+    register_commands(app)
+    
     return app
 
 
 if __name__ == '__main__':
-    app = create_app()
+    app = create_app({'LOAD_SAMPLE_DATA': True})
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,84 @@
+"""
+Caching - Thread-safe in-process LRU cache shared by the app's caches
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live and hit/miss counts.
+
+    Holds at most `max_size` entries (none if it is 0 or less); with a
+    `ttl`, entries expire that many seconds after they were stored.
+
+    Subclasses that keep their own lookups on top of the entries work with
+    the underscored methods, which expect the lock to be held, and override
+    _remove() to keep those lookups in step: every entry leaves the cache
+    through it.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[Optional[float], Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: Optional[Hashable]) -> Optional[Any]:
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        self._remove(key)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (expires, value)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def _clear(self) -> None:
+        self._entries.clear()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            return self._get(key)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._put(key, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,103 @@
+"""
+CLI Commands - Flask command line entry points
+
+Commands are available through the flask CLI, e.g.:
+    flask --app app import-books vendor_feed.csv
+    flask --app app serve --workers 4
+"""
+
+import click
+from services.import_service import DEFAULT_BATCH_SIZE, import_books_from_file
+from database import get_unknown_payments
+from services.job_service import DEFAULT_WORKERS, POLL_INTERVAL, WorkerPool
+from services.library_service import reconcile_payment
+from server import (
+    DEFAULT_BIND, DEFAULT_GRACEFUL_TIMEOUT, DEFAULT_MAX_REQUESTS, DEFAULT_THREADS,
+    DEFAULT_TIMEOUT, build_options, serve
+)
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Feed format (default: from the file extension).')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Books inserted per transaction.')
+def import_books_command(path, file_format, batch_size):
+    """Bulk import books from a CSV or JSON Lines feed."""
+    try:
+        report = import_books_from_file(path, file_format, batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    for reject in report['rejected']:
+        click.echo(f"Row {reject['row']} rejected ({reject['isbn'] or 'no ISBN'}): {reject['reason']}", err=True)
+    click.echo(f"Imported {report['imported']} books, rejected {len(report['rejected'])}.")
+
+
+@click.command('run-workers')
+@click.option('--workers', default=DEFAULT_WORKERS, show_default=True,
+              help='Number of worker processes.')
+@click.option('--poll-interval', default=POLL_INTERVAL, show_default=True,
+              help='Seconds an idle worker waits before checking the queue again.')
+def run_workers_command(workers, poll_interval):
+    """Process queued payment and refund jobs until interrupted."""
+    pool = WorkerPool(workers, poll_interval)
+    pool.start()
+    click.echo(f"Started {workers} payment workers. Press Ctrl+C to stop.")
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        click.echo("Stopping workers after their current jobs...")
+    finally:
+        pool.stop()
+
+
+@click.command('reconcile-payments')
+@click.option('--key', help='Idempotency key of the payment to settle.')
+@click.option('--transaction-id', help='Gateway transaction found for the payment (leave out if there was no charge).')
+def reconcile_payments_command(key, transaction_id):
+    """List payments whose outcome is unknown, or settle one with --key."""
+    if key is None:
+        payments = get_unknown_payments()
+        for payment in payments:
+            click.echo(f"{payment['idempotency_key']}  patron {payment['patron_id']}  "
+                       f"${payment['amount']:.2f}  claimed {payment['claimed_at']}")
+        click.echo(f"{len(payments)} payments to reconcile.")
+        return
+    
+    success, message = reconcile_payment(key, transaction_id)
+    if not success:
+        raise click.ClickException(message)
+    click.echo(message)
+
+
+@click.command('serve')
+@click.option('--bind', default=DEFAULT_BIND, show_default=True,
+              help='Address to listen on (host:port or unix:path).')
+@click.option('--workers', type=int,
+              help='Worker processes (default: WEB_CONCURRENCY or 2 x CPUs + 1).')
+@click.option('--threads', default=DEFAULT_THREADS, show_default=True,
+              help='Request threads per worker.')
+@click.option('--preload/--no-preload', default=True, show_default=True,
+              help='Load the app once in the master before forking workers.')
+@click.option('--timeout', default=DEFAULT_TIMEOUT, show_default=True,
+              help='Seconds a request may take before its worker is restarted.')
+@click.option('--graceful-timeout', default=DEFAULT_GRACEFUL_TIMEOUT, show_default=True,
+              help='Seconds workers get to finish their requests on restart or shutdown.')
+@click.option('--max-requests', default=DEFAULT_MAX_REQUESTS, show_default=True,
+              help='Requests before a worker is replaced (0 disables).')
+def serve_command(bind, workers, threads, preload, timeout, graceful_timeout, max_requests):
+    """Run the app under the gunicorn production server."""
+    try:
+        serve(build_options(bind, workers, threads, preload, timeout, graceful_timeout, max_requests))
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+    app.cli.add_command(import_books_command)
+    app.cli.add_command(run_workers_command)
+    app.cli.add_command(reconcile_payments_command)
+    app.cli.add_command(serve_command)
@@ -3,23 +3,517 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import json
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import g, has_request_context
+
+from caching import LRUCache
 
 # Database configuration
 DATABASE = 'library.db'
 
+# Connection pool configuration
+POOL_SIZE = 5  # Idle connections kept open per process
+
+# Book cache configuration (see BookCache)
+BOOK_CACHE_SIZE = 1024   # Books kept in memory per process
+BOOK_CACHE_TTL = 30.0    # Seconds before a cached book is re-read
+
+# PRAGMA profiles applied by init_database() and to every pooled connection.
+# Both use WAL so catalog readers never wait on borrow/return writers;
+# "fast" only fsyncs at WAL checkpoints and may lose the last commits on
+# power failure, "durable" fsyncs every commit.
+PRAGMA_PROFILES = {
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,     # 64 MiB page cache (negative means KiB)
+        'mmap_size': 268435456,   # 256 MiB memory-mapped I/O
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,     # Milliseconds to wait on a locked database
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16384,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+}
+DB_PROFILE = os.environ.get('LIBRARY_DB_PROFILE', 'fast')
+
+# journal_mode is stored in the database file, so it only needs to be set
+# once at startup; everything else is per connection.
+_PERSISTENT_PRAGMAS = ('journal_mode',)
+
+def apply_pragma_profile(conn, profile: str, include_persistent: bool = False):
+    """Apply the PRAGMAs of a named profile to a connection."""
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Unknown database profile: {profile!r}")
+    for name, value in PRAGMA_PROFILES[profile].items():
+        if name in _PERSISTENT_PRAGMAS and not include_persistent:
+            continue
+        conn.execute(f'PRAGMA {name} = {value}')
+
+
+class ConnectionPool:
+    """
+    A small pool of SQLite connections shared by the threads of one process.
+
+    Connections are opened on demand, configured once, health-checked on
+    checkout and kept open after release so that a request does not pay for
+    sqlite3.connect() and file-lock setup on every statement. At most
+    `size` idle connections are retained; extra connections opened under a
+    burst of concurrent checkouts are closed when they are released.
+    """
+
+    def __init__(self, database: str, size: int = POOL_SIZE, profile: str = 'fast'):
+        self.database = database
+        self.size = size
+        self.profile = profile
+        self.pid = os.getpid()
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A pooled connection may be checked out by different threads over
+        # its lifetime, but only ever by one thread at a time.
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=LibraryConnection)
+        apply_pragma_profile(conn, self.profile)
+        install_book_cache_hooks(conn)
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        """Check out a healthy connection, opening a new one if none is idle."""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+                break
+            if self._is_healthy(conn):
+                break
+            conn.close()
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool, discarding any uncommitted work."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        finally:
+            evict_changed_books(conn)
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self) -> None:
+        """Close every idle connection held by the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+
+class PooledConnection:
+    """
+    Proxy for a pooled sqlite3.Connection.
+
+    Behaves like the underlying connection, except that close() hands the
+    connection back to its pool instead of closing the database handle.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, pool: ConnectionPool):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Get the process-wide connection pool for DATABASE."""
+    global _pool
+    with _pool_lock:
+        if (_pool is None or _pool.database != DATABASE
+                or _pool.profile != DB_PROFILE or _pool.pid != os.getpid()):
+            # Connections inherited across fork() must never be reused,
+            # so a child process simply starts with a fresh pool.
+            if _pool is not None and _pool.pid == os.getpid():
+                _pool.close_all()
+            _pool = ConnectionPool(DATABASE, POOL_SIZE, DB_PROFILE)
+            book_cache.clear()
+        return _pool
+
+def reset_pool():
+    """Close all idle pooled connections (e.g. after changing POOL_SIZE)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and pool.pid == os.getpid():
+        pool.close_all()
+
+class ScopedConnection:
+    """
+    Proxy for the connection of the current request (see RequestScope).
+
+    Behaves like the underlying connection, except that commit() and
+    close() are no-ops: the request's work is committed, and the connection
+    returned to the pool, once when the request ends. `with conn:` runs the
+    block in a savepoint, so only the block is undone if it raises; a plain
+    rollback() would throw away the whole request's work and is refused.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, scope: 'RequestScope'):
+        self._conn = conn
+        self._scope = scope
+        self._savepoints: List[str] = []
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['_conn'], name)
+
+    def __enter__(self):
+        self._savepoints.append(self._scope.savepoint())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._scope.release_savepoint(self._savepoints.pop(), undo=exc_type is not None)
+        return False
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        raise sqlite3.ProgrammingError(
+            "Cannot roll back the request's transaction; use transaction() to undo part of it")
+
+    def close(self):
+        pass
+
+
+class RequestScope:
+    """
+    One connection and one transaction shared by everything a request does.
+
+    The connection is checked out of the pool the first time a helper asks
+    for one, so requests that never touch the database never take one. Only
+    the thread serving the request uses it; sqlite connections must not be
+    shared between threads that run at the same time.
+    """
+
+    def __init__(self):
+        self._pool: Optional[ConnectionPool] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._savepoints = 0
+        self.thread_id = threading.get_ident()
+
+    @property
+    def active(self) -> bool:
+        return self._conn is not None
+
+    def connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._pool = get_pool()
+            self._conn = self._pool.acquire()
+        return self._conn
+
+    def savepoint(self) -> str:
+        """Open a savepoint in the request's transaction, starting it if needed."""
+        conn = self.connection()
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        self._savepoints += 1
+        name = f'request_savepoint_{self._savepoints}'
+        conn.execute(f'SAVEPOINT {name}')
+        return name
+
+    def release_savepoint(self, name: str, undo: bool = False) -> None:
+        """Keep the work done since a savepoint, or undo it if `undo` is set."""
+        if undo:
+            self._conn.execute(f'ROLLBACK TO {name}')
+        self._conn.execute(f'RELEASE {name}')
+
+    def commit(self) -> None:
+        if self._conn is not None and self._conn.in_transaction:
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Return the connection to the pool, rolling back anything not committed."""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+def _request_scope() -> Optional[RequestScope]:
+    """
+    Get the scope of the current request, if the app uses request scopes.
+
+    Threads that inherited the request context (e.g. through
+    asyncio.to_thread) get None, and so pooled connections of their own.
+    """
+    if not has_request_context():
+        return None
+    scope = g.get('db_scope')
+    if scope is None or scope.thread_id != threading.get_ident():
+        return None
+    return scope
+
+def register_request_scope(app) -> None:
+    """
+    Give every request of a Flask app one database connection and transaction.
+
+    The work of a request is committed after its view returns, so a failed
+    commit still becomes an error response, and rolled back if the view
+    raised. The connection goes back to the pool when the request ends.
+    Other threads working for a request, with or without its context, use
+    pooled connections of their own.
+    """
+    @app.before_request
+    def open_request_scope():
+        g.db_scope = RequestScope()
+
+    @app.after_request
+    def commit_request_transaction(response):
+        scope = g.get('db_scope')
+        if scope is not None and response.status_code < 500:
+            scope.commit()
+        return response
+
+    @app.teardown_request
+    def close_request_connection(exc):
+        scope = g.pop('db_scope', None)
+        if scope is not None:
+            scope.close()
+
 def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    return conn
+    """
+    Get a database connection from the pool. Call close() to return it.
+
+    During a request of an app set up with register_request_scope() this is
+    the request's connection instead (see ScopedConnection).
+    """
+    scope = _request_scope()
+    if scope is not None:
+        return ScopedConnection(scope.connection(), scope)
+    return _own_connection()
+
+def _own_connection():
+    """Get a pooled connection of its own, even during a request."""
+    pool = get_pool()
+    return PooledConnection(pool.acquire(), pool)
+
+@contextmanager
+def transaction():
+    """
+    Run a block of statements as one write transaction.
+
+    BEGIN IMMEDIATE takes the write lock up front, so checks made inside
+    the block cannot be invalidated by a concurrent writer before commit.
+    The transaction is rolled back if the block raises.
+
+    During a request (see register_request_scope) the block runs in a
+    savepoint of the request's transaction instead: only the block is
+    undone if it raises, and it is committed with the rest of the request.
+    """
+    scope = _request_scope()
+    if scope is not None:
+        savepoint = scope.savepoint()
+        try:
+            yield ScopedConnection(scope.connection(), scope)
+        except BaseException:
+            scope.release_savepoint(savepoint, undo=True)
+            raise
+        scope.release_savepoint(savepoint)
+        return
 
-def init_database():
-    """Initialize the database with required tables."""
     conn = get_db_connection()
-    
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+class BookCache(LRUCache):
+    """
+    In-process LRU cache of book rows, looked up by id or ISBN.
+
+    Holds at most `max_size` books, each for at most `ttl` seconds. Writes
+    made through this process's pooled connections evict the affected
+    books (see install_book_cache_hooks), so the TTL only bounds how long a
+    change made by another process can go unseen. Lookups that find no
+    book are not cached, so new books are visible immediately.
+
+    Every eviction bumps a generation counter. A reader takes generation()
+    before its query and hands it to put(), which drops the row if anything
+    was evicted in between: the row may be older than the eviction.
+    """
+
+    def __init__(self, max_size: int = BOOK_CACHE_SIZE, ttl: float = BOOK_CACHE_TTL):
+        super().__init__(max_size, ttl)
+        self._ids_by_isbn: Dict[str, int] = {}
+        self._generation = 0
+
+    def get_by_id(self, book_id: int) -> Optional[Dict]:
+        with self._lock:
+            book = self._get(book_id)
+        return dict(book) if book is not None else None
+
+    def get_by_isbn(self, isbn: str) -> Optional[Dict]:
+        with self._lock:
+            book = self._get(self._ids_by_isbn.get(isbn))
+        return dict(book) if book is not None else None
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def put(self, book: Dict, generation: Optional[int] = None) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._put(book['id'], dict(book))
+            self._ids_by_isbn[book['isbn']] = book['id']
+
+    def _remove(self, book_id: int) -> Optional[Dict]:
+        book = super()._remove(book_id)
+        if book is not None and self._ids_by_isbn.get(book['isbn']) == book_id:
+            del self._ids_by_isbn[book['isbn']]
+        return book
+
+    def invalidate(self, book_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            self._remove(book_id)
+
+    def _clear(self) -> None:
+        self._generation += 1
+        super()._clear()
+        self._ids_by_isbn.clear()
+
+book_cache = BookCache()
+
+class LibraryConnection(sqlite3.Connection):
+    """sqlite3.Connection that remembers which books its statements changed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed_book_ids = set()
+
+    def book_changed(self, book_id: int) -> None:
+        # Evict right away, and again once the change is committed (see
+        # evict_changed_books) in case another thread re-cached the old row
+        # in between.
+        self.changed_book_ids.add(book_id)
+        book_cache.invalidate(book_id)
+
+def evict_changed_books(conn) -> None:
+    """Evict the books changed on a connection from the cache."""
+    changed = getattr(conn, 'changed_book_ids', None)
+    while changed:
+        book_cache.invalidate(changed.pop())
+
+# Temporary triggers make every UPDATE or DELETE on books through a pooled
+# connection evict the affected rows from the cache, including ad hoc SQL
+# that bypasses the helper functions below.
+BOOK_CACHE_TRIGGERS = [
+    '''
+        CREATE TEMP TRIGGER IF NOT EXISTS book_cache_on_update AFTER UPDATE ON main.books BEGIN
+            SELECT book_cache_invalidate(old.id);
+        END
+    ''',
+    '''
+        CREATE TEMP TRIGGER IF NOT EXISTS book_cache_on_delete AFTER DELETE ON main.books BEGIN
+            SELECT book_cache_invalidate(old.id);
+        END
+    ''',
+]
+
+def install_book_cache_hooks(conn) -> None:
+    """Install the cache invalidation triggers on a connection (once the books table exists)."""
+    if not isinstance(conn, LibraryConnection):
+        conn = conn._conn  # PooledConnection
+    conn.create_function('book_cache_invalidate', 1, conn.book_changed)
+    try:
+        for statement in BOOK_CACHE_TRIGGERS:
+            conn.execute(statement)
+    except sqlite3.OperationalError:
+        pass  # No books table yet; init_database() installs them after creating it
+
+def init_database(profile: Optional[str] = None):
+    """
+    Initialize the database: apply the PRAGMA profile and bring the schema up to date.
+
+    On a database that is already at SCHEMA_VERSION this is a single
+    version check, so starting many worker processes stays cheap and never
+    takes the write lock.
+
+    Args:
+        profile: Name of the PRAGMA profile to use ("fast" or "durable").
+            Defaults to DB_PROFILE; pooled connections follow the choice.
+    """
+    global DB_PROFILE
+    if profile is not None:
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Unknown database profile: {profile!r}")
+        DB_PROFILE = profile
+
+    conn = get_db_connection()
+    apply_pragma_profile(conn, DB_PROFILE, include_persistent=True)
+    version = get_schema_version(conn)
+    conn.close()
+
+    if version < SCHEMA_VERSION:
+        migrate_database()
+
+def _create_core_tables(conn):
     # Create books table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS books (
@@ -31,7 +525,7 @@ def init_database():
             available_copies INTEGER NOT NULL
         )
     ''')
-    
+
     # Create borrow_records table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS borrow_records (
@@ -44,16 +538,288 @@ def init_database():
             FOREIGN KEY (book_id) REFERENCES books (id)
         )
     ''')
-    
-    conn.commit()
+
+def _add_late_fee_column(conn):
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(borrow_records)')]
+    if 'late_fee' not in columns:
+        # Late fee charged when the book was returned (NULL while on loan)
+        conn.execute('ALTER TABLE borrow_records ADD COLUMN late_fee REAL')
+
+# Indexes for the hot borrow_records lookups. Every patron query filters on
+# patron_id; open loans (return_date IS NULL) get their own partial index so
+# borrow counts and returns stay small lookups as circulation history grows.
+SCHEMA_INDEXES = [
+    '''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_patron
+        ON borrow_records (patron_id, borrow_date)
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_open_loans
+        ON borrow_records (patron_id, book_id)
+        WHERE return_date IS NULL
+    ''',
+    # Billing runs read only the overdue part of the open loans
+    '''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_open_due
+        ON borrow_records (due_date)
+        WHERE return_date IS NULL
+    ''',
+    # Keyset pagination of the catalog walks this index in (title, id) order
+    '''
+        CREATE INDEX IF NOT EXISTS idx_books_title
+        ON books (title, id)
+    ''',
+]
+
+def _create_indexes(conn):
+    for statement in SCHEMA_INDEXES:
+        conn.execute(statement)
+
+# Full-text index over book titles and authors. The trigram tokenizer keeps
+# the case-insensitive substring semantics of R6 while letting SQLite answer
+# the search from the index instead of scanning every book.
+SEARCH_INDEX_TRIGGERS = [
+    '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''',
+]
+
+def create_search_index(conn) -> bool:
+    """
+    Create the books_fts index and its sync triggers if they do not exist.
+
+    Returns False when this SQLite build has no FTS5 trigram support, in
+    which case search_books() falls back to LIKE queries.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+    ).fetchone()
+    if not exists:
+        try:
+            conn.execute('''
+                CREATE VIRTUAL TABLE books_fts USING fts5(
+                    title, author, content='books', content_rowid='id', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return False
+    for statement in SEARCH_INDEX_TRIGGERS:
+        conn.execute(statement)
+    if not exists:
+        # Index the books that were added before the search index existed
+        conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+    return True
+
+def _create_payments_table(conn):
+    # Ledger of late fee charges sent to the gateway
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE NOT NULL,
+            patron_id TEXT NOT NULL,
+            book_id INTEGER,
+            amount REAL NOT NULL,
+            status TEXT NOT NULL,
+            transaction_id TEXT,
+            message TEXT,
+            refunded_amount REAL NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    # Payment history per patron, and refunds looked up by gateway transaction
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_patron
+        ON payments (patron_id, created_at)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_transaction
+        ON payments (transaction_id)
+        WHERE transaction_id IS NOT NULL
+    ''')
+
+def _create_jobs_table(conn):
+    # Queue of background payment and refund jobs
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    # Workers take the oldest job of a status, however many finished jobs pile up
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_status
+        ON jobs (status, id)
+    ''')
+
+def _create_refunds_table(conn):
+    # Refunds sent to the gateway, one per idempotency key
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS refunds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE NOT NULL,
+            transaction_id TEXT NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT NOT NULL,
+            message TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+def _create_worker_stats_table(conn):
+    # Latest payment gateway stats reported by each job worker process
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS worker_stats (
+            worker TEXT PRIMARY KEY,
+            stats TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+def _add_payment_claimed_at_column(conn):
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(payments)')]
+    if 'claimed_at' not in columns:
+        # When the current attempt of a payment was claimed
+        conn.execute('ALTER TABLE payments ADD COLUMN claimed_at TEXT')
+        conn.execute('UPDATE payments SET claimed_at = updated_at')
+
+def _create_late_fee_charges_table(conn):
+    # What each payment charged for each overdue loan, so no fee is billed twice
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS late_fee_charges (
+            payment_id INTEGER NOT NULL,
+            borrow_record_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (payment_id, borrow_record_id),
+            FOREIGN KEY (payment_id) REFERENCES payments (id),
+            FOREIGN KEY (borrow_record_id) REFERENCES borrow_records (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_late_fee_charges_loan
+        ON late_fee_charges (borrow_record_id)
+    ''')
+
+# Every change to books bumps the catalog version, whichever code path makes
+# it, so HTTP caches can tell whether a catalog page is still current.
+CATALOG_VERSION_TRIGGERS = [
+    f'''
+        CREATE TRIGGER IF NOT EXISTS catalog_version_on_{event.lower()} AFTER {event} ON books BEGIN
+            UPDATE catalog_version
+            SET version = version + 1, updated_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+            WHERE id = 1;
+        END
+    '''
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+def _create_catalog_version(conn):
+    # Single-row counter of changes to the books table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO catalog_version (id, version, updated_at)
+        VALUES (1, 1, strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+    ''')
+    for statement in CATALOG_VERSION_TRIGGERS:
+        conn.execute(statement)
+
+# Schema migrations, applied in order by migrate_database(). Append new
+# steps with the next version number and never change a released one.
+# Databases created before schema_version existed start at version 0 and
+# run every step, so each step must cope with its changes already being there.
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, 'books and borrow_records tables', _create_core_tables),
+    (2, 'borrow_records.late_fee column', _add_late_fee_column),
+    (3, 'borrow_records and books indexes', _create_indexes),
+    (4, 'books_fts full-text search index', create_search_index),
+    (5, 'payments ledger', _create_payments_table),
+    (6, 'jobs queue', _create_jobs_table),
+    (7, 'catalog version counter', _create_catalog_version),
+    (8, 'refunds ledger', _create_refunds_table),
+    (9, 'worker stats', _create_worker_stats_table),
+    (10, 'payments.claimed_at column', _add_payment_claimed_at_column),
+    (11, 'late fee charges per loan', _create_late_fee_charges_table),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn) -> int:
+    """Get the schema version of the database (0 if it has never been migrated)."""
+    try:
+        row = conn.execute('SELECT version FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0  # No schema_version table yet
+    return row['version'] if row else 0
+
+def get_catalog_version() -> Tuple[int, datetime]:
+    """
+    Get the catalog version and when it last changed.
+
+    The version goes up with every insert, update or delete on books.
+
+    Returns:
+        tuple: (version: int, updated_at: timezone-aware UTC datetime)
+    """
+    conn = get_db_connection()
+    row = conn.execute('SELECT version, updated_at FROM catalog_version WHERE id = 1').fetchone()
     conn.close()
+    return row['version'], datetime.fromisoformat(row['updated_at'])
+
+def migrate_database():
+    """
+    Bring the database up to SCHEMA_VERSION by running the pending migrations.
+
+    Runs in one write transaction, so when several processes start at once
+    one of them migrates and the others find the work already done.
+    """
+    with transaction() as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        version = get_schema_version(conn)
+        for number, _, migration in MIGRATIONS:
+            if number > version:
+                migration(conn)
+        if version < SCHEMA_VERSION:
+            conn.execute('DELETE FROM schema_version')
+            conn.execute('INSERT INTO schema_version (version) VALUES (?)', (SCHEMA_VERSION,))
+
+    # Connections opened before the books table existed lack the book cache triggers
+    get_pool().close_all()
 
 def add_sample_data():
     """Add sample data to the database if it's empty."""
     conn = get_db_connection()
-    book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
+    has_books = conn.execute('SELECT 1 FROM books LIMIT 1').fetchone() is not None
     
-    if book_count == 0:
+    if not has_books:
         # Add sample books
         sample_books = [
             ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
@@ -91,19 +857,123 @@ def get_all_books() -> List[Dict]:
     conn.close()
     return [dict(book) for book in books]
 
-def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
+def get_books_page(after: Optional[Tuple[str, int]] = None, limit: int = 50) -> Tuple[List[Dict], Optional[Tuple[str, int]]]:
+    """
+    Get one page of books in (title, id) order using keyset pagination.
+
+    Args:
+        after: (title, id) of the last book on the previous page, or None for the first page
+        limit: Maximum number of books on the page
+
+    Returns:
+        tuple: (books: list, next_cursor: (title, id) of the last book, or None on the last page)
+    """
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+    if after is None:
+        rows = conn.execute(
+            'SELECT * FROM books ORDER BY title, id LIMIT ?', (limit + 1,)
+        ).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT * FROM books
+            WHERE (title, id) > (?, ?)
+            ORDER BY title, id
+            LIMIT ?
+        ''', (after[0], after[1], limit + 1)).fetchall()
     conn.close()
-    return dict(book) if book else None
 
-def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
+    books = [dict(row) for row in rows[:limit]]
+    next_cursor = (books[-1]['title'], books[-1]['id']) if len(rows) > limit else None
+    return books, next_cursor
+
+def _load_book(column: str, value) -> Optional[Dict]:
+    """Read one book from the database and cache it if it is committed."""
+    generation = book_cache.generation()
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
+    book = conn.execute(f'SELECT * FROM books WHERE {column} = ?', (value,)).fetchone()
+    # Inside an open transaction (e.g. the request's) the row may hold
+    # changes that are not committed yet and could still be rolled back.
+    committed = not conn.in_transaction
     conn.close()
-    return dict(book) if book else None
+    if not book:
+        return None
+    if committed:
+        book_cache.put(dict(book), generation)
+    return dict(book)
+
+def get_book_by_id(book_id: int) -> Optional[Dict]:
+    """Get a specific book by ID (served from the book cache when possible)."""
+    cached = book_cache.get_by_id(book_id)
+    if cached:
+        return cached
+    return _load_book('id', book_id)
+
+def get_book_by_isbn(isbn: str) -> Optional[Dict]:
+    """Get a specific book by ISBN (served from the book cache when possible)."""
+    cached = book_cache.get_by_isbn(isbn)
+    if cached:
+        return cached
+    return _load_book('isbn', isbn)
+
+# Trigram matching needs at least three characters; shorter terms use LIKE.
+_MIN_FTS_TERM_LENGTH = 3
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def search_books(search_term: str, search_type: str, limit: int = 100, offset: int = 0) -> List[Dict]:
+    """
+    Search books by ISBN (exact) or by title/author (case-insensitive substring).
+
+    ISBN lookups use the UNIQUE index on books.isbn; title and author
+    searches use the books_fts index and are ordered by relevance.
+
+    Args:
+        search_term: Text to look for
+        search_type: "isbn", "title" or "author"
+        limit: Maximum number of books to return
+        offset: Number of matching books to skip, for paging
+
+    Returns:
+        list: Matching books as dicts (empty for an unknown search type)
+    """
+    conn = get_db_connection()
+    try:
+        if search_type == 'isbn':
+            rows = conn.execute('SELECT * FROM books WHERE isbn = ? LIMIT ? OFFSET ?',
+                                (search_term, limit, offset)).fetchall()
+            return [dict(row) for row in rows]
+
+        if search_type not in ('title', 'author'):
+            return []
+
+        rows = None
+        if len(search_term) >= _MIN_FTS_TERM_LENGTH:
+            # A quoted FTS5 string is matched as a substring by the trigram tokenizer
+            match = '{0} : "{1}"'.format(search_type, search_term.replace('"', '""'))
+            try:
+                rows = conn.execute('''
+                    SELECT b.* FROM books_fts
+                    JOIN books b ON b.id = books_fts.rowid
+                    WHERE books_fts MATCH ?
+                    ORDER BY books_fts.rank, b.title, b.id
+                    LIMIT ? OFFSET ?
+                ''', (match, limit, offset)).fetchall()
+            except sqlite3.OperationalError:
+                rows = None  # No FTS5 index in this database
+
+        if rows is None:
+            rows = conn.execute(f'''
+                SELECT * FROM books
+                WHERE {search_type} LIKE ? ESCAPE '\\'
+                ORDER BY title, id
+                LIMIT ? OFFSET ?
+            ''', (_like_pattern(search_term), limit, offset)).fetchall()
+
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
 
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     """Get currently borrowed books for a patron."""
@@ -120,6 +990,7 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     borrowed_books = []
     for record in records:
         borrowed_books.append({
+            'id': record['id'],
             'book_id': record['book_id'],
             'title': record['title'],
             'author': record['author'],
@@ -155,6 +1026,39 @@ def insert_book(title: str, author: str, isbn: str, total_copies: int, available
         conn.close()
         return False
 
+# SQLite builds before 3.32 allow at most 999 bound parameters per statement
+_MAX_SQL_PARAMETERS = 900
+
+# Largest integer SQLite can store or bind (ids, LIMIT and OFFSET values)
+MAX_SQL_INTEGER = 2 ** 63 - 1
+
+def _existing_isbns(conn, isbns: List[str]) -> set:
+    existing = set()
+    for start in range(0, len(isbns), _MAX_SQL_PARAMETERS):
+        chunk = isbns[start:start + _MAX_SQL_PARAMETERS]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(f'SELECT isbn FROM books WHERE isbn IN ({placeholders})', chunk).fetchall()
+        existing.update(row['isbn'] for row in rows)
+    return existing
+
+def insert_new_books(books: List[Tuple[str, str, str, int, int]]) -> set:
+    """
+    Insert many books in one transaction, skipping ISBNs already in the catalog.
+
+    Args:
+        books: (title, author, isbn, total_copies, available_copies) tuples
+
+    Returns:
+        set: ISBNs that were skipped because they already exist
+    """
+    with transaction() as conn:
+        existing = _existing_isbns(conn, [book[2] for book in books])
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [book for book in books if book[2] not in existing])
+    return existing
+
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
     conn = get_db_connection()
@@ -200,9 +1104,245 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
         conn.close()
         return False
 
+def iter_overdue_loans(due_before: datetime, batch_size: int = 10000) -> Iterator[List[Dict]]:
+    """
+    Yield open loans due before a date, in batches of at most batch_size.
+
+    Rows are fetched from one cursor as the caller consumes them, so the
+    whole result set is never held in memory.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute('''
+            SELECT id, patron_id, book_id, due_date FROM borrow_records
+            WHERE return_date IS NULL AND due_date < ?
+            ORDER BY due_date
+        ''', (due_before.isoformat(),))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+# Rows fetched at a time by the export iterators
+EXPORT_BATCH_SIZE = 1000
+
+BORROW_RECORD_FIELDS = ('id', 'patron_id', 'book_id', 'borrow_date', 'due_date', 'return_date', 'late_fee')
+
+def _iter_rows(query: str, params: Tuple, batch_size: int) -> Iterator[List[Dict]]:
+    # Exports are read while a response streams, after the request's own
+    # connection has gone back to the pool, so they use a connection of
+    # their own. One cursor gives them a consistent snapshot.
+    conn = _own_connection()
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def iter_books(since_id: int = 0, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict]]:
+    """
+    Yield the books with an id above since_id, in id order, in batches of
+    at most batch_size. Memory use does not depend on the catalog size.
+    """
+    return _iter_rows('''
+        SELECT id, title, author, isbn, total_copies, available_copies FROM books
+        WHERE id > ?
+        ORDER BY id
+    ''', (since_id,), batch_size)
+
+def iter_borrow_records(since_id: int = 0, since: Optional[datetime] = None,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict]]:
+    """
+    Yield borrow records in id order, in batches of at most batch_size.
+
+    Args:
+        since_id: Only records with a higher id (loans added since the last pull)
+        since: Only records borrowed or returned at or after this time
+            (loans that changed since the last pull)
+    """
+    query = f'''
+        SELECT {', '.join(BORROW_RECORD_FIELDS)} FROM borrow_records
+        WHERE id > ?
+    '''
+    params: Tuple = (since_id,)
+    if since is not None:
+        query += ' AND (borrow_date >= ? OR return_date >= ?)'
+        params += (since.isoformat(), since.isoformat())
+    return _iter_rows(query + ' ORDER BY id', params, batch_size)
+
+def get_overdue_loans_for_patrons(patron_ids: List[str], due_before: datetime) -> List[Dict]:
+    """Get the open loans due before a date for many patrons at once (with book titles)."""
+    conn = get_db_connection()
+    loans = []
+    for start in range(0, len(patron_ids), _MAX_SQL_PARAMETERS):
+        chunk = patron_ids[start:start + _MAX_SQL_PARAMETERS]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT br.id, br.patron_id, br.book_id, br.due_date, b.title
+            FROM borrow_records br
+            JOIN books b ON br.book_id = b.id
+            WHERE br.patron_id IN ({placeholders}) AND br.return_date IS NULL AND br.due_date < ?
+        ''', (*chunk, due_before.isoformat())).fetchall()
+        loans.extend(dict(row) for row in rows)
+    conn.close()
+    return loans
+
+# Outcomes of borrow_book()
+BORROWED = 'borrowed'
+BOOK_NOT_FOUND = 'book_not_found'
+BOOK_UNAVAILABLE = 'book_unavailable'
+BORROW_LIMIT_REACHED = 'borrow_limit_reached'
+
+def _borrow_failure(conn, book_id: int) -> Tuple[str, Optional[Dict]]:
+    # Nothing changed; work out why for the caller
+    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+    if book is None:
+        return BOOK_NOT_FOUND, None
+    if book['available_copies'] <= 0:
+        return BOOK_UNAVAILABLE, dict(book)
+    return BORROW_LIMIT_REACHED, dict(book)
+
+def borrow_book(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                max_borrowed: int = 5) -> Tuple[str, Optional[Dict]]:
+    """
+    Borrow a book in a single transaction.
+
+    The decrement only happens while a copy is available and the patron is
+    under the borrowing limit, so concurrent borrowers can never drive
+    available_copies below zero, and the borrow record is written in the
+    same commit.
+
+    Returns:
+        tuple: (outcome: one of the outcome constants above, book: dict or None)
+    """
+    with transaction() as conn:
+        book = conn.execute('''
+            UPDATE books SET available_copies = available_copies - 1
+            WHERE id = ? AND available_copies > 0
+              AND (SELECT COUNT(*) FROM borrow_records
+                   WHERE patron_id = ? AND return_date IS NULL) < ?
+            RETURNING *
+        ''', (book_id, patron_id, max_borrowed)).fetchone()
+
+        if book is None:
+            return _borrow_failure(conn, book_id)
+
+        conn.execute('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+        return BORROWED, dict(book)
+
+def borrow_books(patron_id: str, book_ids: List[int], borrow_date: datetime, due_date: datetime,
+                 max_borrowed: int = 5) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Borrow several books for one patron in a single transaction.
+
+    The patron's open loans are counted once. Books are then taken in the
+    order given until the patron reaches the limit; the rest are reported
+    as BORROW_LIMIT_REACHED. All borrow records are written in one commit.
+
+    Returns:
+        list: (outcome, book: dict or None) for each book id, in order
+    """
+    results = []
+    with transaction() as conn:
+        open_loans = conn.execute('''
+            SELECT COUNT(*) FROM borrow_records
+            WHERE patron_id = ? AND return_date IS NULL
+        ''', (patron_id,)).fetchone()[0]
+
+        for book_id in book_ids:
+            book = None
+            if open_loans < max_borrowed:
+                book = conn.execute('''
+                    UPDATE books SET available_copies = available_copies - 1
+                    WHERE id = ? AND available_copies > 0
+                    RETURNING *
+                ''', (book_id,)).fetchone()
+            if book is None:
+                results.append(_borrow_failure(conn, book_id))
+                continue
+            open_loans += 1
+            results.append((BORROWED, dict(book)))
+
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', [(patron_id, book['id'], borrow_date.isoformat(), due_date.isoformat())
+              for outcome, book in results if outcome == BORROWED])
+    return results
+
+# Outcomes of return_book()
+RETURNED = 'returned'
+NOT_BORROWED = 'not_borrowed'
+
+def _close_loan(conn, patron_id: str, book_id: int, return_date: datetime,
+                late_fee: Callable[[datetime, datetime], float]) -> Tuple[str, Optional[Dict]]:
+    book = conn.execute('SELECT title FROM books WHERE id = ?', (book_id,)).fetchone()
+    if book is None:
+        return BOOK_NOT_FOUND, None
+
+    record = conn.execute('''
+        UPDATE borrow_records SET return_date = ?
+        WHERE id = (
+            SELECT id FROM borrow_records
+            WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+            ORDER BY borrow_date
+            LIMIT 1
+        )
+        RETURNING id, due_date
+    ''', (return_date.isoformat(), patron_id, book_id)).fetchone()
+    if record is None:
+        return NOT_BORROWED, None
+
+    conn.execute('UPDATE books SET available_copies = available_copies + 1 WHERE id = ?', (book_id,))
+    due_date = datetime.fromisoformat(record['due_date'])
+    fee = late_fee(due_date, return_date)
+    conn.execute('UPDATE borrow_records SET late_fee = ? WHERE id = ?', (fee, record['id']))
+
+    return RETURNED, {'title': book['title'], 'due_date': due_date, 'late_fee': fee}
+
+def return_book(patron_id: str, book_id: int, return_date: datetime,
+                late_fee: Callable[[datetime, datetime], float]) -> Tuple[str, Optional[Dict]]:
+    """
+    Return a borrowed book in a single transaction.
+
+    Closes the patron's oldest open loan of the book, restores one copy and
+    stores the late fee, computed by late_fee(due_date, return_date) from
+    the due date the UPDATE itself returns.
+
+    Returns:
+        tuple: (outcome: RETURNED, BOOK_NOT_FOUND or NOT_BORROWED,
+                info: dict with title, due_date and late_fee, or None)
+    """
+    with transaction() as conn:
+        return _close_loan(conn, patron_id, book_id, return_date, late_fee)
+
+def return_books(patron_id: str, book_ids: List[int], return_date: datetime,
+                 late_fee: Callable[[datetime, datetime], float]) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Return several books for one patron in a single transaction.
+
+    Each book is handled as by return_book(); a book returned twice in
+    the same batch closes two loans if the patron has them.
+
+    Returns:
+        list: (outcome, info) for each book id, in order
+    """
+    with transaction() as conn:
+        return [_close_loan(conn, patron_id, book_id, return_date, late_fee) for book_id in book_ids]
+
 #Add a function for getting a borrowing_history by patron_id
-def get_patron_borrowing_history(patron_id: str) -> List[Dict]:
-    """Get complete borrowing history for a patron (including returned books)."""
+def get_patron_borrowing_history(patron_id: str, limit: Optional[int] = None) -> List[Dict]:
+    """Get borrowing history for a patron (including returned books), most recent first, optionally only the latest `limit` records."""
     conn = get_db_connection()
     records = conn.execute('''
         SELECT br.*, b.title, b.author 
@@ -210,7 +1350,8 @@ def get_patron_borrowing_history(patron_id: str) -> List[Dict]:
         JOIN books b ON br.book_id = b.id 
         WHERE br.patron_id = ?
         ORDER BY br.borrow_date DESC
-    ''', (patron_id,)).fetchall()
+        LIMIT ?
+    ''', (patron_id, -1 if limit is None else limit)).fetchall()
     conn.close()
     
     borrowing_history = []
@@ -227,4 +1368,335 @@ def get_patron_borrowing_history(patron_id: str) -> List[Dict]:
                         (datetime.fromisoformat(record['return_date']) > datetime.fromisoformat(record['due_date']))
         })
     
-    return borrowing_history
\ No newline at end of file
+    return borrowing_history
+
+# Payment statuses in the payments ledger
+PAYMENT_PENDING = 'pending'
+PAYMENT_COMPLETED = 'completed'
+PAYMENT_FAILED = 'failed'
+PAYMENT_UNKNOWN = 'unknown'   # Claimed but never answered; needs reconciliation
+
+# Seconds after which a pending payment is assumed to belong to a process
+# that died before recording the gateway's answer
+PAYMENT_CLAIM_TIMEOUT = 600.0
+
+def _mark_abandoned_claims(conn, now: datetime, claim_timeout: float,
+                           idempotency_key: Optional[str] = None) -> None:
+    """Mark payments pending for longer than claim_timeout (all, or one key) as PAYMENT_UNKNOWN."""
+    query = '''
+        UPDATE payments SET status = ?, message = ?, updated_at = ?
+        WHERE status = ? AND claimed_at < ?
+    '''
+    params: Tuple = (PAYMENT_UNKNOWN, "No answer from the gateway was recorded for this payment.", now.isoformat(),
+                     PAYMENT_PENDING, (now - timedelta(seconds=claim_timeout)).isoformat())
+    if idempotency_key is not None:
+        query += ' AND idempotency_key = ?'
+        params += (idempotency_key,)
+    conn.execute(query, params)
+
+def claim_payment(idempotency_key: str, patron_id: str, book_id: Optional[int], amount: float,
+                  claim_timeout: float = PAYMENT_CLAIM_TIMEOUT,
+                  loan_charges: Optional[Dict[int, float]] = None) -> Tuple[Dict, bool]:
+    """
+    Record a payment as pending before it is sent to the gateway.
+
+    A key that is new, or whose earlier attempt failed, is claimed for this
+    attempt. Any other key returns the payment already recorded under it, so
+    a retried request never reaches the gateway twice.
+
+    loan_charges ({borrow record id: amount}) records which loans' late fees
+    the payment covers (see get_late_fee_charges()), replacing those of an
+    earlier attempt.
+
+    A key left pending for longer than claim_timeout is marked
+    PAYMENT_UNKNOWN: the charge may or may not have gone through, so it is
+    not sent again until reconcile_payment() has settled it.
+
+    Returns:
+        tuple: (payment: dict, claimed: bool) - send the charge only if claimed is True
+    """
+    now = datetime.now()
+    with transaction() as conn:
+        _mark_abandoned_claims(conn, now, claim_timeout, idempotency_key)
+
+        payment = conn.execute('''
+            INSERT INTO payments (idempotency_key, patron_id, book_id, amount, status, created_at, updated_at, claimed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) DO UPDATE SET
+                book_id = excluded.book_id, amount = excluded.amount, status = excluded.status,
+                transaction_id = NULL, message = NULL, updated_at = excluded.updated_at,
+                claimed_at = excluded.claimed_at
+            WHERE payments.status = ? AND payments.patron_id = excluded.patron_id
+            RETURNING *
+        ''', (idempotency_key, patron_id, book_id, amount, PAYMENT_PENDING,
+              now.isoformat(), now.isoformat(), now.isoformat(), PAYMENT_FAILED)).fetchone()
+        if payment is not None:
+            conn.execute('DELETE FROM late_fee_charges WHERE payment_id = ?', (payment['id'],))
+            conn.executemany('''
+                INSERT INTO late_fee_charges (payment_id, borrow_record_id, amount) VALUES (?, ?, ?)
+            ''', [(payment['id'], loan_id, charge) for loan_id, charge in (loan_charges or {}).items()])
+            return dict(payment), True
+
+        payment = conn.execute(
+            'SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)
+        ).fetchone()
+        return dict(payment), False
+
+def get_unknown_payments(claim_timeout: float = PAYMENT_CLAIM_TIMEOUT) -> List[Dict]:
+    """
+    Get the payments waiting for reconciliation, oldest first.
+
+    Pending claims older than claim_timeout are marked PAYMENT_UNKNOWN
+    first, so payments abandoned by a crash are listed even if no request
+    ever comes back with their key.
+    """
+    with transaction() as conn:
+        _mark_abandoned_claims(conn, datetime.now(), claim_timeout)
+        payments = conn.execute('''
+            SELECT * FROM payments WHERE status = ? ORDER BY claimed_at
+        ''', (PAYMENT_UNKNOWN,)).fetchall()
+    return [dict(payment) for payment in payments]
+
+def get_late_fee_charges(loan_ids: List[int]) -> Dict[int, Dict[str, float]]:
+    """
+    Get what payments have charged for the late fees of loans.
+
+    Failed payments charged nothing and are left out. Pending and unknown
+    ones are counted, since their charge may have gone through.
+
+    Returns:
+        dict: {borrow record id: {payment idempotency key: amount}}
+    """
+    conn = get_db_connection()
+    charges: Dict[int, Dict[str, float]] = {}
+    for start in range(0, len(loan_ids), _MAX_SQL_PARAMETERS):
+        chunk = loan_ids[start:start + _MAX_SQL_PARAMETERS]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT c.borrow_record_id, p.idempotency_key, c.amount
+            FROM late_fee_charges c
+            JOIN payments p ON p.id = c.payment_id
+            WHERE c.borrow_record_id IN ({placeholders}) AND p.status != ?
+        ''', (*chunk, PAYMENT_FAILED)).fetchall()
+        for row in rows:
+            charges.setdefault(row['borrow_record_id'], {})[row['idempotency_key']] = row['amount']
+    conn.close()
+    return charges
+
+def finish_payment(idempotency_key: str, status: str, transaction_id: Optional[str], message: str) -> bool:
+    """Store the gateway's answer for a pending payment."""
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        UPDATE payments SET status = ?, transaction_id = ?, message = ?, updated_at = ?
+        WHERE idempotency_key = ?
+    ''', (status, transaction_id, message, datetime.now().isoformat(), idempotency_key))
+    conn.commit()
+    conn.close()
+    return cursor.rowcount > 0
+
+def get_payment_by_key(idempotency_key: str) -> Optional[Dict]:
+    """Get the payment recorded under an idempotency key."""
+    conn = get_db_connection()
+    payment = conn.execute(
+        'SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)
+    ).fetchone()
+    conn.close()
+    return dict(payment) if payment else None
+
+def get_payment_by_transaction(transaction_id: str) -> Optional[Dict]:
+    """Get the completed payment with a gateway transaction ID (the latest, should the gateway reuse one)."""
+    conn = get_db_connection()
+    payment = conn.execute('''
+        SELECT * FROM payments
+        WHERE transaction_id = ? AND status = ?
+        ORDER BY id DESC
+        LIMIT 1
+    ''', (transaction_id, PAYMENT_COMPLETED)).fetchone()
+    conn.close()
+    return dict(payment) if payment else None
+
+def get_patron_payments(patron_id: str) -> List[Dict]:
+    """Get the payments recorded for a patron, most recent first."""
+    conn = get_db_connection()
+    payments = conn.execute('''
+        SELECT * FROM payments
+        WHERE patron_id = ?
+        ORDER BY created_at DESC
+    ''', (patron_id,)).fetchall()
+    conn.close()
+    return [dict(payment) for payment in payments]
+
+def reserve_refund(payment_id: int, amount: float) -> bool:
+    """
+    Count a refund against a payment before it is sent to the gateway.
+
+    Fails if the payment has less than `amount` left to refund, so concurrent
+    refunds can never return more than was paid. Call release_refund() if the
+    gateway then refuses the refund.
+    """
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        UPDATE payments SET refunded_amount = refunded_amount + ?, updated_at = ?
+        WHERE id = ? AND refunded_amount + ? <= amount + 0.005
+    ''', (amount, datetime.now().isoformat(), payment_id, amount))
+    conn.commit()
+    conn.close()
+    return cursor.rowcount > 0
+
+def release_refund(payment_id: int, amount: float) -> None:
+    """Undo a reserve_refund() whose refund did not go through."""
+    conn = get_db_connection()
+    conn.execute('''
+        UPDATE payments SET refunded_amount = MAX(refunded_amount - ?, 0), updated_at = ?
+        WHERE id = ?
+    ''', (amount, datetime.now().isoformat(), payment_id))
+    conn.commit()
+    conn.close()
+
+def claim_refund(idempotency_key: str, transaction_id: str, amount: float) -> Tuple[Dict, bool]:
+    """
+    Record a refund as pending before it is sent to the gateway.
+
+    Works like claim_payment(): a new key, or one whose earlier attempt
+    failed, is claimed; any other key returns the refund already recorded.
+
+    Returns:
+        tuple: (refund: dict, claimed: bool) - send the refund only if claimed is True
+    """
+    now = datetime.now().isoformat()
+    with transaction() as conn:
+        refund = conn.execute('''
+            INSERT INTO refunds (idempotency_key, transaction_id, amount, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) DO UPDATE SET
+                status = excluded.status, message = NULL, updated_at = excluded.updated_at
+            WHERE refunds.status = ? AND refunds.transaction_id = excluded.transaction_id
+                AND refunds.amount = excluded.amount
+            RETURNING *
+        ''', (idempotency_key, transaction_id, amount, PAYMENT_PENDING, now, now, PAYMENT_FAILED)).fetchone()
+        if refund is not None:
+            return dict(refund), True
+
+        refund = conn.execute(
+            'SELECT * FROM refunds WHERE idempotency_key = ?', (idempotency_key,)
+        ).fetchone()
+        return dict(refund), False
+
+def finish_refund(idempotency_key: str, status: str, message: str) -> None:
+    """Store the outcome of a pending refund (PAYMENT_COMPLETED or PAYMENT_FAILED)."""
+    conn = get_db_connection()
+    conn.execute('''
+        UPDATE refunds SET status = ?, message = ?, updated_at = ?
+        WHERE idempotency_key = ?
+    ''', (status, message, datetime.now().isoformat(), idempotency_key))
+    conn.commit()
+    conn.close()
+
+# Job statuses in the jobs queue
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+def enqueue_job(kind: str, payload: Dict) -> int:
+    """Add a job to the queue. Returns the job ID."""
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        INSERT INTO jobs (kind, payload, status, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (kind, json.dumps(payload), JOB_QUEUED, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+    return cursor.lastrowid
+
+def claim_next_job(worker: str, lease_seconds: float = 300.0,
+                   max_attempts: Optional[int] = None) -> Optional[Dict]:
+    """
+    Take the oldest waiting job for a worker.
+
+    A job that has been running for longer than lease_seconds is assumed to
+    belong to a worker that died and is handed out again, unless it has
+    already been tried max_attempts times: then it is marked failed. The
+    claim is a single UPDATE, so two workers can never take the same job.
+
+    Returns:
+        dict: The job with its payload decoded, or None if the queue is empty
+    """
+    now = datetime.now()
+    lease_start = (now - timedelta(seconds=lease_seconds)).isoformat()
+    with transaction() as conn:
+        if max_attempts is not None:
+            conn.execute('''
+                UPDATE jobs SET status = ?, result = ?, finished_at = ?
+                WHERE status = ? AND started_at < ? AND attempts >= ?
+            ''', (JOB_FAILED, json.dumps({'success': False, 'message': f"Job failed: gave up after {max_attempts} attempts"}),
+                  now.isoformat(), JOB_RUNNING, lease_start, max_attempts))
+        job = conn.execute('''
+            UPDATE jobs SET status = ?, worker = ?, started_at = ?, attempts = attempts + 1
+            WHERE id = COALESCE(
+                (SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1),
+                (SELECT id FROM jobs WHERE status = ? AND started_at < ? ORDER BY id LIMIT 1)
+            )
+            RETURNING *
+        ''', (JOB_RUNNING, worker, now.isoformat(), JOB_QUEUED, JOB_RUNNING, lease_start)).fetchone()
+    if job is None:
+        return None
+    job = dict(job)
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+def finish_job(job_id: int, status: str, result: Any, worker: str, attempts: int) -> bool:
+    """
+    Store the outcome of a job (JOB_COMPLETED or JOB_FAILED).
+
+    Only the claim that is still current can finish the job: pass the worker
+    and attempts of the claimed job. A worker whose lease ran out and whose
+    job was handed to another worker gets False and its result is dropped.
+    """
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        UPDATE jobs SET status = ?, result = ?, finished_at = ?
+        WHERE id = ? AND status = ? AND worker = ? AND attempts = ?
+    ''', (status, json.dumps(result), datetime.now().isoformat(), job_id, JOB_RUNNING, worker, attempts))
+    conn.commit()
+    conn.close()
+    return cursor.rowcount > 0
+
+def save_worker_stats(worker: str, stats: Dict) -> None:
+    """Store the latest stats of a worker process, replacing its previous report."""
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO worker_stats (worker, stats, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (worker) DO UPDATE SET stats = excluded.stats, updated_at = excluded.updated_at
+    ''', (worker, json.dumps(stats), datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+def get_worker_stats(max_age_seconds: float) -> Dict[str, Dict]:
+    """
+    Get the stats reported by worker processes in the last max_age_seconds.
+
+    Returns:
+        dict: worker name -> its stats, with the time of the report as updated_at
+    """
+    since = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT worker, stats, updated_at FROM worker_stats
+        WHERE updated_at >= ?
+        ORDER BY worker
+    ''', (since,)).fetchall()
+    conn.close()
+    return {row['worker']: dict(json.loads(row['stats']), updated_at=row['updated_at']) for row in rows}
+
+def get_job(job_id: int) -> Optional[Dict]:
+    """Get a job by ID, with its payload and result decoded."""
+    conn = get_db_connection()
+    job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    if job is None:
+        return None
+    job = dict(job)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] is not None else None
+    return job
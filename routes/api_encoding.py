@@ -0,0 +1,164 @@
+"""
+API Encoding - JSON serialization, field projection and response compression
+"""
+
+import csv
+import gzip
+import io
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib json module is used without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is offered without it
+    brotli = None
+
+# Responses smaller than this are sent as they are: compressing them saves
+# fewer bytes than the Content-Encoding header and the CPU cost are worth
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5   # Close to gzip -6 in speed, noticeably smaller output
+CONTENT_CODINGS = ('br', 'gzip')
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/csv', 'text/plain', 'application/x-ndjson')
+
+# Fields of a book that API clients can select with ?fields=
+BOOK_FIELDS = ('id', 'title', 'author', 'isbn', 'total_copies', 'available_copies')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that serializes with orjson when it is installed.
+    
+    The output decodes to the same values as the default provider's: keys
+    are sorted, and dates, decimals and dataclasses go through the same
+    default() conversion. It is not byte for byte the same: non-ASCII text
+    is written as UTF-8 instead of \\u escapes, and NaN and infinity become
+    null. Objects orjson cannot encode (such as integers over 64 bits) fall
+    back to the stdlib encoder.
+    """
+    
+    def _orjson_dumps(self, obj) -> Optional[bytes]:
+        if orjson is None:
+            return None
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return None
+    
+    def dumps(self, obj, **kwargs) -> str:
+        data = None if kwargs else self._orjson_dumps(obj)
+        if data is None:
+            return super().dumps(obj, **kwargs)
+        return data.decode()
+    
+    def response(self, *args, **kwargs):
+        # Pretty-printed output (debug mode) is left to the default provider
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        data = self._orjson_dumps(self._prepare_response_obj(args, kwargs))
+        if data is None:
+            return super().response(*args, **kwargs)
+        # The default provider ends responses with a newline as well
+        return self._app.response_class(data + b"\n", mimetype=self.mimetype)
+
+
+def parse_fields(value: Optional[str], allowed: Iterable[str] = BOOK_FIELDS) -> Optional[List[str]]:
+    """
+    Parse a comma-separated fields= parameter.
+    
+    Returns:
+        list: Requested fields in the order given, or None for all fields
+    
+    Raises:
+        ValueError: If a field is not one of `allowed`
+    """
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return fields or None
+
+def project_fields(rows: List[Dict], fields: Optional[List[str]]) -> List[Dict]:
+    """Keep only the given fields of each row (all of them if fields is None)."""
+    if fields is None:
+        return rows
+    return [{field: row[field] for field in fields} for row in rows]
+
+
+def ndjson_chunks(batches: Iterable[List[Dict]], dumps: Callable[[Dict], str]) -> Iterator[str]:
+    """Encode batches of rows as newline-delimited JSON, one chunk per batch."""
+    for batch in batches:
+        yield ''.join(dumps(row) + '\n' for row in batch)
+
+def csv_chunks(batches: Iterable[List[Dict]], columns: Sequence[str]) -> Iterator[str]:
+    """Encode batches of rows as CSV with a header row, one chunk per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([row[column] for column in columns] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # Header of an empty export
+
+
+def negotiate_encoding() -> Optional[str]:
+    """Pick the best content coding the client accepts: br, then gzip."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+def compress_response(response):
+    """
+    Compress a response body with gzip or brotli, as negotiated through
+    Accept-Encoding. Streamed, small and non-text responses are left alone.
+    
+    A compressed response gets its own ETag (the original with "-br" or
+    "-gzip" appended), as a strong ETag must change with the bytes sent.
+    """
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    
+    etag, weak = response.get_etag()
+    if response.status_code == 304:
+        # The client revalidates the compressed copy it holds
+        if etag and f'{etag}-{encoding}' in request.if_none_match:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+    
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+    
+    response.set_data(_compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
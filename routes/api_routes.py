@@ -2,11 +2,29 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from services.library_service import calculate_late_fee_for_book, search_books_in_catalog
+from datetime import datetime
+from flask import Blueprint, Response, current_app, jsonify, request, url_for
+from database import (
+    BORROW_RECORD_FIELDS, MAX_SQL_INTEGER, book_cache, iter_books, iter_borrow_records
+)
+from routes.api_encoding import (
+    BOOK_FIELDS, compress_response, csv_chunks, ndjson_chunks, parse_fields, project_fields
+)
+from routes.fragment_cache import catalog_row_cache
+from routes.http_cache import cached_by_catalog_version
+from services.job_service import (
+    enqueue_late_fee_payment, enqueue_refund, get_gateway_stats_by_worker, get_job_status
+)
+from services.library_service import (
+    borrow_books_by_patron, calculate_late_fee_for_book, return_books_by_patron, search_books_in_catalog
+)
+from services.payment_service import get_payment_gateway, payment_status_cache
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# gzip/brotli for clients that accept it (see api_encoding)
+api_bp.after_request(compress_response)
+
 @api_bp.route('/late_fee/<patron_id>/<int:book_id>')
 def get_late_fee(patron_id, book_id):
     """
@@ -17,23 +35,213 @@ def get_late_fee(patron_id, book_id):
     return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
 
 @api_bp.route('/search')
+@cached_by_catalog_version
 def search_books_api():
     """
     Search for books via API endpoint.
     Alternative API interface for R5: Book Search Functionality
+    Optional fields=id,title,... limits each result to those fields.
+    Results come limit at a time (default 100); offset=N skips the first
+    N, and has_more tells whether there are more after this page.
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    limit = request.args.get('limit', 100, type=int)
+    offset = request.args.get('offset', 0, type=int)
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
     
-    # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    if not 1 <= limit <= 1000:
+        return jsonify({'error': 'Limit must be between 1 and 1000'}), 400
+    
+    if not 0 <= offset <= MAX_SQL_INTEGER:
+        return jsonify({'error': 'Offset must be a non-negative integer'}), 400
+    
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Use business logic function; one extra row tells whether there are more
+    books = search_books_in_catalog(search_term, search_type, limit + 1, offset)
+    has_more = len(books) > limit
+    books = books[:limit]
     
     return jsonify({
         'search_term': search_term,
         'search_type': search_type,
-        'results': books,
-        'count': len(books)
+        'results': project_fields(books, fields),
+        'count': len(books),
+        'offset': offset,
+        'has_more': has_more
+    })
+
+@api_bp.route('/metrics')
+def metrics_api():
+    """
+    Runtime metrics: payment gateway circuit breaker state, per-method
+    gateway latency histograms and error counters, and cache hit rates
+    (with the time spent rendering catalog rows).
+    
+    Payments run in the job workers, so their gateway stats, as last
+    reported by each worker, are under payment_workers; payment_gateway
+    only covers calls made by this web process.
+    """
+    return jsonify({
+        'payment_gateway': get_payment_gateway().stats(),
+        'payment_workers': get_gateway_stats_by_worker(),
+        'payment_status_cache': payment_status_cache.stats(),
+        'book_cache': book_cache.stats(),
+        'catalog_row_cache': catalog_row_cache.stats()
     })
+
+def _batch_request():
+    """Read patron_id and book_ids from a batch request, or None if malformed."""
+    data = request.get_json(silent=True) or {}
+    patron_id = data.get('patron_id')
+    book_ids = data.get('book_ids')
+    if (not isinstance(patron_id, str) or not isinstance(book_ids, list)
+            or not all(isinstance(book_id, int) and not isinstance(book_id, bool) for book_id in book_ids)):
+        return None
+    return patron_id, book_ids
+
+def _batch_response(patron_id, result):
+    success, message, results = result
+    if not success:
+        return jsonify({'error': message}), 400
+    return jsonify({'patron_id': patron_id, 'message': message, 'results': results})
+
+@api_bp.route('/borrow/batch', methods=['POST'])
+def borrow_batch():
+    """
+    Borrow several books for one patron. Expects JSON with patron_id and
+    book_ids; answers with a result per book, in the same order.
+    """
+    batch = _batch_request()
+    if batch is None:
+        return jsonify({'error': 'patron_id (string) and book_ids (list of integers) are required'}), 400
+    return _batch_response(batch[0], borrow_books_by_patron(*batch))
+
+@api_bp.route('/return/batch', methods=['POST'])
+def return_batch():
+    """
+    Return several books for one patron. Expects JSON with patron_id and
+    book_ids; answers with a result per book, in the same order.
+    """
+    batch = _batch_request()
+    if batch is None:
+        return jsonify({'error': 'patron_id (string) and book_ids (list of integers) are required'}), 400
+    return _batch_response(batch[0], return_books_by_patron(*batch))
+
+def _job_accepted(job_id):
+    """202 response pointing the client at the job status route."""
+    status_url = url_for('api.payment_job_status', job_id=job_id)
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@api_bp.route('/payments', methods=['POST'])
+def queue_late_fee_payment():
+    """
+    Queue a late fee payment. Expects JSON with patron_id and book_id.
+    An Idempotency-Key header (or idempotency_key field) makes repeated
+    requests resolve to the same charge.
+    """
+    data = request.get_json(silent=True) or {}
+    patron_id = data.get('patron_id')
+    book_id = data.get('book_id')
+    if not isinstance(patron_id, str) or not isinstance(book_id, int) or isinstance(book_id, bool):
+        return jsonify({'error': 'patron_id (string) and book_id (integer) are required'}), 400
+    
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    return _job_accepted(enqueue_late_fee_payment(patron_id, book_id, idempotency_key))
+
+@api_bp.route('/refunds', methods=['POST'])
+def queue_refund():
+    """
+    Queue a late fee refund. Expects JSON with transaction_id and amount,
+    and takes an Idempotency-Key header like /api/payments.
+    """
+    data = request.get_json(silent=True) or {}
+    transaction_id = data.get('transaction_id')
+    amount = data.get('amount')
+    if (not isinstance(transaction_id, str) or not isinstance(amount, (int, float))
+            or isinstance(amount, bool)):
+        return jsonify({'error': 'transaction_id (string) and amount (number) are required'}), 400
+    
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    return _job_accepted(enqueue_refund(transaction_id, float(amount), idempotency_key))
+
+@api_bp.route('/payments/<int:job_id>')
+def payment_job_status(job_id):
+    """Poll a queued payment or refund job."""
+    job = get_job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+def _export_response(batches, columns, name):
+    """
+    Stream an export as NDJSON (the default) or CSV (format=csv). Rows are
+    encoded batch by batch as the client reads them.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format == 'csv':
+        chunks, mimetype = csv_chunks(batches, columns), 'text/csv'
+    else:
+        chunks, mimetype = ndjson_chunks(batches, current_app.json.dumps), 'application/x-ndjson'
+    response = Response(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{export_format}'
+    return response
+
+def _export_args(allow_since=True):
+    """
+    Parse the shared export parameters, returning (args, error response).
+    since is only accepted where allow_since is true. Everything is checked
+    here, before streaming starts and an error can no longer be returned.
+    """
+    if request.args.get('format', 'ndjson') not in ('ndjson', 'csv'):
+        return None, (jsonify({'error': 'format must be ndjson or csv'}), 400)
+    try:
+        since_id = int(request.args.get('since_id', 0))
+    except ValueError:
+        since_id = -1
+    if not 0 <= since_id <= MAX_SQL_INTEGER:
+        return None, (jsonify({'error': 'since_id must be a non-negative 64-bit integer'}), 400)
+    since = request.args.get('since')
+    if since is not None and not allow_since:
+        return None, (jsonify({'error': 'since is not supported for this export'}), 400)
+    if since:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return None, (jsonify({'error': 'since must be an ISO 8601 date or datetime'}), 400)
+        if since.tzinfo is not None:
+            # Loan dates are stored as naive local times
+            since = since.astimezone().replace(tzinfo=None)
+    return {'since_id': since_id, 'since': since or None}, None
+
+@api_bp.route('/export/books')
+def export_books():
+    """
+    Export the catalog in id order. since_id=N only exports books added
+    after book N, for incremental pulls.
+    """
+    args, error = _export_args(allow_since=False)
+    if error:
+        return error
+    return _export_response(iter_books(args['since_id']), BOOK_FIELDS, 'books')
+
+@api_bp.route('/export/borrow_records')
+def export_borrow_records():
+    """
+    Export the loan history in id order. since_id=N only exports records
+    after record N; since=<ISO datetime> only those borrowed or returned
+    from then on (server local time unless the datetime has an offset).
+    """
+    args, error = _export_args()
+    if error:
+        return error
+    batches = iter_borrow_records(args['since_id'], args['since'])
+    return _export_response(batches, BORROW_RECORD_FIELDS, 'borrow_records')
@@ -2,25 +2,81 @@
 Catalog Routes - Book catalog related endpoints
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
+import base64
+import binascii
+import json
+from flask import (
+    Blueprint, render_template, stream_template, request, redirect, url_for, flash,
+    get_flashed_messages, current_app
+)
+from database import MAX_SQL_INTEGER, get_books_page
+from routes.fragment_cache import catalog_row_cache
+from routes.http_cache import cached_by_catalog_version
 from services.library_service import add_book_to_catalog
 
 catalog_bp = Blueprint('catalog', __name__)
 
+# Catalog page sizes
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+def encode_cursor(cursor):
+    """Encode a (title, id) keyset cursor as an opaque URL-safe token."""
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode()).decode()
+
+def decode_cursor(token):
+    """Decode a cursor token, returning None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        title, book_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if not isinstance(title, str) or not isinstance(book_id, int) or isinstance(book_id, bool):
+        return None
+    # Ids SQLite cannot bind would fail in the query
+    if not 0 <= book_id <= MAX_SQL_INTEGER:
+        return None
+    return title, book_id
+
+def render_catalog_row(book):
+    """
+    Render the catalog table row of a book, from the fragment cache when
+    the book is unchanged since the row was last rendered.
+    """
+    key = (book['id'], book['available_copies'], book['total_copies'],
+           book['title'], book['author'], book['isbn'], request.script_root)
+    template = current_app.jinja_env.get_template('_catalog_row.html')
+    return catalog_row_cache.render(key, lambda: template.render(book=book))
+
 @catalog_bp.route('/')
 def index():
     """Home page redirects to catalog."""
     return redirect(url_for('catalog.catalog'))
 
 @catalog_bp.route('/catalog')
+@cached_by_catalog_version
 def catalog():
     """
-    Display all books in the catalog.
+    Display the books in the catalog, one page at a time.
     Implements R2: Book Catalog Display
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    cursor = decode_cursor(request.args.get('cursor'))
+    
+    books, next_cursor = get_books_page(cursor, per_page)
+    next_url = None
+    if next_cursor:
+        next_url = url_for('catalog.catalog', cursor=encode_cursor(next_cursor), per_page=per_page)
+    
+    # Pop flashed messages before streaming starts: the session cookie is
+    # sent with the headers, before the template gets to read them.
+    get_flashed_messages(with_categories=True)
+    
+    return stream_template('catalog.html', books=books, next_url=next_url,
+                           is_first_page=cursor is None, per_page=per_page,
+                           render_row=render_catalog_row)
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
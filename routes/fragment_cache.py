@@ -0,0 +1,52 @@
+"""
+Fragment Cache - Rendered template fragments kept in memory
+"""
+
+import time
+from typing import Callable, Dict, Hashable
+from markupsafe import Markup
+from caching import LRUCache
+
+FRAGMENT_CACHE_SIZE = 4096   # Rendered fragments kept in memory per process
+
+
+class FragmentCache(LRUCache):
+    """
+    In-process LRU cache of rendered HTML fragments.
+    
+    Entries never go stale: the key holds every value the fragment is
+    rendered from, so a changed book simply gets a new key and its old
+    fragment falls out of the LRU. Time spent rendering misses is counted
+    so the metrics show how much template work the cache saves.
+    """
+    
+    def __init__(self, max_size: int = FRAGMENT_CACHE_SIZE):
+        super().__init__(max_size)
+        self.render_seconds = 0.0
+    
+    def render(self, key: Hashable, render: Callable[[], str]) -> Markup:
+        """Get the fragment for a key, rendering it with render() on a miss."""
+        fragment = self.get(key)
+        if fragment is not None:
+            return fragment
+        
+        # Render outside the lock; two threads missing the same key at once
+        # both render it, which is harmless
+        start = time.perf_counter()
+        fragment = Markup(render())
+        elapsed = time.perf_counter() - start
+        
+        with self._lock:
+            self.render_seconds += elapsed
+            self._put(key, fragment)
+        return fragment
+    
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._lock:
+            stats['render_seconds'] = round(self.render_seconds, 6)
+            stats['avg_render_ms'] = round(self.render_seconds * 1000 / self.misses, 4) if self.misses else 0.0
+        return stats
+
+# Rendered rows of the catalog table
+catalog_row_cache = FragmentCache()
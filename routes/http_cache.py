@@ -0,0 +1,83 @@
+"""
+HTTP Caching - Conditional responses for pages that only depend on the catalog
+"""
+
+import hashlib
+import os
+from functools import wraps
+from flask import Response, make_response, request, session
+from database import get_catalog_version
+from routes.api_encoding import CONTENT_CODINGS
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSET_DIRS = ('templates', 'static')
+
+def deploy_token(root: str = _APP_ROOT) -> str:
+    """
+    Hash of the templates and static files, mixed into every ETag so pages
+    rendered by an older deploy are never taken as current. It only depends
+    on the files, so every worker, host and restart of a deploy agree on it.
+    """
+    digest = hashlib.sha1()
+    for directory in ASSET_DIRS:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, directory)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                digest.update(os.path.relpath(path, root).encode())
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+_DEPLOY_TOKEN = deploy_token()
+
+# Clients and proxies may store the page but must check it is still current
+# before reusing it; a check answered with 304 costs one version lookup.
+CACHE_CONTROL = 'no-cache'
+
+def catalog_etag(version):
+    """Strong ETag for the current request URL at a catalog version."""
+    digest = hashlib.sha1(f'{_DEPLOY_TOKEN} {request.full_path}'.encode()).hexdigest()[:16]
+    return f'{version}-{digest}'
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        # If-None-Match wins over If-Modified-Since when both are sent.
+        # Compressed copies carry the ETag with the coding appended.
+        return any(request.if_none_match.contains(tag)
+                   for tag in [etag] + [f'{etag}-{coding}' for coding in CONTENT_CODINGS])
+    return request.if_modified_since is not None and last_modified <= request.if_modified_since
+
+def cached_by_catalog_version(view):
+    """
+    Make a GET view answer revalidations with 304 while books are unchanged.
+
+    The response gets a strong ETag built from the catalog version and the
+    request URL, Last-Modified set to the last change to books, and
+    Cache-Control: no-cache. The version is read before the view runs, so a
+    concurrent change can only make the ETag older than the page, never newer.
+    Requests with flashed messages still to show are not cached, since the
+    page they get differs from everyone else's.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get('_flashes'):
+            response = make_response(view(*args, **kwargs))
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        
+        version, last_modified = get_catalog_version()
+        etag = catalog_etag(version)
+        last_modified = last_modified.replace(microsecond=0)
+        if _not_modified(etag, last_modified):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
+    return wrapper
@@ -3,11 +3,20 @@ Search Routes - Book search functionality
 """
 
 from flask import Blueprint, render_template, request, flash
+from database import MAX_SQL_INTEGER
+from routes.http_cache import cached_by_catalog_version
 from services.library_service import search_books_in_catalog
 
 search_bp = Blueprint('search', __name__)
 
+# Search results shown per page
+SEARCH_PER_PAGE = 50
+
+# Last page whose offset SQLite can still bind; later pages are clamped to it
+MAX_SEARCH_PAGE = MAX_SQL_INTEGER // SEARCH_PER_PAGE
+
 @search_bp.route('/search')
+@cached_by_catalog_version
 def search_books():
     """
     Search for books in the catalog.
@@ -15,14 +24,20 @@ def search_books():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    page = min(max(request.args.get('page', 1, type=int), 1), MAX_SEARCH_PAGE)
     
     if not search_term:
-        return render_template('search.html', books=[], search_term='', search_type=search_type)
+        return render_template('search.html', books=[], search_term='', search_type=search_type,
+                               page=1, has_next=False)
     
-    # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    # Use business logic function; one extra row tells whether there is a next page
+    books = search_books_in_catalog(search_term, search_type, SEARCH_PER_PAGE + 1,
+                                    (page - 1) * SEARCH_PER_PAGE)
+    has_next = len(books) > SEARCH_PER_PAGE
+    books = books[:SEARCH_PER_PAGE]
     
     if not books:
         flash('Search functionality is not yet implemented.', 'error')
     
-    return render_template('search.html', books=books, search_term=search_term, search_type=search_type)
+    return render_template('search.html', books=books, search_term=search_term, search_type=search_type,
+                           page=page, has_next=has_next)
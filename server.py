@@ -0,0 +1,95 @@
+"""
+Production server for the Library Management System.
+
+Runs create_app() under gunicorn with several worker processes, each
+serving requests on several threads. Started with the flask CLI:
+    flask --app app serve --workers 4 --threads 8
+
+SQLite and multiple processes: every worker opens its own connections
+(the connection pool is per process and starts empty after fork), the
+database runs in WAL mode so readers in one worker never block a writer
+in another, and writes take the lock with BEGIN IMMEDIATE and wait on
+busy_timeout instead of failing. With preloading, the master process
+closes its connections before forking so no SQLite handle is shared.
+"""
+
+import multiprocessing
+import os
+from typing import Dict
+
+from database import reset_pool
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn is optional (and not available on Windows)
+    BaseApplication = None
+
+DEFAULT_BIND = '0.0.0.0:5000'
+DEFAULT_THREADS = 4
+DEFAULT_TIMEOUT = 30            # Seconds a request may take before its worker is restarted
+DEFAULT_GRACEFUL_TIMEOUT = 30   # Seconds workers get to finish requests on restart or shutdown
+DEFAULT_MAX_REQUESTS = 1000     # Requests before a worker is replaced (0 disables)
+
+
+def default_workers() -> int:
+    """Worker processes to run: WEB_CONCURRENCY if set, otherwise 2 x CPUs + 1."""
+    if os.environ.get('WEB_CONCURRENCY'):
+        return int(os.environ['WEB_CONCURRENCY'])
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def build_options(bind: str = DEFAULT_BIND, workers: int = None, threads: int = DEFAULT_THREADS,
+                  preload: bool = True, timeout: int = DEFAULT_TIMEOUT,
+                  graceful_timeout: int = DEFAULT_GRACEFUL_TIMEOUT,
+                  max_requests: int = DEFAULT_MAX_REQUESTS) -> Dict:
+    """
+    Build the gunicorn settings for serve().
+
+    Workers are replaced one by one after max_requests requests (with some
+    jitter so they do not all restart at once), which keeps memory growth in
+    check without dropping requests. Sending the master SIGHUP restarts all
+    workers gracefully, e.g. after a deploy.
+    """
+    return {
+        'bind': bind,
+        'workers': workers or default_workers(),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'preload_app': preload,
+        'timeout': timeout,
+        'graceful_timeout': graceful_timeout,
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests // 10,
+        'accesslog': '-',
+    }
+
+
+if BaseApplication is not None:
+    class LibraryServer(BaseApplication):
+        """gunicorn application that serves create_app() with the given settings."""
+
+        def __init__(self, options: Dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            from app import create_app
+            app = create_app()
+            # With preload this runs in the master: don't carry open SQLite
+            # connections into the forked workers
+            reset_pool()
+            return app
+else:
+    LibraryServer = None
+
+
+def serve(options: Dict) -> None:
+    """Run the production server until it is stopped."""
+    if LibraryServer is None:
+        raise RuntimeError("gunicorn is not installed; run `pip install gunicorn`")
+    LibraryServer(options).run()
@@ -0,0 +1,147 @@
+"""
+Fee Service Module - Late fee rules and batch fee computation
+
+Holds the R5 late fee tiers and a batch engine that applies them to many
+loans at once. The batch engine uses NumPy when it is installed and falls
+back to plain Python otherwise; both give the same results.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from database import iter_overdue_loans
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+# Late fee tiers (R5)
+FIRST_TIER_DAYS = 7        # Days charged at the first tier rate
+FIRST_TIER_RATE = 0.50     # Per day for the first 7 days overdue
+SECOND_TIER_RATE = 1.00    # Per day after that
+MAX_LATE_FEE = 15.00       # Maximum fee per book
+
+DateLike = Union[datetime, str]
+
+
+def calculate_late_fee_amount(days_overdue: int) -> float:
+    """
+    Late fee for a number of overdue days.
+    $0.50/day for the first 7 days, then $1.00/day, capped at $15.00 per book.
+    """
+    if days_overdue <= 0:
+        return 0.0
+    elif days_overdue <= FIRST_TIER_DAYS:
+        # First 7 days: $0.50 per day
+        fee_amount = days_overdue * FIRST_TIER_RATE
+    else:
+        # First 7 days, remaining days at $1.00 per day
+        fee_amount = (FIRST_TIER_DAYS * FIRST_TIER_RATE) + ((days_overdue - FIRST_TIER_DAYS) * SECOND_TIER_RATE)
+
+    # Maximum late fee 15$
+    return round(min(fee_amount, MAX_LATE_FEE), 2)
+
+
+def calculate_late_fees(due_dates: Sequence[DateLike],
+                        return_dates: Optional[Sequence[Optional[DateLike]]] = None,
+                        as_of: Optional[datetime] = None) -> Tuple[List[int], List[float]]:
+    """
+    Compute late fees for many loans at once.
+
+    Args:
+        due_dates: Due date of each loan, as datetimes or ISO 8601 strings
+        return_dates: Return date of each loan; None (or a None entry) means
+            the book is still out and is charged up to `as_of`
+        as_of: Date to charge open loans up to (default: now)
+
+    Returns:
+        tuple: (days_overdue: list of int, fee_amounts: list of float),
+               both in the order of due_dates
+    """
+    as_of = as_of or datetime.now()
+    if return_dates is None:
+        return_dates = [None] * len(due_dates)
+    if len(return_dates) != len(due_dates):
+        raise ValueError("due_dates and return_dates must have the same length")
+    if not len(due_dates):
+        return [], []
+
+    if np is not None:
+        return _calculate_late_fees_numpy(due_dates, return_dates, as_of)
+    return _calculate_late_fees_python(due_dates, return_dates, as_of)
+
+
+def _to_datetime(value: DateLike) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _calculate_late_fees_python(due_dates, return_dates, as_of):
+    days = []
+    fees = []
+    for due_date, return_date in zip(due_dates, return_dates):
+        end = _to_datetime(return_date) if return_date is not None else as_of
+        days_overdue = max((end - _to_datetime(due_date)).days, 0)
+        days.append(days_overdue)
+        fees.append(calculate_late_fee_amount(days_overdue))
+    return days, fees
+
+
+def _calculate_late_fees_numpy(due_dates, return_dates, as_of):
+    # NumPy parses ISO 8601 strings itself, so string columns straight from
+    # SQLite never go through datetime objects
+    due = np.array(due_dates, dtype='datetime64[us]')
+    if all(return_date is None for return_date in return_dates):
+        end = np.datetime64(as_of, 'us')
+    else:
+        end = np.array(
+            [as_of if return_date is None else return_date for return_date in return_dates],
+            dtype='datetime64[us]'
+        )
+
+    # Whole days, rounded down like timedelta.days
+    days = np.maximum((end - due) // np.timedelta64(1, 'D'), 0).astype(np.int64)
+
+    first_tier = FIRST_TIER_DAYS * FIRST_TIER_RATE
+    fees = np.where(
+        days <= FIRST_TIER_DAYS,
+        days * FIRST_TIER_RATE,
+        first_tier + (days - FIRST_TIER_DAYS) * SECOND_TIER_RATE
+    )
+    fees = np.round(np.minimum(fees, MAX_LATE_FEE), 2)
+    return days.tolist(), fees.tolist()
+
+
+def compute_all_outstanding_fees(as_of: Optional[datetime] = None,
+                                 batch_size: int = 10000) -> Iterator[Dict]:
+    """
+    Stream the late fee owed on every overdue open loan.
+
+    Loans are read from borrow_records in batches and each batch is priced
+    in one calculate_late_fees() call, so memory use stays flat no matter
+    how many loans are open.
+
+    Args:
+        as_of: Date to charge fees up to (default: now)
+        batch_size: Number of loans read and priced at a time
+
+    Yields:
+        dict: record_id, patron_id, book_id, due_date, days_overdue, fee_amount
+              for each loan with a fee greater than zero
+    """
+    as_of = as_of or datetime.now()
+    # A loan owes nothing until it is at least one whole day overdue
+    overdue_before = as_of - timedelta(days=1)
+
+    for batch in iter_overdue_loans(overdue_before, batch_size):
+        days, fees = calculate_late_fees([loan['due_date'] for loan in batch], as_of=as_of)
+        for loan, days_overdue, fee_amount in zip(batch, days, fees):
+            if fee_amount > 0:
+                yield {
+                    'record_id': loan['id'],
+                    'patron_id': loan['patron_id'],
+                    'book_id': loan['book_id'],
+                    'due_date': datetime.fromisoformat(loan['due_date']),
+                    'days_overdue': days_overdue,
+                    'fee_amount': fee_amount
+                }
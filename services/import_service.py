@@ -0,0 +1,151 @@
+"""
+Import Service Module - Bulk catalog import
+
+Loads large vendor feeds (CSV or JSON Lines) into the catalog. Records are
+read one at a time, checked against the R1 rules, de-duplicated by ISBN and
+inserted in chunked transactions, so a feed of any size is loaded with a
+small, constant number of commits per chunk instead of one per book.
+"""
+
+import csv
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database import insert_new_books
+from services.library_service import validate_book_fields
+
+# Books inserted per transaction
+DEFAULT_BATCH_SIZE = 1000
+
+
+def detect_format(path: str) -> str:
+    """Guess the feed format ("csv" or "jsonl") from a file name."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f"Cannot tell the format of {path!r}; use a .csv or .jsonl file")
+
+
+def read_book_records(path: str, file_format: Optional[str] = None) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """
+    Stream the records of a feed file.
+
+    CSV files need a header row with title, author, isbn and total_copies;
+    JSON Lines files hold one object with those keys per line.
+
+    Yields:
+        tuple: (row number, record dict or None, error message or None)
+    """
+    file_format = file_format or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as feed:
+        if file_format == 'csv':
+            # Row 1 is the header
+            for row_number, record in enumerate(csv.DictReader(feed), start=2):
+                yield row_number, record, None
+        elif file_format == 'jsonl':
+            for row_number, line in enumerate(feed, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield row_number, None, "Malformed JSON."
+                    continue
+                if not isinstance(record, dict):
+                    yield row_number, None, "Each line must be a JSON object."
+                    continue
+                yield row_number, record, None
+        else:
+            raise ValueError(f"Unknown feed format: {file_format!r}")
+
+
+def _parse_record(record: Dict) -> Tuple[Optional[Tuple[str, str, str, int]], Optional[str]]:
+    """Turn a raw record into (title, author, isbn, total_copies), or return the R1 error."""
+    title = str(record.get('title') or '')
+    author = str(record.get('author') or '')
+    isbn = str(record.get('isbn') or '').strip()
+
+    total_copies = record.get('total_copies')
+    if isinstance(total_copies, str):
+        try:
+            total_copies = int(total_copies.strip())
+        except ValueError:
+            pass
+
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return None, error
+    return (title.strip(), author.strip(), isbn, total_copies), None
+
+
+def import_books(records: Iterable[Tuple[int, Optional[Dict], Optional[str]]],
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> Dict:
+    """
+    Import book records into the catalog.
+
+    Each record is validated with the R1 rules. ISBNs repeated within the
+    feed are rejected after their first occurrence; ISBNs already in the
+    catalog are looked up and rejected once per batch. Valid books are
+    inserted with executemany, one transaction per batch.
+
+    Args:
+        records: (row number, record, read error) tuples, e.g. from read_book_records()
+        batch_size: Number of books inserted per transaction
+
+    Returns:
+        dict: {'imported': int, 'rejected': list of {'row', 'isbn', 'reason'}}
+    """
+    imported = 0
+    rejected = []
+    seen_isbns = set()
+    batch: List[Tuple[int, Tuple[str, str, str, int]]] = []
+
+    def flush():
+        nonlocal imported
+        existing = insert_new_books([
+            (title, author, isbn, total_copies, total_copies)
+            for _, (title, author, isbn, total_copies) in batch
+        ])
+        for row_number, book in batch:
+            if book[2] in existing:
+                rejected.append({'row': row_number, 'isbn': book[2],
+                                 'reason': "A book with this ISBN already exists."})
+            else:
+                imported += 1
+        batch.clear()
+
+    for row_number, record, error in records:
+        if error:
+            rejected.append({'row': row_number, 'isbn': None, 'reason': error})
+            continue
+
+        book, error = _parse_record(record)
+        if error:
+            rejected.append({'row': row_number, 'isbn': record.get('isbn'), 'reason': error})
+            continue
+
+        isbn = book[2]
+        if isbn in seen_isbns:
+            rejected.append({'row': row_number, 'isbn': isbn,
+                             'reason': "Duplicate ISBN earlier in the feed."})
+            continue
+        seen_isbns.add(isbn)
+
+        batch.append((row_number, book))
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    rejected.sort(key=lambda reject: reject['row'])
+    return {'imported': imported, 'rejected': rejected}
+
+
+def import_books_from_file(path: str, file_format: Optional[str] = None,
+                           batch_size: int = DEFAULT_BATCH_SIZE) -> Dict:
+    """Import a CSV or JSON Lines feed file. See import_books() for the report format."""
+    return import_books(read_book_records(path, file_format), batch_size)
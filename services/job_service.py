@@ -0,0 +1,226 @@
+"""
+Job Service Module - Background payment and refund processing
+
+Payments and refunds are queued in the jobs table and carried out by a
+pool of worker processes, so a web request only has to insert a row and
+can return at once. Clients poll the job for its result. Throughput grows
+with the number of workers instead of tying up web threads on the
+payment gateway.
+"""
+
+import multiprocessing
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from database import (
+    JOB_COMPLETED, JOB_FAILED, PAYMENT_CLAIM_TIMEOUT, claim_next_job, enqueue_job, finish_job, get_job,
+    get_worker_stats, save_worker_stats
+)
+from services.library_service import pay_late_fees, refund_late_fee_payment
+from services.payment_service import get_payment_gateway
+
+# Job kinds
+PAY_LATE_FEES = 'pay_late_fees'
+REFUND_LATE_FEE = 'refund_late_fee_payment'
+
+DEFAULT_WORKERS = 4
+POLL_INTERVAL = 0.5     # Seconds an idle worker waits before looking again
+# Seconds before a running job is given to another worker. Longer than the
+# payment claim timeout, so a payment job that is run again finds its
+# abandoned claim marked unknown (for reconciliation), not still pending.
+JOB_LEASE = PAYMENT_CLAIM_TIMEOUT + 60.0
+MAX_JOB_ATTEMPTS = 3    # Claims before a job whose workers keep dying is marked failed
+STATS_INTERVAL = 30.0   # Seconds between gateway stats reports of an idle worker
+
+
+def _run_payment(payload: Dict) -> Dict:
+    success, message, transaction_id = pay_late_fees(
+        payload['patron_id'], payload['book_id'], idempotency_key=payload['idempotency_key']
+    )
+    return {'success': success, 'message': message, 'transaction_id': transaction_id}
+
+def _run_refund(payload: Dict) -> Dict:
+    success, message = refund_late_fee_payment(
+        payload['transaction_id'], payload['amount'], idempotency_key=payload['idempotency_key']
+    )
+    return {'success': success, 'message': message}
+
+JOB_HANDLERS: Dict[str, Callable[[Dict], Dict]] = {
+    PAY_LATE_FEES: _run_payment,
+    REFUND_LATE_FEE: _run_refund,
+}
+
+
+def enqueue_late_fee_payment(patron_id: str, book_id: int, idempotency_key: Optional[str] = None) -> int:
+    """
+    Queue a pay_late_fees() call.
+
+    The job carries an idempotency key (a new one unless given), so if a
+    worker dies mid-payment and the job is run again, the payments ledger
+    stops the patron from being charged twice.
+
+    Returns:
+        int: The job ID
+    """
+    return enqueue_job(PAY_LATE_FEES, {
+        'patron_id': patron_id,
+        'book_id': book_id,
+        'idempotency_key': idempotency_key or str(uuid.uuid4())
+    })
+
+def enqueue_refund(transaction_id: str, amount: float, idempotency_key: Optional[str] = None) -> int:
+    """
+    Queue a refund_late_fee_payment() call.
+
+    Like payments, the job carries an idempotency key (a new one unless
+    given), so running the job again never refunds twice.
+
+    Returns:
+        int: The job ID
+    """
+    return enqueue_job(REFUND_LATE_FEE, {
+        'transaction_id': transaction_id,
+        'amount': amount,
+        'idempotency_key': idempotency_key or str(uuid.uuid4())
+    })
+
+def get_job_status(job_id: int) -> Optional[Dict]:
+    """
+    Get the state of a job for polling clients.
+
+    Returns:
+        dict: job_id, kind, status ("queued", "running", "completed" or "failed"),
+              attempts, created_at, finished_at and result (None until finished),
+              or None if there is no such job
+    """
+    job = get_job(job_id)
+    if job is None:
+        return None
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+        'result': job['result']
+    }
+
+
+def run_job(job: Dict) -> None:
+    """
+    Carry out a claimed job and store its result.
+
+    A payment the gateway declines still completes the job; the result says
+    whether it succeeded. A job only fails if its handler raises. If the
+    lease ran out and another worker has claimed the job since, the result
+    is dropped and the new owner's stands.
+    """
+    handler = JOB_HANDLERS.get(job['kind'])
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']!r}")
+        status, result = JOB_COMPLETED, handler(job['payload'])
+    except Exception as e:
+        status, result = JOB_FAILED, {'success': False, 'message': f"Job failed: {str(e)}"}
+    finish_job(job['id'], status, result, job['worker'], job['attempts'])
+
+def run_pending_jobs(worker: str = 'inline', max_jobs: Optional[int] = None) -> int:
+    """
+    Run queued jobs in this process until the queue is empty.
+
+    Returns:
+        int: Number of jobs run
+    """
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = claim_next_job(worker, JOB_LEASE, MAX_JOB_ATTEMPTS)
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+def publish_gateway_stats(worker: str) -> None:
+    """
+    Report this process's payment gateway stats (circuit breaker state and
+    latency histograms) to the database, where /api/metrics reads them.
+    """
+    save_worker_stats(worker, get_payment_gateway().stats())
+
+def get_gateway_stats_by_worker() -> Dict[str, Dict]:
+    """Gateway stats of the worker processes that reported recently."""
+    return get_worker_stats(max_age_seconds=STATS_INTERVAL * 4)
+
+def work(stop_event=None, poll_interval: float = POLL_INTERVAL) -> None:
+    """
+    Worker loop: run jobs as they arrive until stop_event is set.
+
+    The worker's gateway stats are published after every batch of jobs,
+    and every STATS_INTERVAL seconds while it is idle.
+    """
+    worker = f"worker-{os.getpid()}"
+    last_published = 0.0
+    while stop_event is None or not stop_event.is_set():
+        ran = run_pending_jobs(worker)
+        if ran or time.monotonic() - last_published >= STATS_INTERVAL:
+            publish_gateway_stats(worker)
+            last_published = time.monotonic()
+        if not ran:
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+
+class WorkerPool:
+    """
+    A pool of worker processes running work().
+
+    Each process opens its own database connections (the connection pool
+    is per process), so workers never share a SQLite handle.
+
+        pool = WorkerPool(4)
+        pool.start()
+        ...
+        pool.stop()
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, poll_interval: float = POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop_event = multiprocessing.Event()
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self) -> None:
+        self._stop_event.clear()
+        for number in range(self.workers):
+            process = multiprocessing.Process(
+                target=work, args=(self._stop_event, self.poll_interval),
+                name=f"payment-worker-{number + 1}", daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+    def join(self) -> None:
+        """Wait until every worker has exited."""
+        for process in self._processes:
+            process.join()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Let each worker finish its current job, then stop it."""
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
@@ -3,16 +3,52 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
+import asyncio
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from database import (
-    get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books,
-    get_patron_borrowing_history
+    get_book_by_id, get_book_by_isbn,
+    insert_book, get_patron_borrowed_books,
+    get_patron_borrowing_history, search_books,
+    borrow_book, borrow_books, return_book, return_books, get_overdue_loans_for_patrons,
+    claim_payment, finish_payment, get_late_fee_charges, get_payment_by_key, get_payment_by_transaction,
+    reserve_refund, release_refund, claim_refund, finish_refund,
+    PAYMENT_COMPLETED, PAYMENT_FAILED, PAYMENT_PENDING, PAYMENT_UNKNOWN,
+    BORROWED, RETURNED, BOOK_NOT_FOUND, BOOK_UNAVAILABLE, BORROW_LIMIT_REACHED, NOT_BORROWED
 )
 
-from services.payment_service import PaymentGateway
+from services.fee_service import calculate_late_fee_amount, calculate_late_fees
+from services.payment_service import AsyncPaymentGateway, CircuitOpenError, PaymentGateway, get_payment_gateway
+
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
+    """
+    Check the R1 rules for a new book.
+    
+    Returns:
+        str: The error message for the first rule broken, or None if the book is valid
+    """
+    if not title or not title.strip():
+        return "Title is required."
+    
+    if len(title.strip()) > 200:
+        return "Title must be less than 200 characters."
+    
+    if not author or not author.strip():
+        return "Author is required."
+    
+    if len(author.strip()) > 100:
+        return "Author must be less than 100 characters."
+    
+    if len(isbn) != 13:
+        return "ISBN must be exactly 13 digits."
+    
+    if not isinstance(total_copies, int) or isinstance(total_copies, bool) or total_copies <= 0:
+        return "Total copies must be a positive integer."
+    
+    return None
 
 def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
     """
@@ -29,23 +65,9 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
         tuple: (success: bool, message: str)
     """
     # Input validation
-    if not title or not title.strip():
-        return False, "Title is required."
-    
-    if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
-    
-    if not author or not author.strip():
-        return False, "Author is required."
-    
-    if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
-    
-    if len(isbn) != 13:
-        return False, "ISBN must be exactly 13 digits."
-    
-    if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
     
     # Check for duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -59,6 +81,56 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
     else:
         return False, "Database error occurred while adding the book."
 
+# Loan period and borrowing limit (R3)
+LOAN_DAYS = 14
+MAX_BORROWED_BOOKS = 5
+
+# Most books one checkout desk batch may borrow or return
+MAX_BATCH_BOOKS = 50
+
+def validate_patron_id(patron_id: str) -> Optional[str]:
+    """
+    Check that a patron ID is a 6-digit library card number.
+    
+    Returns:
+        str: The error message, or None if the ID is valid
+    """
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return "Invalid patron ID. Must be exactly 6 digits."
+    return None
+
+def _borrow_message(outcome: str, book: Optional[Dict], due_date: datetime) -> Tuple[bool, str]:
+    if outcome == BOOK_NOT_FOUND:
+        return False, "Book not found."
+    
+    if outcome == BOOK_UNAVAILABLE:
+        return False, "This book is currently not available."
+    
+    if outcome == BORROW_LIMIT_REACHED:
+        return False, f"You have reached the maximum borrowing limit of {MAX_BORROWED_BOOKS} books."
+    
+    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+
+def _late_fee(due_date: datetime, returned_at: datetime) -> float:
+    return calculate_late_fee_amount((returned_at - due_date).days)
+
+def _return_message(outcome: str, loan: Optional[Dict], return_date: datetime) -> Tuple[bool, str]:
+    if outcome == BOOK_NOT_FOUND:
+        return False, "Book not found."
+    
+    #If this patron hasn't borrowed this book or it has already been returned.
+    #Return error message
+    if outcome == NOT_BORROWED:
+        return False, "Patron haven't borrowed this book or it has already been returned."
+    
+    fee_amount = loan['late_fee']
+    days_overdue = (return_date - loan['due_date']).days
+    
+    if fee_amount > 0:
+        return True, f'Successfully returned "{loan["title"]}". Late fee: ${fee_amount:.2f} for {days_overdue} days overdue.'
+    else:
+        return True, f'Successfully returned "{loan["title"]}". No late fees.'
+
 def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Allow a patron to borrow a book.
@@ -72,94 +144,126 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
         tuple: (success: bool, message: str)
     """
     # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
-        return False, "Invalid patron ID. Must be exactly 6 digits."
-    
-    # Check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found."
-    
-    if book['available_copies'] <= 0:
-        return False, "This book is currently not available."
-    
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
+    error = validate_patron_id(patron_id)
+    if error:
+        return False, error
     
-    if current_borrowed >= 5:
-        return False, "You have reached the maximum borrowing limit of 5 books."
-    
-    # Create borrow record
+    # Loan period is 14 days
     borrow_date = datetime.now()
-    due_date = borrow_date + timedelta(days=14)
+    due_date = borrow_date + timedelta(days=LOAN_DAYS)
     
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
+    # Availability check, limit check, decrement and borrow record all
+    # happen in one transaction
+    try:
+        outcome, book = borrow_book(patron_id, book_id, borrow_date, due_date, max_borrowed=MAX_BORROWED_BOOKS)
+    except sqlite3.Error:
         return False, "Database error occurred while creating borrow record."
     
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
-    
-    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+    return _borrow_message(outcome, book, due_date)
 
 def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Process book return by a patron.
+    Implements R4: Book Return Processing
     
-    TODO: Implement R4 as per requirements
+    Args:
+        patron_id: 6-digit library card ID
+        book_id: ID of the book being returned
+        
+    Returns:
+        tuple: (success: bool, message: str)
     """
         
     # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
-        return False, "Invalid patron ID. Must be exactly 6 digits."
+    error = validate_patron_id(patron_id)
+    if error:
+        return False, error
     
-    # Check if book exists
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found."
+    # Close the loan, restore the copy and record the late fee in one
+    # transaction. The fee is computed from the due date of the loan being
+    # closed, before anything else can change it.
+    return_date = datetime.now()
+    try:
+        outcome, loan = return_book(patron_id, book_id, return_date, late_fee=_late_fee)
+    except sqlite3.Error:
+        return False, "Database error occurred while returning the book."
     
-    # Check if patron has borrowed this book and it's haven't returned
-    borrowed_books = get_patron_borrowed_books(patron_id)
-    book_borrowed_by_patron = False
+    return _return_message(outcome, loan, return_date)
+
+def _validate_batch(patron_id: str, book_ids: List[int]) -> Optional[str]:
+    error = validate_patron_id(patron_id)
+    if error:
+        return error
+    if not book_ids:
+        return "At least one book ID is required."
+    if len(book_ids) > MAX_BATCH_BOOKS:
+        return f"At most {MAX_BATCH_BOOKS} books can be handled at once."
+    return None
+
+def _batch_results(book_ids: List[int], messages: List[Tuple[bool, str]]) -> List[Dict]:
+    return [
+        {'book_id': book_id, 'success': success, 'message': message}
+        for book_id, (success, message) in zip(book_ids, messages)
+    ]
+
+def borrow_books_by_patron(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Borrow several books for a patron at once, e.g. at a checkout desk.
     
-    for borrowed_book in borrowed_books:
-        if borrowed_book['book_id'] == book_id:
-            book_borrowed_by_patron = True
-            borror_book = borrowed_book
-            break
+    The patron is validated and the borrowing limit checked once for the
+    whole batch, and all loans are made in one transaction. Books are taken
+    in the order given until the limit is reached.
     
-    #If this patron hasn't borrowed this book or it has already been returned.
-    #Return error message
-    if not book_borrowed_by_patron:
-        return False, "Patron haven't borrowed this book or it has already been returned."
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books to borrow
+        
+    Returns:
+        tuple: (success: bool, message: str, results: list of dicts with
+                book_id, success and message, in the order of book_ids)
+                success is False only if the batch as a whole was rejected.
+    """
+    error = _validate_batch(patron_id, book_ids)
+    if error:
+        return False, error, []
     
-    # Update borrow record with return date
-    return_date = datetime.now()
-    return_success = update_borrow_record_return_date(patron_id, book_id, return_date)
-    if not return_success:
-        return False, "Database error occurred while returning the book."
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=LOAN_DAYS)
+    try:
+        outcomes = borrow_books(patron_id, book_ids, borrow_date, due_date, max_borrowed=MAX_BORROWED_BOOKS)
+    except sqlite3.Error:
+        return False, "Database error occurred while creating borrow records.", []
     
-    # Update book availability
-    availability_success = update_book_availability(book_id, 1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
+    borrowed = sum(1 for outcome, _ in outcomes if outcome == BORROWED)
+    messages = [_borrow_message(outcome, book, due_date) for outcome, book in outcomes]
+    return True, f"Borrowed {borrowed} of {len(book_ids)} books.", _batch_results(book_ids, messages)
+
+def return_books_by_patron(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Return several books for a patron at once, in one transaction.
     
-    #Count late fee
-    late_fee_info = calculate_late_fee_for_book(patron_id, book_id)
-    fee_amount = late_fee_info['fee_amount']
-    days_overdue = late_fee_info['days_overdue']
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books being returned
+        
+    Returns:
+        tuple: (success: bool, message: str, results: list of dicts with
+                book_id, success and message, in the order of book_ids)
+                success is False only if the batch as a whole was rejected.
+    """
+    error = _validate_batch(patron_id, book_ids)
+    if error:
+        return False, error, []
     
-    due_date = borror_book['due_date']
-    days_overdue = (return_date - due_date).days
+    return_date = datetime.now()
+    try:
+        outcomes = return_books(patron_id, book_ids, return_date, late_fee=_late_fee)
+    except sqlite3.Error:
+        return False, "Database error occurred while returning the books.", []
     
-    if fee_amount > 0:
-    #If there is late fee, return the calculated values
-    #We don't need to check the status of the late fee calculation, because we already check the borrow record.
-        return True, f'Successfully returned "{book["title"]}". Late fee: ${fee_amount:.2f} for {days_overdue} days overdue.'
-    else:
-        return True, f'Successfully returned "{book["title"]}". No late fees.'
+    returned = sum(1 for outcome, _ in outcomes if outcome == RETURNED)
+    messages = [_return_message(outcome, loan, return_date) for outcome, loan in outcomes]
+    return True, f"Returned {returned} of {len(book_ids)} books.", _batch_results(book_ids, messages)
 
 
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
@@ -194,23 +298,17 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
                 return {
                     'fee_amount': 0.0,
                     'days_overdue': 0,
-                    'status': 'No late fee'
+                    'status': 'No late fee',
+                    'borrow_record_id': book_record['id']
                 }
-            elif days_overdue <= 7:
-                # First 7 days: $0.50 per day
-                fee_amount = days_overdue * 0.50
-            else:
-                # First 7 days, remaining days at $1.00 per day
-                fee_amount = (7 * 0.50) + ((days_overdue - 7) * 1.00)
-
-            # Maximum late fee 15$
-            fee_amount = min(fee_amount, 15.00)
+            fee_amount = calculate_late_fee_amount(days_overdue)
 
             # Return the calculated values
             return {
-                'fee_amount': round(fee_amount, 2),
+                'fee_amount': fee_amount,
                 'days_overdue': days_overdue,
-                'status': f'Late fee calculated: ${fee_amount:.2f} for {days_overdue} days overdue'
+                'status': f'Late fee calculated: ${fee_amount:.2f} for {days_overdue} days overdue',
+                'borrow_record_id': book_record['id']
             }
     #If the book didn't find in the patron's borrowed books, return the following message. 
     return {
@@ -220,120 +318,219 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     }
 
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+def search_books_in_catalog(search_term: str, search_type: str, limit: int = 100, offset: int = 0) -> List[Dict]:
     """
     Search for books in the catalog.
-    
-    TODO: Implement R6 as per requirements
+    Implements R6: Book Search Functionality
+
+    Args:
+        search_term: Text to search for
+        search_type: "title" or "author" (partial, case-insensitive) or "isbn" (exact)
+        limit: Maximum number of results to return
+        offset: Number of results to skip, for paging
+
+    Returns:
+        list: Matching books, best matches first
     """
     
     #Check the search type first， make sure they are not empty
     if not search_term.strip() or not search_type.strip():
         return []
     
-    search_term = search_term.strip().lower()
+    search_term = search_term.strip()
     search_type = search_type.strip().lower()
-    all_books = get_all_books()
-    matching_books = []
-    
-    for book in all_books:
-        if search_type == 'title':
-            # Partial matching for title (case-insensitive)
-            #All trans to lower case
-            if search_term in book['title'].lower():
-                matching_books.append(book)
-        elif search_type == 'author':
-            # Partial matching for author (case-insensitive)
-            #All trans to lower case
-            if search_term in book['author'].lower():
-                matching_books.append(book)
-        elif search_type == 'isbn':
-            # Exact matching for ISBN
-            if search_term == book['isbn']:
-                matching_books.append(book)
     
-    return matching_books
+    #Matching is done by the database: the ISBN index for exact ISBN
+    #lookups and the full-text index for title/author substrings
+    return search_books(search_term, search_type, limit, offset)
     
 
 
-def get_patron_status_report(patron_id: str) -> Dict:
+def get_patron_status_report(patron_id: str, history_limit: Optional[int] = None) -> Dict:
     """
     Get status report for a patron.
+    Implements R7: Patron Status Report
     
-    TODO: Implement R7 as per requirements
+    The whole report comes from two queries (open loans and history);
+    fees for every open loan are computed in one pass over the loans.
+    
+    Args:
+        patron_id: 6-digit library card ID
+        history_limit: Only include the most recent N history records (default: all)
+        
+    Returns:
+        dict: Report with currently borrowed books (each with its late fee),
+              total late fees, current borrow count and borrowing history,
+              or an empty dict for an invalid patron ID
     """
     # Check patron ID, if invaild return error message
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return {}
     
-    #Get all the information
-    #Cuerrent borrow books
+    #Cuerrent borrow books, with the late fee each would owe if returned now
     currently_borrowed = get_patron_borrowed_books(patron_id)
-    #late fee
+    now = datetime.now()
     total_late_fees = 0.00
     for book in currently_borrowed:
-        late_fee_info = calculate_late_fee_for_book(patron_id, book['book_id'])
-        total_late_fees += late_fee_info['fee_amount']
+        days_overdue = max((now - book['due_date']).days, 0)
+        book['days_overdue'] = days_overdue
+        book['late_fee'] = calculate_late_fee_amount(days_overdue)
+        total_late_fees += book['late_fee']
     
-    # Borrowing books count
-    books_borrowed_count = get_patron_borrow_count(patron_id)
     # Borrowing history
-    borrowing_history=get_patron_borrowing_history(patron_id)
+    borrowing_history = get_patron_borrowing_history(patron_id, history_limit)
     
     return {
         'patron_id': patron_id,
         'currently_borrowed': currently_borrowed,
         'total_late_fees': round(total_late_fees, 2),
-        'current_borrow_count': books_borrowed_count,
+        'current_borrow_count': len(currently_borrowed),
         'borrow_history': borrowing_history,
         'status': True
     }
 
-def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None) -> Tuple[bool, str, Optional[str]]:
+def _prepare_late_fee_payment(patron_id: str, book_id: int,
+                              idempotency_key: Optional[str]) -> Tuple[Optional[str], float, Optional[Dict], Optional[Dict[int, float]]]:
     """
-    Process payment for late fees using external payment gateway.
+    Work out what a late fee payment should charge: the fee of the loan,
+    less what other payments have already charged for it.
     
-    NEW FEATURE FOR ASSIGNMENT 3: Demonstrates need for mocking/stubbing
-    This function depends on an external payment service that should be mocked in tests.
-    
-    Args:
-        patron_id: 6-digit library card ID
-        book_id: ID of the book with late fees
-        payment_gateway: Payment gateway instance (injectable for testing)
-        
     Returns:
-        tuple: (success: bool, message: str, transaction_id: Optional[str])
-        
-    Example for you to mock:
-        # In tests, mock the payment gateway:
-        mock_gateway = Mock(spec=PaymentGateway)
-        mock_gateway.process_payment.return_value = (True, "txn_123", "Success")
-        success, msg, txn = pay_late_fees("123456", 1, mock_gateway)
+        tuple: (error message or None, fee amount, book, {borrow record id: amount} or None)
     """
     # Validate patron ID
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
-        return False, "Invalid patron ID. Must be exactly 6 digits.", None
+        return "Invalid patron ID. Must be exactly 6 digits.", 0.0, None, None
     
     # Calculate late fee first
     fee_info = calculate_late_fee_for_book(patron_id, book_id)
     
     # Check if there's a fee to pay
     if not fee_info or 'fee_amount' not in fee_info:
-        return False, "Unable to calculate late fees.", None
+        return "Unable to calculate late fees.", 0.0, None, None
     
     fee_amount = fee_info.get('fee_amount', 0.0)
     
     if fee_amount <= 0:
-        return False, "No late fees to pay for this book.", None
+        return "No late fees to pay for this book.", 0.0, None, None
+    
+    loan_charges = None
+    loan_id = fee_info.get('borrow_record_id')
+    if loan_id is not None:
+        fee_amount = _amount_still_owed(fee_amount, get_late_fee_charges([loan_id]).get(loan_id), idempotency_key)
+        if fee_amount <= 0:
+            return "Late fees for this book are already paid.", 0.0, None, None
+        loan_charges = {loan_id: fee_amount}
     
     # Get book details for payment description
     book = get_book_by_id(book_id)
     if not book:
-        return False, "Book not found.", None
+        return "Book not found.", 0.0, None, None
+    
+    return None, fee_amount, book, loan_charges
+
+def _amount_still_owed(fee: float, charges: Optional[Dict[str, float]], idempotency_key: Optional[str]) -> float:
+    """The part of a loan's fee that payments other than idempotency_key have not charged yet."""
+    charged = sum(amount for key, amount in (charges or {}).items() if key != idempotency_key)
+    return round(max(fee - charged, 0.0), 2)
+
+def _payment_result(success: bool, transaction_id: str, message: str) -> Tuple[bool, str, Optional[str]]:
+    if success:
+        return True, f"Payment successful! {message}", transaction_id
+    else:
+        return False, f"Payment failed: {message}", None
+
+UNKNOWN_PAYMENT_MESSAGE = "The outcome of this payment is unknown. It will not be charged again until it has been reconciled."
+
+def _recorded_payment_result(payment: Dict, patron_id: str) -> Tuple[bool, str, Optional[str]]:
+    """Result for a payment the ledger already holds, returned instead of charging again."""
+    if payment['patron_id'] != patron_id:
+        return False, "Idempotency key was already used for another patron.", None
+    if payment['status'] == PAYMENT_COMPLETED:
+        return _payment_result(True, payment['transaction_id'], payment['message'])
+    if payment['status'] == PAYMENT_UNKNOWN:
+        return False, UNKNOWN_PAYMENT_MESSAGE, None
+    return False, "Payment is already being processed.", None
+
+def _start_late_fee_payment(patron_id: str, book_id: int,
+                            idempotency_key: Optional[str]) -> Tuple[Optional[Tuple[bool, str, Optional[str]]], str, float, Optional[Dict]]:
+    """
+    Check the payments ledger and claim the idempotency key for a new charge.
+    
+    Returns:
+        tuple: (result to return without charging, or None; idempotency key; fee amount; book)
+    """
+    # A key that already paid is answered from the ledger. Pending keys go
+    # through claim_payment(), which notices claims that were abandoned.
+    if idempotency_key:
+        payment = get_payment_by_key(idempotency_key)
+        if payment and payment['status'] not in (PAYMENT_FAILED, PAYMENT_PENDING):
+            return _recorded_payment_result(payment, patron_id), idempotency_key, 0.0, None
+    
+    error, fee_amount, book, loan_charges = _prepare_late_fee_payment(patron_id, book_id, idempotency_key)
+    if error:
+        return (False, error, None), idempotency_key, 0.0, None
+    
+    idempotency_key = idempotency_key or str(uuid.uuid4())
+    payment, claimed = claim_payment(idempotency_key, patron_id, book_id, fee_amount, loan_charges=loan_charges)
+    if not claimed:
+        return _recorded_payment_result(payment, patron_id), idempotency_key, 0.0, None
+    return None, idempotency_key, fee_amount, book
+
+def _record_charge_error(idempotency_key: str, error: Exception) -> str:
+    """
+    Record a charge that raised instead of answering, and build its message.
+    
+    Only the circuit breaker's refusal proves the gateway was never asked.
+    After any other error, a timeout say, the charge may have gone through,
+    so the payment is left for reconciliation rather than charged again on
+    a retry with the same key.
+    """
+    if isinstance(error, CircuitOpenError):
+        finish_payment(idempotency_key, PAYMENT_FAILED, None, str(error))
+        return f"Payment processing error: {str(error)}"
+    finish_payment(idempotency_key, PAYMENT_UNKNOWN, None, str(error))
+    return f"Payment processing error: {str(error)}. {UNKNOWN_PAYMENT_MESSAGE}"
+
+def _finish_late_fee_payment(idempotency_key: str, success: bool, transaction_id: str,
+                             message: str) -> Tuple[bool, str, Optional[str]]:
+    """Record the gateway's answer in the ledger and build the result."""
+    finish_payment(idempotency_key, PAYMENT_COMPLETED if success else PAYMENT_FAILED,
+                   transaction_id if success else None, message)
+    return _payment_result(success, transaction_id, message)
+
+def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None,
+                  idempotency_key: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
+    """
+    Process payment for late fees using external payment gateway.
+    
+    NEW FEATURE FOR ASSIGNMENT 3: Demonstrates need for mocking/stubbing
+    This function depends on an external payment service that should be mocked in tests.
     
-    # Use provided gateway or create new one
+    Args:
+        patron_id: 6-digit library card ID
+        book_id: ID of the book with late fees
+        payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: Key identifying this payment request. A request repeated
+            with the same key (a retry or double-click) gets the recorded result
+            from the payments ledger instead of a second charge.
+        
+    Returns:
+        tuple: (success: bool, message: str, transaction_id: Optional[str])
+        
+    Example for you to mock:
+        # In tests, mock the payment gateway:
+        mock_gateway = Mock(spec=PaymentGateway)
+        mock_gateway.process_payment.return_value = (True, "txn_123", "Success")
+        success, msg, txn = pay_late_fees("123456", 1, mock_gateway)
+    """
+    result, idempotency_key, fee_amount, book = _start_late_fee_payment(patron_id, book_id, idempotency_key)
+    if result:
+        return result
+    
+    # Use provided gateway or the shared one behind the circuit breaker
     if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+        payment_gateway = get_payment_gateway()
     
     # Process payment through external gateway
     # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
@@ -343,18 +540,164 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
             amount=fee_amount,
             description=f"Late fees for '{book['title']}'"
         )
-        
-        if success:
-            return True, f"Payment successful! {message}", transaction_id
-        else:
-            return False, f"Payment failed: {message}", None
+        return _finish_late_fee_payment(idempotency_key, success, transaction_id, message)
             
     except Exception as e:
         # Handle payment gateway errors
-        return False, f"Payment processing error: {str(e)}", None
+        return False, _record_charge_error(idempotency_key, e), None
+
+
+async def pay_late_fees_async(patron_id: str, book_id: int, payment_gateway: AsyncPaymentGateway = None,
+                              idempotency_key: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
+    """
+    Async variant of pay_late_fees() for use on an event loop.
+    
+    The fee lookup runs in a worker thread and the charge is awaited, so
+    one event loop can have many payments in flight at once. The worker
+    threads use pooled connections of their own, even when called during a
+    request, so the ledger is committed as it goes. Pass a shared
+    AsyncPaymentGateway to reuse its pooled connections; without one, a
+    gateway is opened and closed just for this payment. The ledger's
+    idempotency key is also sent to the gateway, so a charge whose answer
+    was lost is not repeated there either.
+    
+    Returns:
+        tuple: (success: bool, message: str, transaction_id: Optional[str])
+    """
+    result, idempotency_key, fee_amount, book = await asyncio.to_thread(
+        _start_late_fee_payment, patron_id, book_id, idempotency_key
+    )
+    if result:
+        return result
+    
+    try:
+        if payment_gateway is None:
+            async with AsyncPaymentGateway() as gateway:
+                return await _charge_late_fee_async(gateway, patron_id, fee_amount, book, idempotency_key)
+        return await _charge_late_fee_async(payment_gateway, patron_id, fee_amount, book, idempotency_key)
+    
+    except Exception as e:
+        return False, await asyncio.to_thread(_record_charge_error, idempotency_key, e), None
+
+async def _charge_late_fee_async(payment_gateway: AsyncPaymentGateway, patron_id: str, fee_amount: float,
+                                 book: Dict, idempotency_key: str) -> Tuple[bool, str, Optional[str]]:
+    success, transaction_id, message = await payment_gateway.process_payment(
+        patron_id=patron_id,
+        amount=fee_amount,
+        description=f"Late fees for '{book['title']}'",
+        idempotency_key=idempotency_key
+    )
+    return await asyncio.to_thread(_finish_late_fee_payment, idempotency_key, success, transaction_id, message)
+
+
+def reconcile_payment(idempotency_key: str, transaction_id: Optional[str] = None,
+                      payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:
+    """
+    Settle a payment whose outcome is unknown (see database.claim_payment()).
+    
+    Look the charge up at the payment provider first. If it was made, pass
+    its transaction ID: the gateway confirms it and the payment is recorded
+    as completed. Without a transaction ID, or if the gateway does not
+    report it completed, the payment is recorded as failed and the patron
+    can retry with the same key.
+    
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    payment = get_payment_by_key(idempotency_key)
+    if payment is None:
+        return False, "Payment not found."
+    if payment['status'] != PAYMENT_UNKNOWN:
+        return False, f"Payment is {payment['status']}; there is nothing to reconcile."
+    
+    if transaction_id:
+        if payment_gateway is None:
+            payment_gateway = get_payment_gateway()
+        status = payment_gateway.verify_payment_status(transaction_id).get('status')
+        if status == 'completed':
+            finish_payment(idempotency_key, PAYMENT_COMPLETED, transaction_id,
+                           f"Payment of ${payment['amount']:.2f} confirmed by reconciliation")
+            return True, f"Payment recorded as completed with {transaction_id}."
+    
+    finish_payment(idempotency_key, PAYMENT_FAILED, None, "No completed charge found during reconciliation")
+    return True, "Payment recorded as failed; it can be retried."
+
+
+def _validate_refund(transaction_id: str, amount: float) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Check a refund request and count it against the payment in the ledger.
+    
+    Payments recorded in the ledger can be refunded up to what was actually
+    paid, less earlier refunds. Transactions the ledger does not know only
+    get the $15.00 per-book limit.
+    
+    Returns:
+        tuple: (error message or None, ledger payment the refund was reserved on, or None)
+    """
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return "Invalid transaction ID.", None
+    
+    if amount <= 0:
+        return "Refund amount must be greater than 0.", None
+    
+    payment = get_payment_by_transaction(transaction_id)
+    
+    # Maximum late fee per book (a batch collection can charge for several books)
+    if amount > 15.00 and (payment is None or payment['book_id'] is not None):
+        return "Refund amount exceeds maximum late fee.", None
+    
+    if payment is not None and not reserve_refund(payment['id'], amount):
+        return "Refund amount exceeds the amount paid.", None
+    
+    return None, payment
+
+def _refund_result(success: bool, message: str) -> Tuple[bool, str]:
+    if success:
+        return True, message
+    else:
+        return False, f"Refund failed: {message}"
+
+def _recorded_refund_result(refund: Dict, transaction_id: str, amount: float) -> Tuple[bool, str]:
+    """Result for a refund the ledger already holds, returned instead of refunding again."""
+    if refund['transaction_id'] != transaction_id or refund['amount'] != amount:
+        return False, "Idempotency key was already used for another refund."
+    if refund['status'] == PAYMENT_COMPLETED:
+        return True, refund['message']
+    return False, "Refund is already being processed."
+
+def _start_late_fee_refund(transaction_id: str, amount: float,
+                           idempotency_key: Optional[str]) -> Tuple[Optional[Tuple[bool, str]], Optional[Dict]]:
+    """
+    Claim the idempotency key (if any) and reserve the refund on the payment.
+    
+    Returns:
+        tuple: (result to return without refunding, or None; ledger payment the refund was reserved on)
+    """
+    if idempotency_key:
+        refund, claimed = claim_refund(idempotency_key, transaction_id, amount)
+        if not claimed:
+            return _recorded_refund_result(refund, transaction_id, amount), None
+    
+    error, payment = _validate_refund(transaction_id, amount)
+    if error:
+        if idempotency_key:
+            finish_refund(idempotency_key, PAYMENT_FAILED, error)
+        return (False, error), None
+    return None, payment
 
+def _finish_late_fee_refund(idempotency_key: Optional[str], payment: Optional[Dict], amount: float,
+                            success: bool, message: Optional[str], error: Optional[str]) -> Tuple[bool, str]:
+    """Release the reservation of a refund that did not go through and record the outcome."""
+    if not success and payment is not None:
+        # Nothing was refunded, so the amount can be refunded again
+        release_refund(payment['id'], amount)
+    result = (False, error) if error else _refund_result(success, message)
+    if idempotency_key:
+        finish_refund(idempotency_key, PAYMENT_COMPLETED if result[0] else PAYMENT_FAILED, result[1])
+    return result
 
-def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:
+def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None,
+                            idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
     """
     Refund a late fee payment (e.g., if book was returned on time but fees were charged in error).
     
@@ -364,33 +707,164 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
         transaction_id: Original transaction ID to refund
         amount: Amount to refund
         payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: Key identifying this refund request. A refund repeated
+            with the same key gets the recorded result instead of a second refund.
         
     Returns:
         tuple: (success: bool, message: str)
     """
     # Validate inputs
-    if not transaction_id or not transaction_id.startswith("txn_"):
-        return False, "Invalid transaction ID."
-    
-    if amount <= 0:
-        return False, "Refund amount must be greater than 0."
-    
-    if amount > 15.00:  # Maximum late fee per book
-        return False, "Refund amount exceeds maximum late fee."
+    result, payment = _start_late_fee_refund(transaction_id, amount, idempotency_key)
+    if result:
+        return result
     
-    # Use provided gateway or create new one
+    # Use provided gateway or the shared one behind the circuit breaker
     if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+        payment_gateway = get_payment_gateway()
     
     # Process refund through external gateway
     # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
+    error = None
     try:
         success, message = payment_gateway.refund_payment(transaction_id, amount)
-        
-        if success:
-            return True, message
+    except Exception as e:
+        success, message = False, None
+        error = f"Refund processing error: {str(e)}"
+    
+    return _finish_late_fee_refund(idempotency_key, payment, amount, success, message, error)
+
+
+async def refund_late_fee_payment_async(transaction_id: str, amount: float,
+                                        payment_gateway: AsyncPaymentGateway = None,
+                                        idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Async variant of refund_late_fee_payment(); see pay_late_fees_async() for gateway sharing.
+    
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    result, payment = await asyncio.to_thread(_start_late_fee_refund, transaction_id, amount, idempotency_key)
+    if result:
+        return result
+    
+    error = None
+    try:
+        if payment_gateway is None:
+            async with AsyncPaymentGateway() as gateway:
+                success, message = await gateway.refund_payment(transaction_id, amount)
         else:
-            return False, f"Refund failed: {message}"
-            
+            success, message = await payment_gateway.refund_payment(transaction_id, amount)
     except Exception as e:
-        return False, f"Refund processing error: {str(e)}"
\ No newline at end of file
+        success, message = False, None
+        error = f"Refund processing error: {str(e)}"
+    
+    return await asyncio.to_thread(
+        _finish_late_fee_refund, idempotency_key, payment, amount, success, message, error
+    )
+
+
+
+def collect_late_fees(patron_ids: List[str], payment_gateway: PaymentGateway = None,
+                      max_workers: int = 8, batch_id: Optional[str] = None) -> List[Dict]:
+    """
+    Collect outstanding late fees from many patrons (e.g. end-of-month billing).
+    
+    Fees for every patron come from one query and one batch fee calculation.
+    Each patron is then charged once for the total of their overdue books,
+    with the charges sent to the gateway by a pool of at most max_workers
+    threads, so thousands of slow gateway calls overlap instead of running
+    one after another.
+    
+    Every charge is recorded in the payments ledger under the key
+    "<batch_id>:<patron_id>", so running an interrupted batch again with
+    the same batch_id skips the patrons it already charged. The ledger also
+    records what each payment charged per loan, and only the part of a
+    fee that no other payment (an earlier batch or pay_late_fees()) has
+    covered is billed, so no loan is ever charged more than its fee.
+    
+    Args:
+        patron_ids: 6-digit library card IDs to bill
+        payment_gateway: Payment gateway instance, shared by all workers (injectable for testing)
+        max_workers: Maximum number of charges in flight at once
+        batch_id: Name of this collection run (default: a new unique ID)
+        
+    Returns:
+        list: One result per distinct patron ID, in the order given, with keys
+              patron_id, status ("paid", "failed", "pending", "unknown", "no_fees"
+              or "invalid"), amount, books, message and transaction_id
+    """
+    results = {}
+    valid_ids = []
+    for patron_id in dict.fromkeys(patron_ids):
+        if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+            results[patron_id] = _collection_result(patron_id, 'invalid', message="Invalid patron ID. Must be exactly 6 digits.")
+        else:
+            valid_ids.append(patron_id)
+    
+    # Price every overdue loan of every patron in one pass
+    now = datetime.now()
+    loans = get_overdue_loans_for_patrons(valid_ids, now - timedelta(days=1))
+    _, fees = calculate_late_fees([loan['due_date'] for loan in loans], as_of=now)
+    charged = get_late_fee_charges([loan['id'] for loan in loans])
+    batch_id = batch_id or str(uuid.uuid4())
+    
+    charges = {}
+    for loan, fee in zip(loans, fees):
+        owed = _amount_still_owed(fee, charged.get(loan['id']), f"{batch_id}:{loan['patron_id']}")
+        if owed > 0:
+            amount, books, loan_charges = charges.get(loan['patron_id'], (0.0, 0, {}))
+            loan_charges[loan['id']] = owed
+            charges[loan['patron_id']] = (amount + owed, books + 1, loan_charges)
+    
+    for patron_id in valid_ids:
+        if patron_id not in charges:
+            results[patron_id] = _collection_result(patron_id, 'no_fees', message="No late fees to pay.")
+    
+    if charges:
+        if payment_gateway is None:
+            payment_gateway = get_payment_gateway()
+        
+        def charge(patron_id: str) -> Dict:
+            amount, books, loan_charges = charges[patron_id]
+            amount = round(amount, 2)
+            idempotency_key = f"{batch_id}:{patron_id}"
+            payment, claimed = claim_payment(idempotency_key, patron_id, None, amount, loan_charges=loan_charges)
+            if not claimed:
+                if payment['status'] == PAYMENT_COMPLETED:
+                    return _collection_result(patron_id, 'paid', payment['amount'], books,
+                                              f"Payment successful! {payment['message']}", payment['transaction_id'])
+                if payment['status'] == PAYMENT_UNKNOWN:
+                    return _collection_result(patron_id, 'unknown', payment['amount'], books, UNKNOWN_PAYMENT_MESSAGE)
+                return _collection_result(patron_id, 'pending', payment['amount'], books, "Payment is already being processed.")
+            try:
+                success, transaction_id, message = payment_gateway.process_payment(
+                    patron_id=patron_id,
+                    amount=amount,
+                    description=f"Late fees for {books} overdue book(s)"
+                )
+            except Exception as e:
+                message = _record_charge_error(idempotency_key, e)
+                status = 'failed' if isinstance(e, CircuitOpenError) else 'unknown'
+                return _collection_result(patron_id, status, amount, books, message)
+            finish_payment(idempotency_key, PAYMENT_COMPLETED if success else PAYMENT_FAILED,
+                           transaction_id if success else None, message)
+            if success:
+                return _collection_result(patron_id, 'paid', amount, books, f"Payment successful! {message}", transaction_id)
+            return _collection_result(patron_id, 'failed', amount, books, f"Payment failed: {message}")
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for result in pool.map(charge, charges):
+                results[result['patron_id']] = result
+    
+    return [results[patron_id] for patron_id in dict.fromkeys(patron_ids)]
+
+def _collection_result(patron_id: str, status: str, amount: float = 0.0, books: int = 0,
+                       message: str = "", transaction_id: Optional[str] = None) -> Dict:
+    return {
+        'patron_id': patron_id,
+        'status': status,
+        'amount': amount,
+        'books': books,
+        'message': message,
+        'transaction_id': transaction_id
+    }
@@ -6,9 +6,45 @@ For Assignment 3: You will learn to mock this service in their tests
 since we cannot make actual payment API calls during testing.
 """
 
+import asyncio
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
 import requests
-from typing import Dict, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 import time
+from caching import LRUCache
+
+# Payment statuses that never change once reached (a refund evicts the entry)
+TERMINAL_STATUSES = ("completed", "refunded")
+STATUS_CACHE_SIZE = 10000   # Transactions kept in memory per process
+STATUS_CACHE_TTL = 300.0    # Seconds before a cached status is checked again
+
+
+class PaymentStatusCache(LRUCache):
+    """
+    In-process LRU cache of payment statuses, keyed by transaction ID.
+    
+    Only terminal statuses are stored: a pending payment is always asked
+    again. Entries expire after `ttl` seconds, and a refund made through a
+    gateway in this process evicts its transaction at once.
+    """
+    
+    def __init__(self, max_size: int = STATUS_CACHE_SIZE, ttl: float = STATUS_CACHE_TTL):
+        super().__init__(max_size, ttl)
+    
+    def get(self, transaction_id: str) -> Optional[Dict]:
+        status = super().get(transaction_id)
+        return dict(status) if status is not None else None
+    
+    def put(self, transaction_id: str, status: Dict) -> None:
+        if status.get("status") not in TERMINAL_STATUSES:
+            return
+        super().put(transaction_id, dict(status))
+
+# Shared by every gateway in the process unless one is given its own
+payment_status_cache = PaymentStatusCache()
 
 
 class PaymentGateway:
@@ -22,15 +58,17 @@ class PaymentGateway:
     - Incurring costs or rate limits
     """
     
-    def __init__(self, api_key: str = "test_key_12345"):
+    def __init__(self, api_key: str = "test_key_12345", status_cache: Optional[PaymentStatusCache] = None):
         """
         Initialize payment gateway with API credentials.
         
         Args:
             api_key: API key for authentication (default is test key)
+            status_cache: Cache of terminal payment statuses (default: the shared one)
         """
         self.api_key = api_key
         self.base_url = "https://api.payment-gateway.example.com"
+        self.status_cache = status_cache if status_cache is not None else payment_status_cache
     
     def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
         """
@@ -105,6 +143,7 @@ class PaymentGateway:
             return False, "Invalid refund amount"
         
         refund_id = f"refund_{transaction_id}_{int(time.time())}"
+        self.status_cache.invalidate(transaction_id)
         return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"
     
     def verify_payment_status(self, transaction_id: str) -> Dict:
@@ -120,15 +159,482 @@ class PaymentGateway:
         Returns:
             dict: Payment status information
         """
+        cached = self.status_cache.get(transaction_id)
+        if cached is not None:
+            return cached
+        
         time.sleep(0.3)
         
         if not transaction_id or not transaction_id.startswith("txn_"):
             return {"status": "not_found", "message": "Transaction not found"}
         
         # Simulate status check
-        return {
+        status = {
             "transaction_id": transaction_id,
             "status": "completed",
             "amount": 10.50,
             "timestamp": time.time()
-        }
\ No newline at end of file
+        }
+        self.status_cache.put(transaction_id, status)
+        return status
+    
+    def verify_many(self, transaction_ids: Iterable[str], max_workers: int = 16) -> Dict[str, Dict]:
+        """
+        Check the status of many payment transactions.
+        
+        Cached terminal statuses are answered locally; the remaining
+        transactions are checked in parallel, at most max_workers at a time.
+        A check that raises is reported with status "error".
+        
+        Args:
+            transaction_ids: Transaction IDs to check (repeats are checked once)
+            max_workers: Maximum number of status checks in flight at once
+            
+        Returns:
+            dict: Payment status information by transaction ID, in the order given
+        """
+        statuses = {transaction_id: self.status_cache.get(transaction_id)
+                    for transaction_id in dict.fromkeys(transaction_ids)}
+        missing = [transaction_id for transaction_id, status in statuses.items() if status is None]
+        
+        def verify(transaction_id: str) -> Dict:
+            try:
+                return self.verify_payment_status(transaction_id)
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+        
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+                for transaction_id, status in zip(missing, pool.map(verify, missing)):
+                    statuses[transaction_id] = status
+        return statuses
+
+
+class AsyncPaymentGateway:
+    """
+    asyncio client for the payment gateway HTTP API.
+    
+    Unlike PaymentGateway, one instance is meant to be created per event
+    loop and shared by every payment made on it:
+    - all requests go through a single aiohttp session, so TCP/TLS
+      connections to the gateway are pooled and kept alive;
+    - a semaphore bounds the number of requests in flight;
+    - every request has a timeout, and connection errors, timeouts and
+      429/5xx responses are retried with exponential backoff. Charges and
+      refunds carry an Idempotency-Key header so a retried request is
+      never applied twice by the gateway.
+    
+    Use it as an async context manager, or call close() when done:
+        async with AsyncPaymentGateway() as gateway:
+            success, txn_id, msg = await gateway.process_payment("123456", 10.50, "Late fees")
+    """
+    
+    # HTTP statuses worth retrying: rate limited or gateway temporarily down
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, api_key: str = "test_key_12345",
+                 base_url: str = "https://api.payment-gateway.example.com",
+                 max_concurrency: int = 100, timeout: float = 5.0,
+                 max_retries: int = 2, backoff: float = 0.2,
+                 status_cache: Optional[PaymentStatusCache] = None):
+        """
+        Args:
+            api_key: API key for authentication (default is test key)
+            base_url: Gateway API root URL
+            max_concurrency: Maximum number of requests in flight at once
+            timeout: Seconds allowed for each request attempt
+            max_retries: Retries after the first attempt of a request
+            backoff: Delay before the first retry; doubles on every retry
+            status_cache: Cache of terminal payment statuses (default: the shared one)
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.status_cache = status_cache if status_cache is not None else payment_status_cache
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+        return self._session
+    
+    async def close(self) -> None:
+        """Close the shared HTTP session and its pooled connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _request(self, method: str, path: str, payload: Optional[Dict] = None,
+                       idempotency_key: Optional[str] = None) -> Tuple[int, Dict]:
+        """
+        Send one API request, retrying transient failures.
+        
+        Returns:
+            tuple: (HTTP status: int, JSON body: dict)
+        
+        Raises:
+            aiohttp.ClientError or asyncio.TimeoutError once all retries failed
+        """
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    async with self._get_session().request(
+                        method, f"{self.base_url}{path}", json=payload, headers=headers
+                    ) as response:
+                        if response.status in self.RETRY_STATUSES and attempt < self.max_retries:
+                            await response.read()
+                        else:
+                            body = await response.json(content_type=None) if response.content_length != 0 else {}
+                            return response.status, body or {}
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    raise
+            await asyncio.sleep(delay)
+            delay *= 2
+    
+    async def process_payment(self, patron_id: str, amount: float, description: str = "",
+                              idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        """
+        Process a payment through the external gateway.
+        
+        Args:
+            patron_id: 6-digit patron/customer ID
+            amount: Payment amount in dollars
+            description: Payment description
+            idempotency_key: Key identifying this charge across retries (default: new key)
+            
+        Returns:
+            tuple: (success: bool, transaction_id: str, message: str)
+        """
+        if amount <= 0:
+            return False, "", "Invalid amount: must be greater than 0"
+        
+        if amount > 1000:
+            return False, "", "Payment declined: amount exceeds limit"
+        
+        if len(patron_id) != 6:
+            return False, "", "Invalid patron ID format"
+        
+        status, body = await self._request("POST", "/charges", {
+            "customer_id": patron_id,
+            "amount": amount,
+            "currency": "usd",
+            "description": description
+        }, idempotency_key or str(uuid.uuid4()))
+        
+        if status >= 400:
+            return False, "", body.get("message", f"Payment declined (HTTP {status})")
+        return True, body["id"], f"Payment of ${amount:.2f} processed successfully"
+    
+    async def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        """
+        Refund a previous payment.
+        
+        Args:
+            transaction_id: Original transaction ID to refund
+            amount: Amount to refund
+            
+        Returns:
+            tuple: (success: bool, message: str)
+        """
+        if not transaction_id or not transaction_id.startswith("txn_"):
+            return False, "Invalid transaction ID"
+        
+        if amount <= 0:
+            return False, "Invalid refund amount"
+        
+        status, body = await self._request("POST", "/refunds", {
+            "charge": transaction_id,
+            "amount": amount
+        }, str(uuid.uuid4()))
+        
+        if status >= 400:
+            return False, body.get("message", f"Refund failed (HTTP {status})")
+        self.status_cache.invalidate(transaction_id)
+        return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {body['id']}"
+    
+    async def verify_payment_status(self, transaction_id: str) -> Dict:
+        """
+        Check the status of a payment transaction.
+        
+        Args:
+            transaction_id: Transaction ID to check
+            
+        Returns:
+            dict: Payment status information
+        """
+        if not transaction_id or not transaction_id.startswith("txn_"):
+            return {"status": "not_found", "message": "Transaction not found"}
+        
+        cached = self.status_cache.get(transaction_id)
+        if cached is not None:
+            return cached
+        
+        status, body = await self._request("GET", f"/charges/{transaction_id}")
+        if status == 404:
+            return {"status": "not_found", "message": "Transaction not found"}
+        if status >= 400:
+            return {"status": "error", "message": body.get("message", f"Status check failed (HTTP {status})")}
+        self.status_cache.put(transaction_id, body)
+        return body
+    
+    async def verify_many(self, transaction_ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Check the status of many payment transactions.
+        
+        Cached terminal statuses are answered locally; the remaining checks
+        run concurrently, bounded by max_concurrency. A check that fails
+        after its retries is reported with status "error".
+        
+        Args:
+            transaction_ids: Transaction IDs to check (repeats are checked once)
+            
+        Returns:
+            dict: Payment status information by transaction ID, in the order given
+        """
+        transaction_ids = list(dict.fromkeys(transaction_ids))
+        results = await asyncio.gather(
+            *[self.verify_payment_status(transaction_id) for transaction_id in transaction_ids],
+            return_exceptions=True
+        )
+        return {
+            transaction_id: {"status": "error", "message": str(result) or type(result).__name__}
+            if isinstance(result, Exception) else result
+            for transaction_id, result in zip(transaction_ids, results)
+        }
+
+
+# Upper bounds (seconds) of the gateway latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the gateway while the circuit breaker is open."""
+
+
+class GatewayMetrics:
+    """
+    Per-method call counters and latency histograms for a payment gateway.
+    
+    Histogram buckets are cumulative: each counts the calls that took at
+    most that many seconds, and "+Inf" counts every call.
+    """
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._methods: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+    
+    def _method(self, method: str) -> Dict:
+        if method not in self._methods:
+            self._methods[method] = {
+                'calls': 0,
+                'errors': 0,
+                'slow_calls': 0,
+                'rejected': 0,
+                'total_seconds': 0.0,
+                'latency': [0] * len(self.buckets)
+            }
+        return self._methods[method]
+    
+    def record_call(self, method: str, elapsed: float, error: bool, slow: bool) -> None:
+        with self._lock:
+            counters = self._method(method)
+            counters['calls'] += 1
+            counters['errors'] += error
+            counters['slow_calls'] += slow
+            counters['total_seconds'] += elapsed
+            for index, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    counters['latency'][index] += 1
+    
+    def record_rejected(self, method: str) -> None:
+        with self._lock:
+            self._method(method)['rejected'] += 1
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            methods = {}
+            for method, counters in self._methods.items():
+                latency = {str(bound): count for bound, count in zip(self.buckets, counters['latency'])}
+                latency['+Inf'] = counters['calls']
+                methods[method] = dict(counters, total_seconds=round(counters['total_seconds'], 6), latency=latency)
+            return methods
+
+
+class CircuitBreakerGateway:
+    """
+    Wraps a PaymentGateway with a circuit breaker and latency metrics.
+    
+    The breaker watches the last `window_size` calls. Once at least
+    `minimum_calls` of them were made and the share that raised or took
+    longer than `slow_call_seconds` reaches `failure_rate_threshold`, the
+    circuit opens: every call fails at once with CircuitOpenError instead
+    of tying up a worker on a degraded provider. After `reset_timeout`
+    seconds the circuit is half-open and lets one trial call through; it
+    closes again if that call is healthy and reopens if not.
+    
+    A declined payment is a healthy answer from the gateway; only
+    exceptions and slow calls count as failures.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, gateway: Optional[PaymentGateway] = None, failure_rate_threshold: float = 0.5,
+                 slow_call_seconds: float = 2.0, window_size: int = 20, minimum_calls: int = 5,
+                 reset_timeout: float = 30.0, metrics: Optional[GatewayMetrics] = None):
+        """
+        Args:
+            gateway: Gateway to protect (default: a new PaymentGateway)
+            failure_rate_threshold: Share of failed or slow calls that opens the circuit
+            slow_call_seconds: Calls taking longer than this count as failures
+            window_size: Number of recent calls the failure rate is taken over
+            minimum_calls: Calls needed in the window before the circuit can open
+            reset_timeout: Seconds the circuit stays open before a trial call
+            metrics: Where calls are counted (default: a new GatewayMetrics)
+        """
+        self.gateway = gateway if gateway is not None else PaymentGateway()
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.window_size = window_size
+        self.minimum_calls = minimum_calls
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics if metrics is not None else GatewayMetrics()
+        self.state = self.CLOSED
+        self._outcomes: List[bool] = []   # True for each failed or slow call, oldest first
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+    
+    def _before_call(self, method: str) -> bool:
+        """
+        Returns:
+            True if this call is the half-open trial call, False otherwise
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+        self.metrics.record_rejected(method)
+        raise CircuitOpenError("Payment gateway unavailable, try again later")
+    
+    def _after_call(self, method: str, elapsed: float, error: bool, trial: bool) -> None:
+        slow = elapsed > self.slow_call_seconds
+        self.metrics.record_call(method, elapsed, error, slow)
+        failed = error or slow
+        with self._lock:
+            if trial:
+                # Only the trial call decides a half-open circuit; calls that
+                # started while it was still closed finish here too.
+                self._trial_running = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes = []
+                return
+            if self.state != self.CLOSED:
+                return
+            self._outcomes.append(failed)
+            del self._outcomes[:-self.window_size]
+            if (len(self._outcomes) >= self.minimum_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate_threshold):
+                self._open()
+    
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes = []
+    
+    def _call(self, method: str, *args, **kwargs):
+        trial = self._before_call(method)
+        start = time.monotonic()
+        try:
+            result = getattr(self.gateway, method)(*args, **kwargs)
+        except Exception:
+            self._after_call(method, time.monotonic() - start, True, trial)
+            raise
+        except BaseException:
+            # Interrupted or cancelled, not a gateway failure; just let a
+            # new trial through if this one was it.
+            if trial:
+                with self._lock:
+                    self._trial_running = False
+            raise
+        self._after_call(method, time.monotonic() - start, False, trial)
+        return result
+    
+    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+        return self._call('process_payment', patron_id=patron_id, amount=amount, description=description)
+    
+    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        return self._call('refund_payment', transaction_id, amount)
+    
+    def verify_payment_status(self, transaction_id: str) -> Dict:
+        # Cached statuses never reach the gateway, so they are answered even while the circuit is open
+        status_cache = getattr(self.gateway, 'status_cache', None)
+        if status_cache is not None:
+            cached = status_cache.get(transaction_id)
+            if cached is not None:
+                return cached
+        return self._call('verify_payment_status', transaction_id)
+    
+    def verify_many(self, transaction_ids: Iterable[str], max_workers: int = 16) -> Dict[str, Dict]:
+        """Check many transactions; see PaymentGateway.verify_many(). Each gateway call goes through the breaker."""
+        transaction_ids = list(dict.fromkeys(transaction_ids))
+        
+        def verify(transaction_id: str) -> Dict:
+            try:
+                return self.verify_payment_status(transaction_id)
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(transaction_ids)))) as pool:
+            return dict(zip(transaction_ids, pool.map(verify, transaction_ids)))
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            state = self.state
+            window = list(self._outcomes)
+        return {
+            'state': state,
+            'recent_calls': len(window),
+            'recent_failure_rate': round(sum(window) / len(window), 4) if window else 0.0,
+            'methods': self.metrics.snapshot()
+        }
+
+
+_default_gateway: Optional[CircuitBreakerGateway] = None
+_default_gateway_lock = threading.Lock()
+
+def get_payment_gateway() -> CircuitBreakerGateway:
+    """The process-wide payment gateway, behind a circuit breaker, used when no gateway is passed in."""
+    global _default_gateway
+    with _default_gateway_lock:
+        if _default_gateway is None:
+            _default_gateway = CircuitBreakerGateway(PaymentGateway())
+        return _default_gateway
@@ -0,0 +1,95 @@
+import gzip
+import json
+from datetime import datetime
+import pytest
+from flask.json.provider import DefaultJSONProvider
+from app import create_app
+from database import insert_book
+from routes import api_encoding
+from routes.api_encoding import parse_fields
+
+#Use a fresh database file with enough books to make compression worthwhile
+@pytest.fixture
+def client(fresh_app):
+    for i in range(30):
+        insert_book(f"Test Book {i}", "Test Author", f"{1234567890000 + i}", 2, 2)
+    return fresh_app.test_client()
+
+#orjson output decodes to the same JSON as the stdlib encoder's
+def test_provider_matches_default():
+    app = create_app()
+    data = {'b': 1, 'a': [1.5, None, "é"], 'date': datetime(2025, 1, 2, 3, 4, 5)}
+    with app.app_context():
+        fast = app.json.dumps(data)
+        app.json = DefaultJSONProvider(app)
+        default = app.json.dumps(data)
+    assert json.loads(fast) == json.loads(default)
+    assert fast.index('"a"') < fast.index('"b"')
+
+#Responses differ from the default provider's only in how non-ASCII text is written
+def test_provider_response_matches_default():
+    app = create_app()
+    data = {'b': 1, 'a': [1.5, None], 'title': "Café"}
+    with app.app_context():
+        fast = app.json.response(data).get_data()
+        app.json = DefaultJSONProvider(app)
+        default = app.json.response(data).get_data()
+    assert fast.endswith(b"\n")
+    assert fast == default.replace(b"\\u00e9", "é".encode())
+
+#Without orjson the provider falls back to the stdlib
+def test_provider_without_orjson(monkeypatch):
+    monkeypatch.setattr(api_encoding, 'orjson', None)
+    app = create_app()
+    with app.app_context():
+        assert json.loads(app.json.dumps({'a': 1})) == {'a': 1}
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields('title, id') == ['title', 'id']
+    with pytest.raises(ValueError):
+        parse_fields('title,password')
+
+def test_fields_projection(client):
+    response = client.get('/api/search?q=Test&fields=id,title')
+    assert response.status_code == 200
+    assert all(set(book) == {'id', 'title'} for book in response.json['results'])
+
+    response = client.get('/api/search?q=Test&fields=secret')
+    assert response.status_code == 400
+    assert 'Unknown fields: secret' in response.json['error']
+
+def test_gzip(client, monkeypatch):
+    monkeypatch.setattr(api_encoding, 'brotli', None)
+    plain = client.get('/api/search?q=Test')
+    response = client.get('/api/search?q=Test', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+    assert len(response.data) < len(plain.data)
+    #The compressed copy has its own ETag
+    assert response.get_etag()[0] == plain.get_etag()[0] + '-gzip'
+
+def test_brotli_preferred(client):
+    brotli = pytest.importorskip('brotli')
+    plain = client.get('/api/search?q=Test')
+    response = client.get('/api/search?q=Test', headers={'Accept-Encoding': 'gzip, br'})
+
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.data)) == plain.json
+
+#Revalidating a compressed copy still gets a 304
+def test_compressed_revalidation(client):
+    response = client.get('/api/search?q=Test', headers={'Accept-Encoding': 'gzip'})
+    etag = response.get_etag()[0]
+
+    response = client.get('/api/search?q=Test', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.get_etag()[0] == etag
+
+#Small responses and clients without Accept-Encoding get plain JSON
+def test_not_compressed(client):
+    assert 'Content-Encoding' not in client.get('/api/search?q=Test').headers
+    response = client.get('/api/search?q=Test&limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
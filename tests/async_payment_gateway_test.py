@@ -0,0 +1,237 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from services.payment_service import AsyncPaymentGateway, PaymentStatusCache
+from services.library_service import pay_late_fees_async, refund_late_fee_payment_async
+
+FAKE_book = {'book_id': 1, 'title': 'Test Book', 'available_copies': 1}
+FAKE_calculate_late_fee = {'fee_amount': 6.5, 'days_overdue': 10, 'status': 'Late fee calculated'}
+
+
+#A local stand-in for the payment gateway HTTP API
+class StubGateway:
+    def __init__(self):
+        self.delay = 0.0           #Seconds each request takes
+        self.fail_next = 0         #Number of upcoming requests answered with 503
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def handle(self, handler):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failing = self.fail_next > 0
+            if failing:
+                self.fail_next -= 1
+        try:
+            time.sleep(self.delay)
+            length = int(handler.headers.get('Content-Length') or 0)
+            body = json.loads(handler.rfile.read(length)) if length else None
+            with self.lock:
+                self.requests.append((handler.command, handler.path, body, dict(handler.headers)))
+            if failing:
+                return 503, {'message': 'Try again later'}
+            if handler.command == 'POST' and handler.path == '/charges':
+                return 200, {'id': f"txn_{body['customer_id']}_{len(self.requests)}", 'status': 'completed'}
+            if handler.command == 'POST' and handler.path == '/refunds':
+                return 200, {'id': f"refund_{body['charge']}", 'status': 'refunded'}
+            if handler.command == 'GET' and handler.path.startswith('/charges/txn_'):
+                return 200, {'transaction_id': handler.path.split('/')[-1], 'status': 'completed'}
+            return 404, {'message': 'Not found'}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def stub():
+    stub = StubGateway()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def respond(self):
+            status, body = stub.handle(self)
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = respond
+        do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    stub.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield stub
+    server.shutdown()
+    server.server_close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+#A payment goes to the gateway with the API key and an idempotency key
+def test_process_payment(stub):
+    async def pay():
+        async with AsyncPaymentGateway(base_url=stub.url) as gateway:
+            return await gateway.process_payment("123456", 6.5, "Late fees")
+
+    success, transaction_id, message = run(pay())
+    assert success is True
+    assert transaction_id.startswith("txn_123456")
+    assert "$6.50" in message
+
+    method, path, body, headers = stub.requests[0]
+    assert (method, path) == ('POST', '/charges')
+    assert body['amount'] == 6.5
+    assert headers['Authorization'] == "Bearer test_key_12345"
+    assert headers['Idempotency-Key']
+
+#Invalid payments are refused without calling the gateway
+def test_process_payment_invalid_amount(stub):
+    async def pay():
+        async with AsyncPaymentGateway(base_url=stub.url) as gateway:
+            return await gateway.process_payment("123456", 0)
+
+    assert run(pay())[0] is False
+    assert stub.requests == []
+
+#Temporary failures are retried with the same idempotency key
+def test_retry_on_unavailable(stub):
+    stub.fail_next = 2
+
+    async def pay():
+        async with AsyncPaymentGateway(base_url=stub.url, backoff=0.01) as gateway:
+            return await gateway.process_payment("123456", 6.5)
+
+    assert run(pay())[0] is True
+    assert len(stub.requests) == 3
+    assert len({headers['Idempotency-Key'] for _, _, _, headers in stub.requests}) == 1
+
+#Once the retries are used up the failure is reported
+def test_retries_exhausted(stub):
+    stub.fail_next = 10
+
+    async def pay():
+        async with AsyncPaymentGateway(base_url=stub.url, max_retries=1, backoff=0.01) as gateway:
+            return await gateway.process_payment("123456", 6.5)
+
+    success, transaction_id, message = run(pay())
+    assert success is False
+    assert message == "Try again later"
+    assert len(stub.requests) == 2
+
+#Slow responses time out
+def test_timeout(stub):
+    stub.delay = 0.5
+
+    async def pay():
+        async with AsyncPaymentGateway(base_url=stub.url, timeout=0.1, max_retries=0) as gateway:
+            return await gateway.process_payment("123456", 6.5)
+
+    with pytest.raises(asyncio.TimeoutError):
+        run(pay())
+
+#Many payments run at once, but never more than max_concurrency
+def test_concurrent_payments_are_bounded(stub):
+    stub.delay = 0.1
+
+    async def pay_all():
+        async with AsyncPaymentGateway(base_url=stub.url, max_concurrency=5) as gateway:
+            return await asyncio.gather(*[
+                gateway.process_payment(f"{100000 + i}", 1.0) for i in range(20)
+            ])
+
+    start = time.monotonic()
+    results = run(pay_all())
+    elapsed = time.monotonic() - start
+
+    assert all(success for success, _, _ in results)
+    assert stub.max_in_flight <= 5
+    #20 requests of 0.1 s, 5 at a time: about 0.4 s instead of 2 s one by one
+    assert elapsed < 1.5
+
+def test_refund_and_verify(stub):
+    async def refund_and_verify():
+        async with AsyncPaymentGateway(base_url=stub.url) as gateway:
+            refund = await gateway.refund_payment("txn_123456_1", 6.5)
+            status = await gateway.verify_payment_status("txn_123456_1")
+            return refund, status
+
+    (success, message), status = run(refund_and_verify())
+    assert success is True
+    assert "Refund ID: refund_txn_123456_1" in message
+    assert status['status'] == 'completed'
+
+#The async service functions work with the shared gateway
+def test_pay_late_fees_async(stub, mocker):
+    mocker.patch("services.library_service.calculate_late_fee_for_book", return_value=FAKE_calculate_late_fee)
+    mocker.patch("services.library_service.get_book_by_id", return_value=FAKE_book)
+
+    async def pay():
+        async with AsyncPaymentGateway(base_url=stub.url) as gateway:
+            return await pay_late_fees_async("123456", 1, gateway)
+
+    success, message, transaction_id = run(pay())
+    assert success is True
+    assert "Payment successful!" in message
+    assert stub.requests[0][2]['description'] == "Late fees for 'Test Book'"
+
+def test_pay_late_fees_async_invalid_patron(stub):
+    success, message, transaction_id = run(pay_late_fees_async("12", 1, AsyncPaymentGateway(base_url=stub.url)))
+    assert success is False
+    assert "Invalid patron ID" in message
+    assert stub.requests == []
+
+def test_refund_late_fee_payment_async(stub):
+    async def refund():
+        async with AsyncPaymentGateway(base_url=stub.url) as gateway:
+            return await refund_late_fee_payment_async("txn_123456_1", 5.0, gateway)
+
+    success, message = run(refund())
+    assert success is True
+    assert run(refund_late_fee_payment_async("txn_123456_1", 20.0))[1] == "Refund amount exceeds maximum late fee."
+
+#Batch status checks run concurrently; completed payments are then served from the cache
+def test_verify_many(stub):
+    async def verify():
+        async with AsyncPaymentGateway(base_url=stub.url, status_cache=PaymentStatusCache()) as gateway:
+            first = await gateway.verify_many([f"txn_123456_{i}" for i in range(10)] + ["bad_id"])
+            second = await gateway.verify_many([f"txn_123456_{i}" for i in range(10)])
+            return first, second
+
+    first, second = run(verify())
+    assert first["txn_123456_4"]['status'] == 'completed'
+    assert first["bad_id"]['status'] == 'not_found'
+    assert second == {transaction_id: status for transaction_id, status in first.items() if transaction_id != "bad_id"}
+    assert len(stub.requests) == 10
+
+#Checks that keep failing or time out are reported without failing the whole batch
+def test_verify_many_reports_errors(stub):
+    stub.fail_next = 1
+
+    async def verify():
+        async with AsyncPaymentGateway(base_url=stub.url, max_retries=0, timeout=0.3,
+                                       status_cache=PaymentStatusCache()) as gateway:
+            unavailable = await gateway.verify_many(["txn_123456_1"])
+            stub.delay = 0.5
+            timed_out = await gateway.verify_many(["txn_123456_2"])
+            return unavailable, timed_out
+
+    unavailable, timed_out = run(verify())
+    assert unavailable["txn_123456_1"] == {'status': 'error', 'message': 'Try again later'}
+    assert timed_out["txn_123456_2"]['status'] == 'error'
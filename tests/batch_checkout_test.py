@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+import pytest
+import database
+from database import get_book_by_isbn, get_patron_borrow_count, insert_book, insert_borrow_record
+from services.library_service import borrow_books_by_patron, return_books_by_patron
+
+#Use a fresh database file for every test
+@pytest.fixture
+def book_ids(fresh_app):
+    for i in range(7):
+        insert_book(f"Test Book {i}", "Test Author", f"{1234567890000 + i}", 1, 1)
+    return [get_book_by_isbn(f"{1234567890000 + i}")['id'] for i in range(7)]
+
+def test_borrow_batch(book_ids):
+    success, message, results = borrow_books_by_patron("123456", book_ids[:3])
+
+    assert success == True
+    assert message == "Borrowed 3 of 3 books."
+    assert [result['book_id'] for result in results] == book_ids[:3]
+    assert all(result['success'] for result in results)
+    assert get_patron_borrow_count("123456") == 3
+    assert get_book_by_isbn("1234567890000")['available_copies'] == 0
+
+#The limit is checked once: books past the fifth loan are refused
+def test_borrow_batch_limit(book_ids):
+    borrow_books_by_patron("123456", book_ids[:2])
+    success, message, results = borrow_books_by_patron("123456", book_ids[2:6])
+
+    assert message == "Borrowed 3 of 4 books."
+    assert [result['success'] for result in results] == [True, True, True, False]
+    assert "maximum borrowing limit of 5" in results[3]['message']
+    assert get_patron_borrow_count("123456") == 5
+    assert get_book_by_isbn("1234567890005")['available_copies'] == 1
+
+#Unavailable and unknown books only fail their own item
+def test_borrow_batch_mixed(book_ids):
+    borrow_books_by_patron("654321", [book_ids[0]])
+    success, message, results = borrow_books_by_patron("123456", [book_ids[0], 99999, book_ids[1]])
+
+    assert success == True
+    assert [result['message'] for result in results[:2]] == ["This book is currently not available.", "Book not found."]
+    assert results[2]['success'] == True
+    assert get_patron_borrow_count("123456") == 1
+
+def test_batch_rejected(book_ids):
+    assert borrow_books_by_patron("12345", book_ids[:1]) == (False, "Invalid patron ID. Must be exactly 6 digits.", [])
+    assert borrow_books_by_patron("123456", [])[1] == "At least one book ID is required."
+    assert return_books_by_patron("123456", list(range(51)))[1] == "At most 50 books can be handled at once."
+
+def test_return_batch(book_ids):
+    now = datetime.now()
+    borrow_books_by_patron("123456", book_ids[:2])
+    insert_borrow_record("123456", book_ids[2], now - timedelta(days=30), now - timedelta(days=16))
+
+    success, message, results = return_books_by_patron("123456", [book_ids[0], book_ids[2], book_ids[3]])
+
+    assert message == "Returned 2 of 3 books."
+    assert results[0]['message'] == 'Successfully returned "Test Book 0". No late fees.'
+    assert "Late fee: $" in results[1]['message']
+    assert results[2]['success'] == False
+    assert get_patron_borrow_count("123456") == 1
+    assert get_book_by_isbn("1234567890000")['available_copies'] == 1
+
+#The whole batch is one request on one connection
+def test_batch_api(fresh_app, book_ids, monkeypatch):
+    client = fresh_app.test_client()
+    pool = database.get_pool()
+    acquired = []
+    original_acquire = pool.acquire
+    monkeypatch.setattr(pool, 'acquire', lambda: acquired.append(1) or original_acquire())
+
+    response = client.post('/api/borrow/batch', json={'patron_id': "123456", 'book_ids': book_ids[:5]})
+    assert response.status_code == 200
+    assert response.json['message'] == "Borrowed 5 of 5 books."
+    assert len(acquired) == 1
+
+    response = client.post('/api/return/batch', json={'patron_id': "123456", 'book_ids': book_ids[:5]})
+    assert response.status_code == 200
+    assert all(result['success'] for result in response.json['results'])
+    assert get_patron_borrow_count("123456") == 0
+
+def test_batch_api_bad_request(fresh_app, book_ids):
+    client = fresh_app.test_client()
+    assert client.post('/api/borrow/batch', json={'patron_id': "123456", 'book_ids': "1,2"}).status_code == 400
+    assert client.post('/api/return/batch', json={'patron_id': "123456", 'book_ids': [True]}).status_code == 400
+    response = client.post('/api/borrow/batch', json={'patron_id': "abc", 'book_ids': [1]})
+    assert response.status_code == 400
+    assert response.json['error'] == "Invalid patron ID. Must be exactly 6 digits."
@@ -0,0 +1,141 @@
+import pytest
+import caching
+from app import create_app
+from database import (
+    BookCache, book_cache, get_book_by_id, get_book_by_isbn, get_db_connection,
+    update_book_availability
+)
+from services.library_service import add_book_to_catalog, borrow_book_by_patron
+
+#Assume database alread exist
+
+#Clean the database. Add a sample book.
+def clean_database():
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books')
+    conn.execute('DELETE FROM borrow_records')
+    conn.commit()
+    conn.close()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 5)
+    book_cache.clear()
+    return get_book_by_isbn("1234567890123")['id']
+
+#The second lookup of a book is served from the cache
+def test_book_lookup_is_cached():
+    book_id = clean_database()
+    hits = book_cache.hits
+
+    get_book_by_id(book_id)
+    assert book_cache.hits == hits + 1
+    get_book_by_isbn("1234567890123")
+    assert book_cache.hits == hits + 2
+
+#Changing the cached copy does not change the cache
+def test_cached_book_is_a_copy():
+    book_id = clean_database()
+    get_book_by_id(book_id)['title'] = "Changed"
+    assert get_book_by_id(book_id)['title'] == "Test Book"
+
+#update_book_availability and borrowing evict the cached book
+def test_writes_evict_cached_book():
+    book_id = clean_database()
+    get_book_by_id(book_id)
+
+    update_book_availability(book_id, -1)
+    assert get_book_by_id(book_id)['available_copies'] == 4
+
+    borrow_book_by_patron("123456", book_id)
+    assert get_book_by_id(book_id)['available_copies'] == 3
+
+#Plain SQL through a pooled connection also evicts the cached book
+def test_direct_sql_evicts_cached_book():
+    book_id = clean_database()
+    get_book_by_isbn("1234567890123")
+
+    conn = get_db_connection()
+    conn.execute("UPDATE books SET title = 'New Title' WHERE id = ?", (book_id,))
+    conn.commit()
+    conn.close()
+    assert get_book_by_isbn("1234567890123")['title'] == "New Title"
+
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books WHERE id = ?', (book_id,))
+    conn.commit()
+    conn.close()
+    assert get_book_by_id(book_id) is None
+    assert get_book_by_isbn("1234567890123") is None
+
+#A rolled back change leaves the database as it was, and the next lookup sees that
+def test_rolled_back_change_is_not_cached():
+    book_id = clean_database()
+    get_book_by_id(book_id)
+
+    conn = get_db_connection()
+    conn.execute('UPDATE books SET available_copies = 0 WHERE id = ?', (book_id,))
+    conn.close()
+    assert get_book_by_id(book_id)['available_copies'] == 5
+
+#The least recently used book is dropped when the cache is full
+def test_cache_is_bounded():
+    cache = BookCache(max_size=2, ttl=60)
+    for book_id in (1, 2):
+        cache.put({'id': book_id, 'isbn': f"{book_id:013d}"})
+    cache.get_by_id(1)
+    cache.put({'id': 3, 'isbn': "0000000000003"})
+
+    assert cache.get_by_id(2) is None
+    assert cache.get_by_isbn("0000000000002") is None
+    assert cache.get_by_id(1) is not None
+    assert cache.stats()['size'] == 2
+
+#Books expire after the TTL
+def test_cache_entries_expire(monkeypatch):
+    cache = BookCache(max_size=10, ttl=30)
+    now = [1000.0]
+    monkeypatch.setattr(caching.time, 'monotonic', lambda: now[0])
+
+    cache.put({'id': 1, 'isbn': "0000000000001"})
+    now[0] += 29
+    assert cache.get_by_id(1) is not None
+    now[0] += 2
+    assert cache.get_by_id(1) is None
+
+def test_cache_stats():
+    cache = BookCache(max_size=10, ttl=60)
+    cache.put({'id': 1, 'isbn': "0000000000001"})
+    cache.get_by_id(1)
+    cache.get_by_id(2)
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+#A row read before an eviction is not put back into the cache after it
+def test_stale_put_is_dropped():
+    cache = BookCache(max_size=10, ttl=60)
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.put({'id': 1, 'isbn': "0000000000001"}, generation)
+    assert cache.get_by_id(1) is None
+
+    cache.put({'id': 1, 'isbn': "0000000000001"}, cache.generation())
+    assert cache.get_by_id(1) is not None
+
+#A book read inside the request's open transaction is not cached, so other
+#threads never see the uncommitted row
+def test_uncommitted_book_is_not_cached():
+    book_id = clean_database()
+    app = create_app()
+    seen = []
+
+    @app.route('/change-then-fail')
+    def change_then_fail():
+        update_book_availability(book_id, -5)
+        seen.append(get_book_by_id(book_id)['available_copies'])
+        seen.append(book_cache.get_by_id(book_id))
+        raise RuntimeError("view failed")
+
+    assert app.test_client().get('/change-then-fail').status_code == 500
+    assert seen == [0, None]
+    assert get_book_by_id(book_id)['available_copies'] == 5
@@ -93,6 +93,65 @@ def test_return_book_not_exits_borrow_record():
     assert sucess == False
     assert "Patron haven't borrowed this book or it has already been returned." in message
 
+#Returning an overdue book reports the late fee and stores it on the record
+def test_return_book_overdue_records_late_fee():
+    clean_database()
+    add_book_to_catalog("Test Book", "Test Author", "1234512345123", 1)
+    
+    books = get_all_books()
+    book_id = books[0]['id']
+    patron_id = "654321"
+    
+    #Borrowed 24 days ago, so 10 days overdue
+    borrow_date = datetime.now() - timedelta(days=24)
+    due_date = borrow_date + timedelta(days=14)
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+        VALUES (?, ?, ?, ?)
+    ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+    conn.execute('UPDATE books SET available_copies = 0 WHERE id = ?', (book_id,))
+    conn.commit()
+    conn.close()
+    
+    sucess, message = return_book_by_patron(patron_id, book_id)
+    assert sucess == True
+    assert "Late fee: $6.50 for 10 days overdue." in message
+    
+    conn = get_db_connection()
+    record = conn.execute('SELECT * FROM borrow_records WHERE patron_id = ?', (patron_id,)).fetchone()
+    conn.close()
+    assert record['return_date'] is not None
+    assert record['late_fee'] == 6.5
+    assert get_all_books()[0]['available_copies'] == 1
+
+#Returning one of several copies closes only one loan
+def test_return_book_closes_one_loan():
+    clean_database()
+    add_book_to_catalog("Test Book", "Test Author", "1234512345123", 3)
+    
+    books = get_all_books()
+    book_id = books[0]['id']
+    patron_id = "654321"
+    borrow_book_by_patron(patron_id, book_id)
+    borrow_book_by_patron(patron_id, book_id)
+    
+    sucess, message = return_book_by_patron(patron_id, book_id)
+    assert sucess == True
+    assert "No late fees." in message
+    assert get_patron_borrow_count(patron_id) == 1
+    assert get_all_books()[0]['available_copies'] == 2
+
+#A failed return leaves the book availability unchanged
+def test_return_book_not_borrowed_keeps_availability():
+    clean_database()
+    add_book_to_catalog("Test Book", "Test Author", "1234512345123", 2)
+    
+    book_id = get_all_books()[0]['id']
+    sucess, message = return_book_by_patron("654321", book_id)
+    assert sucess == False
+    assert get_all_books()[0]['available_copies'] == 2
+
 """ 
 GPT-5 test case
 class TestBookReturn:
@@ -1,4 +1,6 @@
 import pytest
+from app import create_app
+from routes import search_routes
 from database import get_all_books, get_db_connection, get_patron_borrow_count, get_patron_borrowed_books
 from services.library_service import (
     add_book_to_catalog,
@@ -68,6 +70,114 @@ def test_search_books_in_catalog_with_not_exist_isbn():
     
     #The return should be empty which is len 0 for not exist ISBN
     assert len(search_books_in_catalog("1234567891234", "isbn")) == 0
+
+#Partial title match in the middle of a word
+def test_search_books_in_catalog_title_substring():
+    clean_database()
+    add_book_to_catalog("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565", 3)
+    add_book_to_catalog("1984", "George Orwell", "9780451524935", 1)
+    
+    results = search_books_in_catalog("atsb", "title")
+    assert len(results) == 1
+    assert results[0]['title'] == "The Great Gatsby"
+
+#Terms shorter than 3 characters still do partial matching
+def test_search_books_in_catalog_short_term():
+    clean_database()
+    add_book_to_catalog("1984", "George Orwell", "9780451524935", 1)
+    add_book_to_catalog("Animal Farm", "George Orwell", "9780451526342", 1)
+    
+    assert len(search_books_in_catalog("19", "title")) == 1
+    assert len(search_books_in_catalog("or", "author")) == 2
+
+#Special characters are matched literally
+def test_search_books_in_catalog_special_characters():
+    clean_database()
+    add_book_to_catalog('The "Quoted" Book', "Test Author", "1234567892235", 1)
+    add_book_to_catalog("100% Book", "Test Author", "1234567891235", 1)
+    
+    assert len(search_books_in_catalog('"Quoted"', "title")) == 1
+    assert len(search_books_in_catalog("0%", "title")) == 1
+    assert len(search_books_in_catalog("_", "title")) == 0
+
+#The number of results can be limited
+def test_search_books_in_catalog_limit():
+    clean_database()
+    for i in range(5):
+        add_book_to_catalog(f"Test Book {i}", "Test Author", f"123456789123{i}", 1)
+    
+    assert len(search_books_in_catalog("Test Book", "title")) == 5
+    assert len(search_books_in_catalog("Test Book", "title", limit=2)) == 2
+
+#Results can be paged with an offset, without gaps or repeats
+def test_search_books_in_catalog_offset():
+    clean_database()
+    for i in range(5):
+        add_book_to_catalog(f"Test Book {i}", "Test Author", f"123456789123{i}", 1)
+    
+    first = search_books_in_catalog("Test Book", "title", limit=3)
+    second = search_books_in_catalog("Test Book", "title", limit=3, offset=3)
+    assert len(first) == 3 and len(second) == 2
+    assert {book['id'] for book in first + second} == {book['id'] for book in search_books_in_catalog("Test Book", "title")}
+
+#The search page links to the next page of results
+def test_search_page_paging(monkeypatch):
+    clean_database()
+    for i in range(5):
+        add_book_to_catalog(f"Test Book {i}", "Test Author", f"123456789123{i}", 1)
+    monkeypatch.setattr(search_routes, 'SEARCH_PER_PAGE', 3)
+    client = create_app().test_client()
+    
+    html = client.get('/search?q=Test+Book&type=title').get_data(as_text=True)
+    assert html.count('name="book_id"') == 3
+    assert 'page=2' in html and 'Previous Page' not in html
+    
+    html = client.get('/search?q=Test+Book&type=title&page=2').get_data(as_text=True)
+    assert html.count('name="book_id"') == 2
+    assert 'Previous Page' in html and 'Next Page' not in html
+
+#A page number too large for SQLite shows an empty page instead of failing
+def test_search_page_out_of_range():
+    client = create_app().test_client()
+    response = client.get('/search?q=Test+Book&type=title&page=100000000000000000000')
+    assert response.status_code == 200
+
+#The search API pages with offset and says whether more results follow
+def test_search_api_offset_and_has_more():
+    clean_database()
+    for i in range(5):
+        add_book_to_catalog(f"Test Book {i}", "Test Author", f"123456789123{i}", 1)
+    client = create_app().test_client()
+    
+    first = client.get('/api/search?q=Test+Book&limit=3').get_json()
+    assert first['count'] == 3 and first['has_more'] is True
+    
+    second = client.get('/api/search?q=Test+Book&limit=3&offset=3').get_json()
+    assert second['count'] == 2 and second['has_more'] is False
+    assert second['offset'] == 3
+    assert {b['id'] for b in first['results'] + second['results']} == {b['id'] for b in search_books_in_catalog("Test Book", "title")}
+
+#Negative or oversized offsets are rejected
+def test_search_api_invalid_offset():
+    client = create_app().test_client()
+    assert client.get('/api/search?q=Test&offset=-1').status_code == 400
+    assert client.get('/api/search?q=Test&offset=100000000000000000000').status_code == 400
+
+#The search index follows title changes and deleted books
+def test_search_books_in_catalog_index_stays_in_sync():
+    clean_database()
+    add_book_to_catalog("Old Title", "Test Author", "1234567892235", 1)
+    
+    conn = get_db_connection()
+    conn.execute("UPDATE books SET title = 'New Title' WHERE isbn = '1234567892235'")
+    conn.commit()
+    conn.close()
+    
+    assert len(search_books_in_catalog("Old Title", "title")) == 0
+    assert len(search_books_in_catalog("New Title", "title")) == 1
+    
+    clean_database()
+    assert len(search_books_in_catalog("New Title", "title")) == 0
     
 """ GPT-5
 class TestBookSearch:
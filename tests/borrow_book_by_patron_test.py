@@ -1,3 +1,4 @@
+import threading
 import pytest
 from datetime import datetime, timedelta
 from database import get_all_books, get_db_connection, get_patron_borrow_count, get_patron_borrowed_books
@@ -114,4 +115,50 @@ def test_borrow_book_too_much_borrow():
     assert success == False
     assert "You have reached the maximum borrowing limit of 5 books" in message
     
-    
\ No newline at end of file
+    
+#Many patrons race for the last copies, only as many as there are copies can win
+def test_borrow_book_concurrent_last_copies():
+    clean_database()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 3)
+    
+    book_id = get_all_books()[0]['id']
+    results = []
+    
+    def borrow(patron_id):
+        results.append(borrow_book_by_patron(patron_id, book_id)[0])
+    
+    threads = [threading.Thread(target=borrow, args=(f"{100000 + i}",)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert results.count(True) == 3
+    assert get_all_books()[0]['available_copies'] == 0
+    
+    #Every successful borrow has its record, and nothing more
+    conn = get_db_connection()
+    record_count = conn.execute('SELECT COUNT(*) FROM borrow_records WHERE book_id = ?', (book_id,)).fetchone()[0]
+    conn.close()
+    assert record_count == 3
+
+#One patron borrowing concurrently can never go over the limit
+def test_borrow_book_concurrent_limit():
+    clean_database()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 20)
+    
+    book_id = get_all_books()[0]['id']
+    results = []
+    
+    def borrow():
+        results.append(borrow_book_by_patron("123456", book_id)[0])
+    
+    threads = [threading.Thread(target=borrow) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert results.count(True) == 5
+    assert get_patron_borrow_count("123456") == 5
+    assert get_all_books()[0]['available_copies'] == 15
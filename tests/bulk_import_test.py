@@ -0,0 +1,108 @@
+import json
+import pytest
+from app import create_app
+from database import get_all_books, get_book_by_isbn, get_db_connection
+from services.import_service import import_books_from_file
+from services.library_service import add_book_to_catalog
+
+#Assume database alread exist
+
+#Clean the database.
+def clean_database():
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books')
+    conn.execute('DELETE FROM borrow_records')
+    conn.commit()
+    conn.close()
+
+CSV_FEED = """title,author,isbn,total_copies
+Book One,Author One,1000000000001,3
+Book Two,Author Two,1000000000002,1
+,No Title,1000000000003,1
+Book Four,Author Four,12345,1
+Book Five,Author Five,1000000000005,zero
+Book One Again,Author One,1000000000001,2
+Already There,Someone,1234567890123,1
+Book Eight,Author Eight,1000000000008,4
+"""
+
+#Valid rows are imported, every bad row is reported with its reason
+def test_import_csv_feed(tmp_path):
+    clean_database()
+    add_book_to_catalog("Existing Book", "Existing Author", "1234567890123", 1)
+    feed = tmp_path / "feed.csv"
+    feed.write_text(CSV_FEED)
+
+    #A small batch size makes the import span several transactions
+    report = import_books_from_file(str(feed), batch_size=2)
+
+    assert report['imported'] == 3
+    reasons = {reject['row']: reject['reason'] for reject in report['rejected']}
+    assert reasons == {
+        4: "Title is required.",
+        5: "ISBN must be exactly 13 digits.",
+        6: "Total copies must be a positive integer.",
+        7: "Duplicate ISBN earlier in the feed.",
+        8: "A book with this ISBN already exists.",
+    }
+
+    book = get_book_by_isbn("1000000000008")
+    assert book['title'] == "Book Eight"
+    assert book['total_copies'] == 4
+    assert book['available_copies'] == 4
+    assert len(get_all_books()) == 4
+
+#JSON Lines feeds work the same way, malformed lines are rejected
+def test_import_jsonl_feed(tmp_path):
+    clean_database()
+    feed = tmp_path / "feed.jsonl"
+    lines = [
+        json.dumps({"title": "Book One", "author": "Author One", "isbn": "1000000000001", "total_copies": 2}),
+        "{not json",
+        "",
+        json.dumps({"title": "Book Two", "author": "Author Two", "isbn": "1000000000002", "total_copies": "5"}),
+        json.dumps(["not", "an", "object"]),
+    ]
+    feed.write_text("\n".join(lines) + "\n")
+
+    report = import_books_from_file(str(feed))
+
+    assert report['imported'] == 2
+    assert [reject['row'] for reject in report['rejected']] == [2, 5]
+    assert get_book_by_isbn("1000000000002")['total_copies'] == 5
+
+#JSON true/false are not copy counts
+def test_import_jsonl_rejects_boolean_copies(tmp_path):
+    clean_database()
+    feed = tmp_path / "feed.jsonl"
+    lines = [
+        json.dumps({"title": "Book One", "author": "Author One", "isbn": "1000000000001", "total_copies": True}),
+        json.dumps({"title": "Book Two", "author": "Author Two", "isbn": "1000000000002", "total_copies": False}),
+    ]
+    feed.write_text("\n".join(lines) + "\n")
+
+    report = import_books_from_file(str(feed))
+
+    assert report['imported'] == 0
+    assert [reject['reason'] for reject in report['rejected']] == ["Total copies must be a positive integer."] * 2
+    assert get_book_by_isbn("1000000000001") is None
+
+#Unknown file types are refused
+def test_import_unknown_format(tmp_path):
+    feed = tmp_path / "feed.txt"
+    feed.write_text("title,author,isbn,total_copies\n")
+    with pytest.raises(ValueError):
+        import_books_from_file(str(feed))
+
+#The flask import-books command prints a summary and the rejects
+def test_import_books_command(tmp_path):
+    clean_database()
+    feed = tmp_path / "feed.csv"
+    feed.write_text(CSV_FEED)
+
+    runner = create_app().test_cli_runner()
+    result = runner.invoke(args=['import-books', str(feed)])
+
+    assert result.exit_code == 0
+    assert "Imported 4 books, rejected 4." in result.output
+    assert "Row 7 rejected (1000000000001): Duplicate ISBN earlier in the feed." in result.output
@@ -0,0 +1,97 @@
+import pytest
+from app import create_app
+from database import get_books_page, get_db_connection
+from routes.catalog_routes import encode_cursor, decode_cursor
+from services.library_service import add_book_to_catalog
+
+#Assume database alread exist
+
+#Clean the database.
+def clean_database():
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books')
+    conn.execute('DELETE FROM borrow_records')
+    conn.commit()
+    conn.close()
+
+#Add books whose titles sort in a known order (two share a title)
+def add_books():
+    add_book_to_catalog("Book C", "Author", "1000000000003", 1)
+    add_book_to_catalog("Book A", "Author", "1000000000001", 1)
+    add_book_to_catalog("Book B", "Author", "1000000000002", 1)
+    add_book_to_catalog("Book B", "Author", "1000000000004", 1)
+    add_book_to_catalog("Book D", "Author", "1000000000005", 1)
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    return app.test_client()
+
+#Walking the pages returns every book once, in title order
+def test_get_books_page_walks_whole_catalog():
+    clean_database()
+    add_books()
+
+    seen = []
+    books, cursor = get_books_page(None, 2)
+    seen += books
+    while cursor:
+        books, cursor = get_books_page(cursor, 2)
+        seen += books
+
+    assert [book['isbn'] for book in seen] == [
+        "1000000000001", "1000000000002", "1000000000004", "1000000000003", "1000000000005"
+    ]
+
+#The last page has no next cursor
+def test_get_books_page_last_page():
+    clean_database()
+    add_books()
+
+    books, cursor = get_books_page(None, 5)
+    assert len(books) == 5
+    assert cursor is None
+
+#Cursors survive the round trip through the URL, bad ones are ignored
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(("Book B", 7))) == ("Book B", 7)
+    assert decode_cursor("not-a-cursor") is None
+    assert decode_cursor(None) is None
+
+#Cursors with an id SQLite cannot bind are ignored instead of failing the page
+def test_cursor_id_out_of_range(client):
+    assert decode_cursor(encode_cursor(("Book B", 10 ** 20))) is None
+    assert decode_cursor(encode_cursor(("Book B", -1))) is None
+    response = client.get(f'/catalog?cursor={encode_cursor(("Book B", 10 ** 20))}')
+    assert response.status_code == 200
+
+#The catalog page shows one page of books and a link to the next one
+def test_catalog_route_paginates(client):
+    clean_database()
+    add_books()
+
+    response = client.get('/catalog?per_page=2')
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert "1000000000001" in html
+    assert "1000000000003" not in html
+    assert "Next Page" in html
+
+    _, cursor = get_books_page(None, 2)
+    response = client.get(f'/catalog?per_page=2&cursor={encode_cursor(cursor)}')
+    html = response.get_data(as_text=True)
+    assert "1000000000004" in html
+    assert "1000000000003" in html
+    assert "1000000000001" not in html
+
+#A flashed message is shown once even though the page is streamed
+def test_catalog_route_flash_shown_once(client):
+    clean_database()
+    add_books()
+
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Flash for the catalog')]
+
+    assert "Flash for the catalog" in client.get('/catalog').get_data(as_text=True)
+    assert "Flash for the catalog" not in client.get('/catalog').get_data(as_text=True)
@@ -0,0 +1,206 @@
+import pytest
+from unittest.mock import Mock
+import services.payment_service as payment_service
+from app import create_app
+from services.library_service import pay_late_fees
+from services.payment_service import (
+    CircuitBreakerGateway, CircuitOpenError, PaymentGateway, PaymentStatusCache
+)
+
+FAKE_book = {'book_id': 1, 'title': 'Test Book', 'available_copies': 1}
+FAKE_calculate_late_fee = {'fee_amount': 6.5, 'days_overdue': 10, 'status': 'Late fee calculated'}
+
+#A fake clock, so slow calls and the reset timeout take no real time
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(payment_service.time, 'monotonic', lambda: now[0])
+    return now
+
+def failing_gateway():
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.side_effect = Exception("Connection refused")
+    return gateway
+
+def make_breaker(gateway, **options):
+    options.setdefault('window_size', 10)
+    options.setdefault('minimum_calls', 4)
+    options.setdefault('reset_timeout', 30)
+    return CircuitBreakerGateway(gateway, **options)
+
+#Calls are passed through while the gateway is healthy
+def test_closed_circuit_passes_calls():
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_123456_1", "Payment processed")
+    breaker = make_breaker(gateway)
+
+    assert breaker.process_payment("123456", 6.5, "Late fees") == (True, "txn_123456_1", "Payment processed")
+    gateway.process_payment.assert_called_once_with(patron_id="123456", amount=6.5, description="Late fees")
+    assert breaker.state == 'closed'
+
+#Enough failures open the circuit, then calls fail fast without reaching the gateway
+def test_failures_open_circuit(clock):
+    gateway = failing_gateway()
+    breaker = make_breaker(gateway)
+
+    for _ in range(4):
+        with pytest.raises(Exception, match="Connection refused"):
+            breaker.process_payment("123456", 6.5)
+    assert breaker.state == 'open'
+
+    with pytest.raises(CircuitOpenError):
+        breaker.process_payment("123456", 6.5)
+    assert gateway.process_payment.call_count == 4
+    assert breaker.stats()['methods']['process_payment']['rejected'] == 1
+
+#Declined payments are healthy answers and never open the circuit
+def test_declined_payments_keep_circuit_closed():
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (False, "", "Payment declined")
+    breaker = make_breaker(gateway)
+
+    for _ in range(10):
+        breaker.process_payment("123456", 6.5)
+    assert breaker.state == 'closed'
+
+#Calls slower than the latency threshold count as failures
+def test_slow_calls_open_circuit(clock):
+    gateway = Mock(spec=PaymentGateway)
+
+    def slow_payment(**kwargs):
+        clock[0] += 3.0
+        return True, "txn_123456_1", "Payment processed"
+
+    gateway.process_payment.side_effect = slow_payment
+    breaker = make_breaker(gateway, slow_call_seconds=2.0)
+
+    for _ in range(4):
+        assert breaker.process_payment("123456", 6.5)[0] is True
+    assert breaker.state == 'open'
+    assert breaker.stats()['methods']['process_payment']['slow_calls'] == 4
+
+#After the reset timeout one trial call decides whether the circuit closes
+def test_half_open_trial_call(clock):
+    gateway = failing_gateway()
+    breaker = make_breaker(gateway)
+    for _ in range(4):
+        with pytest.raises(Exception):
+            breaker.process_payment("123456", 6.5)
+
+    #A failed trial opens the circuit again
+    clock[0] += 31
+    assert breaker.stats()['state'] == 'half_open'
+    with pytest.raises(Exception, match="Connection refused"):
+        breaker.process_payment("123456", 6.5)
+    assert breaker.state == 'open'
+
+    #A healthy trial closes it
+    clock[0] += 31
+    gateway.process_payment.side_effect = None
+    gateway.process_payment.return_value = (True, "txn_123456_1", "Payment processed")
+    assert breaker.process_payment("123456", 6.5)[0] is True
+    assert breaker.state == 'closed'
+
+#A call that started before the circuit opened cannot close it while half-open
+def test_only_trial_call_decides_half_open(clock):
+    gateway = failing_gateway()
+    breaker = make_breaker(gateway)
+    stale = breaker._before_call('process_payment')
+    for _ in range(4):
+        with pytest.raises(Exception):
+            breaker.process_payment("123456", 6.5)
+
+    clock[0] += 31
+    trial = breaker._before_call('process_payment')
+    assert stale is False and trial is True
+    breaker._after_call('process_payment', 0.1, False, stale)
+    assert breaker.state == 'half_open'
+    with pytest.raises(CircuitOpenError):
+        breaker.process_payment("123456", 6.5)
+
+    breaker._after_call('process_payment', 0.1, True, trial)
+    assert breaker.state == 'open'
+
+#An interrupted trial is not a gateway failure and frees the trial slot
+def test_interrupted_trial_call(clock):
+    gateway = failing_gateway()
+    breaker = make_breaker(gateway)
+    for _ in range(4):
+        with pytest.raises(Exception):
+            breaker.process_payment("123456", 6.5)
+
+    clock[0] += 31
+    gateway.process_payment.side_effect = KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        breaker.process_payment("123456", 6.5)
+    assert breaker.state == 'half_open'
+    assert breaker.metrics.snapshot()['process_payment']['errors'] == 4
+
+    gateway.process_payment.side_effect = None
+    gateway.process_payment.return_value = (True, "txn_123456_1", "Payment processed")
+    assert breaker.process_payment("123456", 6.5)[0] is True
+    assert breaker.state == 'closed'
+
+#Latency histograms and error counters per method
+def test_metrics(clock):
+    gateway = Mock(spec=PaymentGateway)
+
+    def payment(**kwargs):
+        clock[0] += 0.2
+        return True, "txn_123456_1", "Payment processed"
+
+    gateway.process_payment.side_effect = payment
+    gateway.refund_payment.side_effect = Exception("Timeout")
+    breaker = make_breaker(gateway)
+
+    breaker.process_payment("123456", 6.5)
+    breaker.process_payment("123456", 6.5)
+    with pytest.raises(Exception):
+        breaker.refund_payment("txn_123456_1", 6.5)
+
+    methods = breaker.stats()['methods']
+    assert methods['process_payment']['calls'] == 2
+    assert methods['process_payment']['errors'] == 0
+    assert methods['process_payment']['latency']['0.1'] == 0
+    assert methods['process_payment']['latency']['0.25'] == 2
+    assert methods['process_payment']['latency']['+Inf'] == 2
+    assert methods['refund_payment']['errors'] == 1
+
+#Cached statuses are answered even while the circuit is open
+def test_cached_status_while_open(clock):
+    gateway = failing_gateway()
+    gateway.status_cache = PaymentStatusCache()
+    gateway.status_cache.put("txn_123456_1", {"status": "completed"})
+    gateway.verify_payment_status.side_effect = Exception("Connection refused")
+    breaker = make_breaker(gateway)
+    for _ in range(4):
+        with pytest.raises(Exception):
+            breaker.process_payment("123456", 6.5)
+
+    statuses = breaker.verify_many(["txn_123456_1", "txn_123456_2"])
+    assert statuses["txn_123456_1"]['status'] == "completed"
+    assert statuses["txn_123456_2"]['status'] == "error"
+    gateway.verify_payment_status.assert_not_called()
+
+#pay_late_fees reports an open circuit as a processing error
+def test_pay_late_fees_fails_fast(mocker, clock):
+    mocker.patch("services.library_service.calculate_late_fee_for_book", return_value=FAKE_calculate_late_fee)
+    mocker.patch("services.library_service.get_book_by_id", return_value=FAKE_book)
+    gateway = failing_gateway()
+    breaker = make_breaker(gateway)
+    for _ in range(4):
+        pay_late_fees("123456", 1, breaker)
+
+    success, message, transaction_id = pay_late_fees("123456", 1, breaker)
+    assert success is False
+    assert message == "Payment processing error: Payment gateway unavailable, try again later"
+    assert gateway.process_payment.call_count == 4
+
+def test_metrics_endpoint():
+    client = create_app().test_client()
+    response = client.get('/api/metrics')
+
+    assert response.status_code == 200
+    assert response.json['payment_gateway']['state'] in ('closed', 'open', 'half_open')
+    assert 'hit_rate' in response.json['book_cache']
+    assert 'hit_rate' in response.json['payment_status_cache']
@@ -0,0 +1,16 @@
+import pytest
+import database
+from app import create_app
+
+#Point the database helpers at an empty database file of the test's own
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'library_test.db')
+    monkeypatch.setattr(database, 'DATABASE', path)
+    yield path
+    database.reset_pool()
+
+#An app on a fresh database, with the schema in place and no books
+@pytest.fixture
+def fresh_app(db_path):
+    return create_app()
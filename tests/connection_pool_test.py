@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import pytest
+import database
+from database import ConnectionPool, get_db_connection, get_pool, DATABASE
+
+#Assume database alread exist
+
+#A closed connection goes back to the pool and is handed out again
+def test_connection_is_reused_after_close():
+    pool = ConnectionPool(DATABASE, size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+
+    assert pool.idle_count() == 1
+    assert pool.acquire() is conn
+    pool.close_all()
+
+#The pool never keeps more idle connections than its size
+def test_pool_keeps_at_most_size_idle_connections():
+    pool = ConnectionPool(DATABASE, size=2)
+    connections = [pool.acquire() for _ in range(4)]
+    assert len({id(conn) for conn in connections}) == 4
+
+    for conn in connections:
+        pool.release(conn)
+    assert pool.idle_count() == 2
+    pool.close_all()
+
+#A broken connection fails the health check and is replaced on checkout
+def test_unhealthy_connection_is_replaced():
+    pool = ConnectionPool(DATABASE, size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()
+
+    new_conn = pool.acquire()
+    assert new_conn is not conn
+    assert new_conn.execute('SELECT 1').fetchone()[0] == 1
+    pool.close_all()
+
+#Uncommitted work is rolled back when a connection is returned
+def test_release_rolls_back_open_transaction():
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO books (title, author, isbn, total_copies, available_copies)
+        VALUES ('Pool Book', 'Pool Author', '9999999999999', 1, 1)
+    ''')
+    conn.close()
+
+    conn = get_db_connection()
+    row = conn.execute("SELECT * FROM books WHERE isbn = '9999999999999'").fetchone()
+    conn.close()
+    assert row is None
+
+#Pooled connections keep row access by column name
+def test_pooled_connection_rows_by_name():
+    conn = get_db_connection()
+    row = conn.execute('SELECT 1 AS one').fetchone()
+    conn.close()
+    assert row['one'] == 1
+
+#Using a connection after close is an error, like a plain sqlite3 connection
+def test_closed_pooled_connection_raises():
+    conn = get_db_connection()
+    conn.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+
+#Connections can be shared by threads, one at a time
+def test_pool_used_from_multiple_threads():
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(20):
+                conn = get_db_connection()
+                conn.execute('SELECT COUNT(*) FROM books').fetchone()
+                conn.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert get_pool().idle_count() <= get_pool().size
+
+#init_database switches the database file to WAL mode
+def test_init_database_enables_wal(db_path):
+    database.init_database()
+
+    conn = get_db_connection()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+
+#Every pooled connection gets the PRAGMAs of the selected profile
+def test_pooled_connections_follow_profile(db_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PROFILE', 'fast')
+
+    database.init_database(profile='durable')
+    conn = get_db_connection()
+    #synchronous: 1 is NORMAL, 2 is FULL
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 2
+    conn.close()
+
+    database.init_database(profile='fast')
+    conn = get_db_connection()
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+    assert conn.execute('PRAGMA temp_store').fetchone()[0] == 2
+    assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+    conn.close()
+
+#Unknown profile names are rejected
+def test_unknown_profile_rejected():
+    with pytest.raises(ValueError):
+        database.init_database(profile='turbo')
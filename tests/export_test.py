@@ -0,0 +1,94 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+import pytest
+import database
+from database import get_book_by_isbn, insert_book, insert_borrow_record, iter_books
+
+#Use a fresh database file for every test
+@pytest.fixture
+def client(fresh_app):
+    for i in range(5):
+        insert_book(f"Test Book {i}", "Test Author", f"{1234567890000 + i}", 2, 2)
+    return fresh_app.test_client()
+
+def ndjson(response):
+    return [json.loads(line) for line in response.data.decode().splitlines()]
+
+#Rows come in batches from one cursor
+def test_iter_books_batches(client):
+    batches = list(iter_books(batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    ids = [book['id'] for batch in batches for book in batch]
+    assert ids == sorted(ids)
+
+def test_export_books_ndjson(client):
+    response = client.get('/api/export/books')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.is_streamed
+    books = ndjson(response)
+    assert [book['title'] for book in books] == [f"Test Book {i}" for i in range(5)]
+
+    #Incremental pull
+    since_id = books[2]['id']
+    assert [book['id'] for book in ndjson(client.get(f'/api/export/books?since_id={since_id}'))] == [books[3]['id'], books[4]['id']]
+
+def test_export_books_csv(client):
+    response = client.get('/api/export/books?format=csv')
+    assert response.mimetype == 'text/csv'
+    assert 'books.csv' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert len(rows) == 5
+    assert rows[0]['title'] == "Test Book 0"
+    assert rows[0]['available_copies'] == '2'
+
+#An empty export still has its CSV header
+def test_export_empty_csv(client):
+    response = client.get('/api/export/borrow_records?format=csv')
+    assert response.data.decode().strip() == 'id,patron_id,book_id,borrow_date,due_date,return_date,late_fee'
+
+def test_export_borrow_records_since(client):
+    book_id = get_book_by_isbn("1234567890000")['id']
+    now = datetime.now()
+    insert_borrow_record("123456", book_id, now - timedelta(days=30), now - timedelta(days=16))
+    insert_borrow_record("654321", book_id, now - timedelta(days=1), now + timedelta(days=13))
+
+    records = ndjson(client.get('/api/export/borrow_records'))
+    assert [record['patron_id'] for record in records] == ["123456", "654321"]
+    assert records[0]['return_date'] is None
+
+    since = (now - timedelta(days=7)).isoformat()
+    records = ndjson(client.get('/api/export/borrow_records', query_string={'since': since}))
+    assert [record['patron_id'] for record in records] == ["654321"]
+
+#A since with a UTC offset is compared in local time, like the stored dates
+def test_export_borrow_records_since_with_offset(client):
+    book_id = get_book_by_isbn("1234567890000")['id']
+    now = datetime.now()
+    insert_borrow_record("123456", book_id, now - timedelta(hours=3), now + timedelta(days=14))
+    insert_borrow_record("654321", book_id, now - timedelta(hours=1), now + timedelta(days=14))
+
+    for offset in (-12, 14):
+        since = (now - timedelta(hours=2)).astimezone(timezone(timedelta(hours=offset))).isoformat()
+        records = ndjson(client.get('/api/export/borrow_records', query_string={'since': since}))
+        assert [record['patron_id'] for record in records] == ["654321"]
+
+def test_export_bad_parameters(client):
+    assert client.get('/api/export/books?format=xml').status_code == 400
+    assert client.get('/api/export/books?since_id=-1').status_code == 400
+    assert client.get('/api/export/borrow_records?since=yesterday').status_code == 400
+    assert client.get('/api/export/books?since_id=abc').status_code == 400
+    assert client.get('/api/export/books?since_id=100000000000000000000').status_code == 400
+    assert client.get('/api/export/books?since=2024-01-01').status_code == 400
+
+#The export reads with a connection of its own, not the request's
+def test_export_uses_own_connection(client, monkeypatch):
+    calls = []
+    original = database._own_connection
+    monkeypatch.setattr(database, '_own_connection', lambda: calls.append(1) or original())
+
+    ndjson(client.get('/api/export/books'))
+    assert calls == [1]
+    assert database.get_pool().idle_count() >= 1
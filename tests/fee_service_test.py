@@ -0,0 +1,107 @@
+import pytest
+from datetime import datetime, timedelta
+from database import get_db_connection, get_all_books
+from services import fee_service
+from services.fee_service import (
+    calculate_late_fee_amount, calculate_late_fees, compute_all_outstanding_fees
+)
+from services.library_service import add_book_to_catalog
+
+#Assume database alread exist
+
+#Clean the database. Add a sample book.
+def clean_database():
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books')
+    conn.execute('DELETE FROM borrow_records')
+    conn.commit()
+    conn.close()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 50)
+
+#Add a borrow record with a due date relative to now
+def add_loan(patron_id, book_id, days_overdue, returned=False):
+    due_date = datetime.now() - timedelta(days=days_overdue, hours=1)
+    borrow_date = due_date - timedelta(days=14)
+    return_date = datetime.now().isoformat() if returned else None
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat(), return_date))
+    conn.commit()
+    conn.close()
+
+#Run each batch test with NumPy (when installed) and with the pure Python fallback
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        if fee_service.np is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(fee_service, 'np', None)
+    return request.param
+
+#The fee tiers: $0.50/day for 7 days, then $1.00/day, at most $15.00
+def test_calculate_late_fee_amount_tiers():
+    assert calculate_late_fee_amount(-3) == 0
+    assert calculate_late_fee_amount(0) == 0
+    assert calculate_late_fee_amount(1) == 0.5
+    assert calculate_late_fee_amount(7) == 3.5
+    assert calculate_late_fee_amount(8) == 4.5
+    assert calculate_late_fee_amount(18) == 14.5
+    assert calculate_late_fee_amount(19) == 15
+    assert calculate_late_fee_amount(365) == 15
+
+#The batch engine matches the single-loan calculation for every day count
+def test_calculate_late_fees_matches_scalar(backend):
+    as_of = datetime(2025, 3, 1, 12, 0, 0)
+    due_dates = [as_of - timedelta(days=days, minutes=5) for days in range(-3, 40)]
+
+    days, fees = calculate_late_fees(due_dates, as_of=as_of)
+    assert days == [max(d, 0) for d in range(-3, 40)]
+    assert fees == [calculate_late_fee_amount(d) for d in range(-3, 40)]
+
+#ISO strings work like datetimes and returned loans are charged up to the return date
+def test_calculate_late_fees_with_return_dates(backend):
+    as_of = datetime(2025, 3, 1)
+    due_dates = ['2025-02-01T00:00:00', '2025-02-01T00:00:00', datetime(2025, 2, 20)]
+    return_dates = ['2025-02-05T06:00:00', None, datetime(2025, 2, 19)]
+
+    days, fees = calculate_late_fees(due_dates, return_dates, as_of=as_of)
+    assert days == [4, 28, 0]
+    assert fees == [2.0, 15.0, 0.0]
+
+#NumPy and the pure Python fallback give the same days and fees, including
+#partial days, returned loans and loans that are not yet due
+def test_numpy_and_python_agree():
+    if fee_service.np is None:
+        pytest.skip("NumPy is not installed")
+    as_of = datetime(2025, 3, 1, 12, 0, 0)
+    due_dates = [as_of - timedelta(days=days, hours=hours) for days in range(-5, 45) for hours in (0, 7, 23)]
+    return_dates = [None if i % 3 else (due + timedelta(days=i % 20, minutes=1)).isoformat()
+                    for i, due in enumerate(due_dates)]
+
+    expected = fee_service._calculate_late_fees_python(due_dates, return_dates, as_of)
+    assert fee_service._calculate_late_fees_numpy(due_dates, return_dates, as_of) == expected
+
+def test_calculate_late_fees_empty(backend):
+    assert calculate_late_fees([]) == ([], [])
+
+def test_calculate_late_fees_length_mismatch():
+    with pytest.raises(ValueError):
+        calculate_late_fees([datetime.now()], [None, None])
+
+#Only open, overdue loans are billed, across several batches
+def test_compute_all_outstanding_fees(backend):
+    clean_database()
+    book_id = get_all_books()[0]['id']
+    add_loan("111111", book_id, 3)
+    add_loan("111111", book_id, 10)
+    add_loan("222222", book_id, 30)
+    add_loan("333333", book_id, -5)
+    add_loan("444444", book_id, 12, returned=True)
+
+    results = list(compute_all_outstanding_fees(batch_size=2))
+    fees = sorted((r['patron_id'], r['days_overdue'], r['fee_amount']) for r in results)
+    assert fees == [("111111", 3, 1.5), ("111111", 10, 6.5), ("222222", 30, 15.0)]
+    assert all(r['book_id'] == book_id for r in results)
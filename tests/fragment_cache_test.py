@@ -0,0 +1,76 @@
+import pytest
+from database import get_book_by_isbn, insert_book, update_book_availability
+from routes.fragment_cache import FragmentCache, catalog_row_cache
+
+#Use a fresh database file and an empty row cache for every test (the counters keep running)
+@pytest.fixture
+def client(fresh_app):
+    catalog_row_cache.clear()
+    insert_book("Test Book", "Test Author", "1234567890123", 2, 2)
+    insert_book("Other Book", "Other Author", "1234567890124", 1, 1)
+    return fresh_app.test_client()
+
+def test_render_once_per_key():
+    cache = FragmentCache()
+    calls = []
+    render = lambda: calls.append(1) or '<tr>row</tr>'
+
+    assert cache.render(('book', 1), render) == '<tr>row</tr>'
+    assert cache.render(('book', 1), render) == '<tr>row</tr>'
+    assert len(calls) == 1
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['render_seconds'] >= 0
+
+#The least recently used fragment is dropped when the cache is full
+def test_bounded_size():
+    cache = FragmentCache(max_size=2)
+    cache.render('a', lambda: 'a')
+    cache.render('b', lambda: 'b')
+    cache.render('a', lambda: 'a')
+    cache.render('c', lambda: 'c')
+
+    assert cache.stats()['size'] == 2
+    assert cache.render('a', lambda: 'new a') == 'a'
+    assert cache.render('b', lambda: 'new b') == 'new b'
+
+#Rendered rows are HTML, not text to be escaped again
+def test_fragment_is_markup():
+    assert FragmentCache().render('row', lambda: '<td>x</td>').__html__() == '<td>x</td>'
+
+#A second catalog view is served from cached rows
+def test_catalog_rows_cached(client):
+    before = catalog_row_cache.stats()
+    first = client.get('/catalog').data
+    assert catalog_row_cache.stats()['misses'] == before['misses'] + 2
+
+    assert client.get('/catalog').data == first
+    assert catalog_row_cache.stats()['hits'] == before['hits'] + 2
+
+#Only the changed book is rendered again, with its new availability
+def test_changed_book_rendered_again(client):
+    client.get('/catalog').data
+    update_book_availability(get_book_by_isbn("1234567890123")['id'], -1)
+
+    before = catalog_row_cache.stats()
+    page = client.get('/catalog').data
+    assert b'1/2 Available' in page
+    stats = catalog_row_cache.stats()
+    assert stats['misses'] == before['misses'] + 1
+    assert stats['hits'] == before['hits'] + 1
+
+#Book titles are still escaped inside cached rows
+def test_row_escaped(client):
+    insert_book("<b>Bold</b>", "Test Author", "1234567890125", 1, 1)
+    page = client.get('/catalog').data
+    assert b'&lt;b&gt;Bold&lt;/b&gt;' in page
+
+def test_metrics(client):
+    #The page is streamed, so rows are rendered as the body is read
+    client.get('/catalog').data
+    stats = client.get('/api/metrics').json['catalog_row_cache']
+    assert stats['size'] == 2
+    assert stats['misses'] >= 2
+    assert 'avg_render_ms' in stats
@@ -0,0 +1,82 @@
+import pytest
+from database import get_book_by_isbn, get_catalog_version, insert_book, update_book_availability
+from routes import http_cache
+from routes.http_cache import deploy_token
+
+#Use a fresh database file for every test
+@pytest.fixture
+def client(fresh_app):
+    insert_book("Test Book", "Test Author", "1234567890123", 2, 2)
+    return fresh_app.test_client()
+
+#Every change to books bumps the catalog version
+def test_catalog_version_changes_with_books(client):
+    version, _ = get_catalog_version()
+    book_id = get_book_by_isbn("1234567890123")['id']
+
+    update_book_availability(book_id, -1)
+    assert get_catalog_version()[0] == version + 1
+
+    insert_book("Second Book", "Test Author", "1234567890124", 1, 1)
+    assert get_catalog_version()[0] == version + 2
+
+@pytest.mark.parametrize('url', ['/catalog', '/search?q=Test&type=title', '/api/search?q=Test'])
+def test_revalidation_until_catalog_changes(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.last_modified is not None
+    etag, weak = response.get_etag()
+    assert etag and not weak
+
+    #Unchanged catalog: 304 with no body
+    response = client.get(url, headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.get_etag()[0] == etag
+
+    #A borrow changes the page, so the old ETag no longer matches
+    update_book_availability(get_book_by_isbn("1234567890123")['id'], -1)
+    response = client.get(url, headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+
+#Different URLs never share an ETag
+def test_etag_per_url(client):
+    first = client.get('/catalog?per_page=1').get_etag()[0]
+    second = client.get('/catalog?per_page=2').get_etag()[0]
+    assert first != second
+
+def test_if_modified_since(client):
+    last_modified = client.get('/catalog').headers['Last-Modified']
+    response = client.get('/catalog', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+#A page with flashed messages is personal and must not be reused
+def test_flashes_skip_cache(client):
+    etag = client.get('/catalog').get_etag()[0]
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Book borrowed')]
+
+    response = client.get('/catalog', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert b'Book borrowed' in response.data
+    assert response.get_etag()[0] is None
+
+#Errors are not cached
+def test_error_response_not_cached(client):
+    response = client.get('/api/search')
+    assert response.status_code == 400
+    assert response.get_etag()[0] is None
+
+#The ETag token comes from the template files, so every worker and restart agree on it
+def test_deploy_token_is_deterministic(tmp_path):
+    (tmp_path / 'templates').mkdir()
+    (tmp_path / 'templates' / 'catalog.html').write_text('<table></table>')
+    token = deploy_token(str(tmp_path))
+    assert deploy_token(str(tmp_path)) == token
+    assert http_cache._DEPLOY_TOKEN == deploy_token()
+
+    (tmp_path / 'templates' / 'catalog.html').write_text('<table class="new"></table>')
+    assert deploy_token(str(tmp_path)) != token
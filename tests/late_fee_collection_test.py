@@ -0,0 +1,169 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+from database import get_book_by_isbn, get_db_connection
+from services.library_service import add_book_to_catalog, collect_late_fees, pay_late_fees
+from services.payment_service import PaymentGateway
+
+#Assume database alread exist
+
+#Clean the database, including earlier runs' payments. Add two sample books.
+def clean_database():
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books')
+    conn.execute('DELETE FROM borrow_records')
+    conn.execute('DELETE FROM late_fee_charges')
+    conn.execute('DELETE FROM payments')
+    conn.commit()
+    conn.close()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 5)
+    add_book_to_catalog("Other Book", "Other Author", "1234567890124", 5)
+    return get_book_by_isbn("1234567890123")['id'], get_book_by_isbn("1234567890124")['id']
+
+#Add a loan that is days_overdue days past its due date
+def add_loan(patron_id, book_id, days_overdue):
+    due_date = datetime.now() - timedelta(days=days_overdue)
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+        VALUES (?, ?, ?, ?)
+    ''', (patron_id, book_id, (due_date - timedelta(days=14)).isoformat(), due_date.isoformat()))
+    conn.commit()
+    conn.close()
+
+#Each patron is charged once for all of their overdue books
+def test_collect_late_fees_one_charge_per_patron():
+    book1, book2 = clean_database()
+    add_loan("111111", book1, 3)     #$1.50
+    add_loan("111111", book2, 10)    #$6.50
+    add_loan("222222", book1, 30)    #$15.00
+
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = lambda patron_id, amount, description: (
+        True, f"txn_{patron_id}", f"Payment of ${amount:.2f} processed successfully"
+    )
+
+    results = collect_late_fees(["111111", "222222"], mock_gateway)
+
+    assert [result['patron_id'] for result in results] == ["111111", "222222"]
+    assert results[0]['status'] == 'paid'
+    assert results[0]['amount'] == 8.0
+    assert results[0]['books'] == 2
+    assert results[0]['transaction_id'] == "txn_111111"
+    assert results[1]['amount'] == 15.0
+
+    assert mock_gateway.process_payment.call_count == 2
+    mock_gateway.process_payment.assert_any_call(
+        patron_id="111111",
+        amount=8.0,
+        description="Late fees for 2 overdue book(s)"
+    )
+
+#Patrons with nothing to pay, invalid IDs and repeats are reported without charging
+def test_collect_late_fees_no_fees_and_invalid():
+    book1, book2 = clean_database()
+    add_loan("111111", book1, 0)     #Not overdue yet
+
+    mock_gateway = Mock(spec=PaymentGateway)
+    results = collect_late_fees(["111111", "12", "111111", "333333"], mock_gateway)
+
+    assert [(result['patron_id'], result['status']) for result in results] == [
+        ("111111", 'no_fees'), ("12", 'invalid'), ("333333", 'no_fees')
+    ]
+    assert "Invalid patron ID" in results[1]['message']
+    mock_gateway.process_payment.assert_not_called()
+
+#A declined or failing charge only affects that patron
+def test_collect_late_fees_failures_are_per_patron():
+    book1, book2 = clean_database()
+    add_loan("111111", book1, 5)
+    add_loan("222222", book1, 5)
+    add_loan("333333", book1, 5)
+
+    def process_payment(patron_id, amount, description):
+        if patron_id == "222222":
+            return False, "", "Payment declined: amount exceeds limit"
+        if patron_id == "333333":
+            raise Exception("Network error")
+        return True, f"txn_{patron_id}", "Payment processed"
+
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = process_payment
+
+    results = collect_late_fees(["111111", "222222", "333333"], mock_gateway)
+
+    #The network error may have come after the charge went through
+    assert [result['status'] for result in results] == ['paid', 'failed', 'unknown']
+    assert results[1]['message'] == "Payment failed: Payment declined: amount exceeds limit"
+    assert results[2]['message'].startswith("Payment processing error: Network error.")
+    assert results[2]['transaction_id'] is None
+
+#Charges run in parallel, but never more than max_workers at once
+def test_collect_late_fees_runs_charges_concurrently():
+    book1, book2 = clean_database()
+    patron_ids = [f"{400000 + i}" for i in range(20)]
+    for patron_id in patron_ids:
+        add_loan(patron_id, book1, 2)
+
+    lock = threading.Lock()
+    in_flight = [0, 0]   #Current, maximum
+
+    def process_payment(patron_id, amount, description):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        return True, f"txn_{patron_id}", "Payment processed"
+
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = process_payment
+
+    start = time.monotonic()
+    results = collect_late_fees(patron_ids, mock_gateway, max_workers=5)
+    elapsed = time.monotonic() - start
+
+    assert all(result['status'] == 'paid' for result in results)
+    assert 1 < in_flight[1] <= 5
+    #20 charges of 0.05 s, 5 at a time: about 0.2 s instead of 1 s one by one
+    assert elapsed < 0.8
+
+#A new batch only bills the part of each fee that earlier payments did not cover
+def test_new_batch_bills_only_what_is_still_owed():
+    book1, book2 = clean_database()
+    add_loan("111111", book1, 10)    #$6.50
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = lambda patron_id, amount, description: (
+        True, f"txn_{patron_id}_{amount}", "Payment processed"
+    )
+
+    assert collect_late_fees(["111111"], mock_gateway, batch_id="month-1")[0]['amount'] == 6.5
+    assert collect_late_fees(["111111"], mock_gateway, batch_id="month-2")[0]['status'] == 'no_fees'
+
+    #Five more days overdue: $11.50, of which $6.50 is paid
+    conn = get_db_connection()
+    conn.execute('UPDATE borrow_records SET due_date = ?', ((datetime.now() - timedelta(days=15)).isoformat(),))
+    conn.commit()
+    conn.close()
+    result = collect_late_fees(["111111"], mock_gateway, batch_id="month-3")[0]
+    assert result['status'] == 'paid'
+    assert result['amount'] == 5.0
+    assert mock_gateway.process_payment.call_count == 2
+
+#Fees paid one book at a time are not billed again by a batch, and the other way round
+def test_batch_and_single_payments_share_the_ledger():
+    book1, book2 = clean_database()
+    add_loan("111111", book1, 10)    #$6.50
+    add_loan("111111", book2, 30)    #$15.00
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_1", "Payment processed")
+
+    assert pay_late_fees("111111", book1, mock_gateway)[0] is True
+    result = collect_late_fees(["111111"], mock_gateway)[0]
+    assert result['amount'] == 15.0
+    assert result['books'] == 1
+
+    assert pay_late_fees("111111", book2, mock_gateway) == (False, "Late fees for this book are already paid.", None)
+    assert mock_gateway.process_payment.call_count == 2
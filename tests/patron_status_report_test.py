@@ -1,4 +1,5 @@
 import pytest
+from datetime import datetime, timedelta
 from database import get_all_books, get_db_connection, get_patron_borrow_count, get_patron_borrowed_books
 from services.library_service import (
     add_book_to_catalog,
@@ -97,6 +98,74 @@ def test_patron_status_report_with_no_exist_patron_is():
     assert report['total_late_fees'] == 0
     assert report['current_borrow_count'] == 0
     assert len(report['borrow_history']) == 0
+
+#Add a borrow record that was borrowed some days ago
+def add_borrow_record(patron_id, book_id, days_ago):
+    borrow_date = datetime.now() - timedelta(days=days_ago)
+    due_date = borrow_date + timedelta(days=14)
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+        VALUES (?, ?, ?, ?)
+    ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+    conn.commit()
+    conn.close()
+
+#Each borrowed book has its own late fee and the total adds them up
+def test_patron_status_report_late_fees_per_book():
+    clean_database()
+    add_book_to_catalog("Test Book 1", "Test Author", "1234567890123", 5)
+    add_book_to_catalog("Test Book 2", "Test Author", "1234567890124", 5)
+    books = get_all_books()
+    patron_id = "123456"
+    
+    #4 days overdue ($2.00) and 30 days overdue (capped at $15.00)
+    add_borrow_record(patron_id, books[0]['id'], 18)
+    add_borrow_record(patron_id, books[1]['id'], 44)
+    
+    report = get_patron_status_report(patron_id)
+    fees = sorted(book['late_fee'] for book in report['currently_borrowed'])
+    assert fees == [2.0, 15.0]
+    assert report['total_late_fees'] == 17.0
+    assert report['current_borrow_count'] == 2
+
+#The history can be limited to the most recent records
+def test_patron_status_report_history_limit():
+    clean_database()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 5)
+    book_id = get_all_books()[0]['id']
+    patron_id = "123456"
+    for days_ago in (3, 2, 1):
+        add_borrow_record(patron_id, book_id, days_ago)
+    
+    report = get_patron_status_report(patron_id, history_limit=2)
+    assert len(report['borrow_history']) == 2
+    assert report['current_borrow_count'] == 3
+    assert len(get_patron_status_report(patron_id)['borrow_history']) == 3
+
+#The report needs the same number of queries however many books are borrowed
+def test_patron_status_report_query_count(monkeypatch):
+    import database
+    clean_database()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 5)
+    book_id = get_all_books()[0]['id']
+    for days_ago in (30, 20, 10, 5, 1):
+        add_borrow_record("123456", book_id, days_ago)
+    
+    statements = []
+    original_get_db_connection = database.get_db_connection
+    def traced_get_db_connection():
+        conn = original_get_db_connection()
+        conn.set_trace_callback(statements.append)
+        return conn
+    monkeypatch.setattr(database, 'get_db_connection', traced_get_db_connection)
+    
+    get_patron_status_report("123456")
+    database.reset_pool()
+    
+    #"SELECT 1" is the connection pool health check
+    queries = [sql for sql in statements if sql.lstrip().upper().startswith('SELECT') and sql != 'SELECT 1']
+    assert len(queries) == 2
     
 """ GPT-5 test case.
 class TestPatronStatus:
@@ -0,0 +1,221 @@
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+import pytest
+from app import create_app
+from database import (
+    PAYMENT_CLAIM_TIMEOUT, claim_next_job, claim_payment, enqueue_job, finish_job, get_book_by_isbn,
+    get_db_connection, get_job, get_unknown_payments
+)
+from services.job_service import (
+    JOB_LEASE, MAX_JOB_ATTEMPTS, WorkerPool, enqueue_late_fee_payment, enqueue_refund, run_job, run_pending_jobs
+)
+from services.library_service import UNKNOWN_PAYMENT_MESSAGE, add_book_to_catalog
+from services.payment_service import PaymentGateway
+
+FAKE_book = {'book_id': 1, 'title': 'Test Book', 'available_copies': 1}
+FAKE_calculate_late_fee = {'fee_amount': 6.5, 'days_overdue': 10, 'status': 'Late fee calculated'}
+
+#Assume database alread exist
+
+#Clean the job queue.
+def clean_database():
+    conn = get_db_connection()
+    conn.execute('DELETE FROM jobs')
+    conn.commit()
+    conn.close()
+
+@pytest.fixture
+def client():
+    clean_database()
+    return create_app().test_client()
+
+#Stub the fee calculation and the shared gateway the jobs use
+@pytest.fixture
+def gateway(mocker):
+    mocker.patch("services.library_service.calculate_late_fee_for_book", return_value=FAKE_calculate_late_fee)
+    mocker.patch("services.library_service.get_book_by_id", return_value=FAKE_book)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_123456_1", "Payment of $6.50 processed successfully")
+    mock_gateway.refund_payment.return_value = (True, "Refund of $5.00 processed successfully")
+    mocker.patch("services.library_service.get_payment_gateway", return_value=mock_gateway)
+    return mock_gateway
+
+#The request only queues the payment; a worker makes it and the client polls for the result
+def test_payment_job(client, gateway):
+    response = client.post('/api/payments', json={'patron_id': "123456", 'book_id': 1})
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+    assert response.headers['Location'].endswith(f"/api/payments/{job_id}")
+    gateway.process_payment.assert_not_called()
+
+    assert client.get(f"/api/payments/{job_id}").json['status'] == 'queued'
+
+    assert run_pending_jobs() == 1
+    job = client.get(f"/api/payments/{job_id}").json
+    assert job['status'] == 'completed'
+    assert job['attempts'] == 1
+    assert job['result'] == {
+        'success': True,
+        'message': "Payment successful! Payment of $6.50 processed successfully",
+        'transaction_id': "txn_123456_1"
+    }
+
+#Jobs queued with the same Idempotency-Key charge the patron once
+def test_payment_jobs_with_same_key(client, gateway):
+    headers = {'Idempotency-Key': f"job-test-{time.time()}"}
+    first = client.post('/api/payments', json={'patron_id': "123456", 'book_id': 1}, headers=headers).json['job_id']
+    second = client.post('/api/payments', json={'patron_id': "123456", 'book_id': 1}, headers=headers).json['job_id']
+
+    run_pending_jobs()
+
+    assert client.get(f"/api/payments/{first}").json['result'] == client.get(f"/api/payments/{second}").json['result']
+    gateway.process_payment.assert_called_once()
+
+def test_refund_job(client, gateway):
+    response = client.post('/api/refunds', json={'transaction_id': "txn_999999_1", 'amount': 5})
+    assert response.status_code == 202
+
+    run_pending_jobs()
+    job = client.get(response.headers['Location']).json
+    assert job['kind'] == 'refund_late_fee_payment'
+    assert job['result'] == {'success': True, 'message': "Refund of $5.00 processed successfully"}
+    gateway.refund_payment.assert_called_once_with("txn_999999_1", 5.0)
+
+#Business errors complete the job with an unsuccessful result
+def test_declined_payment_job(client, gateway):
+    job_id = client.post('/api/payments', json={'patron_id': "12", 'book_id': 1}).json['job_id']
+    run_pending_jobs()
+
+    job = client.get(f"/api/payments/{job_id}").json
+    assert job['status'] == 'completed'
+    assert job['result']['success'] is False
+    assert "Invalid patron ID" in job['result']['message']
+
+#A job whose handler raises is marked failed
+def test_failed_job(client):
+    job_id = enqueue_job('no_such_job', {})
+    run_pending_jobs()
+
+    job = client.get(f"/api/payments/{job_id}").json
+    assert job['status'] == 'failed'
+    assert job['result']['message'] == "Job failed: Unknown job kind: 'no_such_job'"
+
+def test_bad_requests(client):
+    assert client.post('/api/payments', json={'patron_id': "123456"}).status_code == 400
+    assert client.post('/api/payments', json={'patron_id': "123456", 'book_id': "1"}).status_code == 400
+    assert client.post('/api/refunds', json={'transaction_id': "txn_1", 'amount': "5"}).status_code == 400
+    assert client.post('/api/refunds', data="not json").status_code == 400
+    assert client.get('/api/payments/999999999').status_code == 404
+
+#A job left running by a worker that died is handed out again once its lease expires
+def test_stale_job_is_reclaimed():
+    clean_database()
+    job_id = enqueue_job('pay_late_fees', {})
+    assert claim_next_job('worker-1')['id'] == job_id
+    assert claim_next_job('worker-2') is None
+
+    job = claim_next_job('worker-2', lease_seconds=0)
+    assert job['id'] == job_id
+    assert job['attempts'] == 2
+    assert job['worker'] == 'worker-2'
+
+#A payment job whose worker died mid-charge is run again only after its claim
+#timed out, so the payment is flagged for reconciliation instead of left pending
+def test_payment_job_after_worker_died(client, gateway):
+    assert JOB_LEASE > PAYMENT_CLAIM_TIMEOUT
+    conn = get_db_connection()
+    conn.execute("DELETE FROM payments WHERE idempotency_key = 'died-1'")
+    conn.commit()
+    conn.close()
+    job_id = enqueue_late_fee_payment("123456", 1, idempotency_key="died-1")
+    claim_next_job('worker-1')
+    claim_payment("died-1", "123456", 1, 6.5)
+    #The lease runs out: the claim is now at least JOB_LEASE seconds old
+    conn = get_db_connection()
+    conn.execute("UPDATE payments SET claimed_at = ? WHERE idempotency_key = 'died-1'",
+                 ((datetime.now() - timedelta(seconds=JOB_LEASE)).isoformat(),))
+    conn.commit()
+    conn.close()
+    run_job(claim_next_job('worker-2', lease_seconds=0))
+
+    gateway.process_payment.assert_not_called()
+    assert get_job(job_id)['result']['message'] == UNKNOWN_PAYMENT_MESSAGE
+    assert "died-1" in [payment['idempotency_key'] for payment in get_unknown_payments()]
+
+#A refund job that is run again (its worker died after the refund) does not refund twice
+def test_refund_job_run_twice(client, gateway):
+    job_id = enqueue_refund("txn_999999_2", 5.0)
+    job = claim_next_job('worker-1')
+    run_job(job)
+    assert get_job(job_id)['result']['success'] == True
+
+    #The lease runs out and another worker runs the same payload again
+    run_job(dict(job, worker='worker-2', attempts=2))
+    gateway.refund_payment.assert_called_once_with("txn_999999_2", 5.0)
+
+#A job whose workers keep dying is given up after MAX_JOB_ATTEMPTS claims
+def test_job_attempts_capped():
+    clean_database()
+    job_id = enqueue_job('pay_late_fees', {})
+    for attempt in range(MAX_JOB_ATTEMPTS):
+        assert claim_next_job(f'worker-{attempt}', lease_seconds=0, max_attempts=MAX_JOB_ATTEMPTS)['id'] == job_id
+
+    assert claim_next_job('worker-last', lease_seconds=0, max_attempts=MAX_JOB_ATTEMPTS) is None
+    job = get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['result']['message'] == f"Job failed: gave up after {MAX_JOB_ATTEMPTS} attempts"
+
+#A worker whose job was handed to another worker cannot overwrite the new owner's result
+def test_stale_worker_cannot_finish():
+    clean_database()
+    job_id = enqueue_job('pay_late_fees', {})
+    stale = claim_next_job('worker-1')
+    current = claim_next_job('worker-2', lease_seconds=0)
+
+    assert finish_job(job_id, 'completed', {'success': True}, current['worker'], current['attempts']) == True
+    assert finish_job(job_id, 'failed', {'success': False}, stale['worker'], stale['attempts']) == False
+    assert get_job(job_id)['result'] == {'success': True}
+
+#Worker processes drain the queue in parallel
+def test_worker_pool(client):
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books')
+    conn.execute('DELETE FROM borrow_records')
+    conn.commit()
+    conn.close()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 5)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    due_date = datetime.now() - timedelta(days=10)
+    patron_ids = [f"{500000 + i}" for i in range(4)]
+    conn = get_db_connection()
+    for patron_id in patron_ids:
+        conn.execute('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', (patron_id, book_id, (due_date - timedelta(days=14)).isoformat(), due_date.isoformat()))
+    conn.commit()
+    conn.close()
+
+    job_ids = [
+        client.post('/api/payments', json={'patron_id': patron_id, 'book_id': book_id}).json['job_id']
+        for patron_id in patron_ids
+    ]
+
+    with WorkerPool(workers=4, poll_interval=0.05):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            jobs = [client.get(f"/api/payments/{job_id}").json for job_id in job_ids]
+            if all(job['status'] == 'completed' for job in jobs):
+                break
+            time.sleep(0.05)
+
+    assert all(job['status'] == 'completed' for job in jobs)
+    assert all(job['result']['success'] for job in jobs)
+    assert all(job['result']['transaction_id'].startswith("txn_5000") for job in jobs)
+
+    #Each worker reported the gateway calls it made for /api/metrics
+    workers = client.get('/api/metrics').json['payment_workers']
+    calls = sum(stats['methods'].get('process_payment', {}).get('calls', 0) for stats in workers.values())
+    assert calls >= 4
+    assert all(stats['state'] == 'closed' for stats in workers.values())
@@ -0,0 +1,293 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+from database import (
+    get_book_by_isbn, get_db_connection, get_patron_payments, get_payment_by_key, get_unknown_payments
+)
+from services.library_service import (
+    UNKNOWN_PAYMENT_MESSAGE, add_book_to_catalog, collect_late_fees, pay_late_fees, reconcile_payment,
+    refund_late_fee_payment
+)
+from services.payment_service import CircuitOpenError, PaymentGateway
+
+FAKE_book = {'book_id': 1, 'title': 'Test Book', 'available_copies': 1}
+FAKE_calculate_late_fee = {'fee_amount': 6.5, 'days_overdue': 10, 'status': 'Late fee calculated'}
+
+#Assume database alread exist
+
+#Clean the payments ledger.
+def clean_database():
+    conn = get_db_connection()
+    conn.execute('DELETE FROM payments')
+    conn.commit()
+    conn.close()
+
+#Stub the fee calculation and book lookup like the payment mock tests
+def stub_late_fee(mocker):
+    mocker.patch("services.library_service.calculate_late_fee_for_book", return_value=FAKE_calculate_late_fee)
+    mocker.patch("services.library_service.get_book_by_id", return_value=FAKE_book)
+
+#A repeated request with the same key is answered from the ledger
+def test_same_key_charges_once(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_1", "Payment of $6.50 processed successfully")
+
+    first = pay_late_fees("111111", 1, mock_gateway, idempotency_key="click-1")
+    second = pay_late_fees("111111", 1, mock_gateway, idempotency_key="click-1")
+
+    assert first == second
+    assert first[0] is True
+    assert first[2] == "txn_111111_1"
+    mock_gateway.process_payment.assert_called_once()
+
+    payment = get_payment_by_key("click-1")
+    assert payment['status'] == 'completed'
+    assert payment['amount'] == 6.5
+    assert payment['transaction_id'] == "txn_111111_1"
+
+#Without a key every call is a new payment, but each one is still recorded
+def test_payments_without_key_are_recorded(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = [
+        (True, "txn_111111_1", "Payment processed"),
+        (False, "", "Payment declined"),
+    ]
+
+    pay_late_fees("111111", 1, mock_gateway)
+    pay_late_fees("111111", 1, mock_gateway)
+
+    assert mock_gateway.process_payment.call_count == 2
+    assert sorted(payment['status'] for payment in get_patron_payments("111111")) == ['completed', 'failed']
+
+#A declined or refused attempt can be retried with the same key
+def test_failed_payment_can_be_retried(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = [
+        (False, "", "Payment declined"),
+        CircuitOpenError("Payment gateway unavailable, try again later"),
+        (True, "txn_111111_2", "Payment processed"),
+    ]
+
+    success, message, transaction_id = pay_late_fees("111111", 1, mock_gateway, idempotency_key="retry-1")
+    assert success is False
+    assert get_payment_by_key("retry-1")['status'] == 'failed'
+
+    success, message, transaction_id = pay_late_fees("111111", 1, mock_gateway, idempotency_key="retry-1")
+    assert success is False
+    assert get_payment_by_key("retry-1")['status'] == 'failed'
+
+    success, message, transaction_id = pay_late_fees("111111", 1, mock_gateway, idempotency_key="retry-1")
+    assert success is True
+    assert transaction_id == "txn_111111_2"
+    assert mock_gateway.process_payment.call_count == 3
+
+#A charge that raised may have gone through: it is not retried, but reconciled
+def test_charge_error_needs_reconciliation(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = TimeoutError("Read timed out")
+
+    success, message, transaction_id = pay_late_fees("111111", 1, mock_gateway, idempotency_key="timeout-1")
+    assert success is False
+    assert message == f"Payment processing error: Read timed out. {UNKNOWN_PAYMENT_MESSAGE}"
+    assert get_payment_by_key("timeout-1")['status'] == 'unknown'
+
+    mock_gateway.process_payment.side_effect = None
+    mock_gateway.process_payment.return_value = (True, "txn_111111_3", "Payment processed")
+    assert pay_late_fees("111111", 1, mock_gateway, idempotency_key="timeout-1") == (False, UNKNOWN_PAYMENT_MESSAGE, None)
+    mock_gateway.process_payment.assert_called_once()
+    assert [payment['idempotency_key'] for payment in get_unknown_payments()] == ["timeout-1"]
+
+#A key belongs to the patron who used it first
+def test_key_of_another_patron_is_refused(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_1", "Payment processed")
+
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="shared")
+    success, message, transaction_id = pay_late_fees("222222", 1, mock_gateway, idempotency_key="shared")
+
+    assert success is False
+    assert message == "Idempotency key was already used for another patron."
+    mock_gateway.process_payment.assert_called_once()
+
+#Double-clicks arriving at the same time still reach the gateway only once
+def test_concurrent_requests_charge_once(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+
+    def process_payment(patron_id, amount, description):
+        time.sleep(0.1)
+        return True, "txn_111111_1", "Payment processed"
+
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = process_payment
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(pay_late_fees("111111", 1, mock_gateway, idempotency_key="double")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mock_gateway.process_payment.assert_called_once()
+    assert sum(1 for success, _, _ in results if success) >= 1
+    assert all(success or message == "Payment is already being processed." for success, message, _ in results)
+
+#Refunds of recorded payments are limited to what was paid
+def test_refunds_limited_to_amount_paid(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_9", "Payment processed")
+    mock_gateway.refund_payment.return_value = (True, "Refund processed")
+    pay_late_fees("111111", 1, mock_gateway)
+
+    assert refund_late_fee_payment("txn_111111_9", 5.0, mock_gateway)[0] is True
+    success, message = refund_late_fee_payment("txn_111111_9", 2.0, mock_gateway)
+    assert success is False
+    assert message == "Refund amount exceeds the amount paid."
+    mock_gateway.refund_payment.assert_called_once()
+
+    #A refund the gateway refuses does not count
+    mock_gateway.refund_payment.return_value = (False, "Refund declined")
+    assert refund_late_fee_payment("txn_111111_9", 1.5, mock_gateway)[0] is False
+    mock_gateway.refund_payment.return_value = (True, "Refund processed")
+    assert refund_late_fee_payment("txn_111111_9", 1.5, mock_gateway)[0] is True
+
+#Running a collection batch again does not charge the same patrons twice
+def test_collection_batch_can_be_rerun():
+    clean_database()
+    conn = get_db_connection()
+    conn.execute('DELETE FROM books')
+    conn.execute('DELETE FROM borrow_records')
+    conn.commit()
+    conn.close()
+    add_book_to_catalog("Test Book", "Test Author", "1234567890123", 5)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    due_date = datetime.now() - timedelta(days=20)
+    conn = get_db_connection()
+    for patron_id in ("111111", "222222"):
+        conn.execute('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', (patron_id, book_id, (due_date - timedelta(days=14)).isoformat(), due_date.isoformat()))
+    conn.commit()
+    conn.close()
+
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.side_effect = lambda patron_id, amount, description: (
+        (True, f"txn_{patron_id}", "Payment processed") if patron_id == "111111" else (False, "", "Payment declined")
+    )
+    first = collect_late_fees(["111111", "222222"], mock_gateway, batch_id="2026-10")
+    assert [result['status'] for result in first] == ['paid', 'failed']
+
+    mock_gateway.process_payment.side_effect = lambda patron_id, amount, description: (
+        True, f"txn_{patron_id}", "Payment processed"
+    )
+    second = collect_late_fees(["111111", "222222"], mock_gateway, batch_id="2026-10")
+    assert [result['status'] for result in second] == ['paid', 'paid']
+    assert second[0]['transaction_id'] == "txn_111111"
+    #The first run charged 111111 and tried 222222; the second run only retried 222222
+    assert mock_gateway.process_payment.call_count == 3
+
+#Ledger lookups use the indexes
+def test_ledger_lookups_use_indexes():
+    conn = get_db_connection()
+    for sql, index in [
+        ("SELECT * FROM payments WHERE idempotency_key = 'key'", "sqlite_autoindex_payments_1"),
+        ("SELECT * FROM payments WHERE transaction_id = 'txn_1' AND status = 'completed' ORDER BY id DESC LIMIT 1", "idx_payments_transaction"),
+        ("SELECT * FROM payments WHERE patron_id = '111111' ORDER BY created_at DESC", "idx_payments_patron"),
+    ]:
+        plan = ' '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+        assert index in plan, plan
+    conn.close()
+
+#Make a claimed payment look like its process died long ago
+def abandon_claim(idempotency_key):
+    conn = get_db_connection()
+    conn.execute('UPDATE payments SET status = ?, claimed_at = ? WHERE idempotency_key = ?',
+                 ('pending', (datetime.now() - timedelta(hours=1)).isoformat(), idempotency_key))
+    conn.commit()
+    conn.close()
+
+#A claim abandoned by a crash is not charged again, but flagged for reconciliation
+def test_abandoned_claim_needs_reconciliation(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_5", "Payment processed")
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-1")
+    abandon_claim("crash-1")
+
+    success, message, _ = pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-1")
+    assert success is False
+    assert "unknown" in message
+    assert get_payment_by_key("crash-1")['status'] == 'unknown'
+    assert [payment['idempotency_key'] for payment in get_unknown_payments()] == ["crash-1"]
+    mock_gateway.process_payment.assert_called_once()
+
+#An abandoned claim is listed for reconciliation even if its key never comes back
+def test_abandoned_claim_listed_without_retry(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_6", "Payment processed")
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-2")
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="fresh-1")
+    abandon_claim("crash-2")
+    conn = get_db_connection()
+    conn.execute("UPDATE payments SET status = 'pending' WHERE idempotency_key = 'fresh-1'")
+    conn.commit()
+    conn.close()
+
+    assert [payment['idempotency_key'] for payment in get_unknown_payments()] == ["crash-2"]
+    assert get_payment_by_key("crash-2")['status'] == 'unknown'
+    assert get_payment_by_key("fresh-1")['status'] == 'pending'
+
+#The gateway confirms the charge: the payment is completed without charging again
+def test_reconcile_charged_payment(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_6", "Payment processed")
+    mock_gateway.verify_payment_status.return_value = {'status': 'completed'}
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-2")
+    abandon_claim("crash-2")
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-2")
+
+    assert reconcile_payment("crash-2", "txn_111111_6", mock_gateway)[0] is True
+    mock_gateway.verify_payment_status.assert_called_once_with("txn_111111_6")
+    success, _, transaction_id = pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-2")
+    assert success is True
+    assert transaction_id == "txn_111111_6"
+    mock_gateway.process_payment.assert_called_once()
+
+#No charge was made: the key can be retried
+def test_reconcile_uncharged_payment(mocker):
+    clean_database()
+    stub_late_fee(mocker)
+    mock_gateway = Mock(spec=PaymentGateway)
+    mock_gateway.process_payment.return_value = (True, "txn_111111_7", "Payment processed")
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-3")
+    abandon_claim("crash-3")
+    pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-3")
+
+    assert reconcile_payment("crash-3") == (True, "Payment recorded as failed; it can be retried.")
+    assert pay_late_fees("111111", 1, mock_gateway, idempotency_key="crash-3")[0] is True
+    assert mock_gateway.process_payment.call_count == 2
+
+    #Only unknown payments can be reconciled
+    assert reconcile_payment("crash-3")[0] is False
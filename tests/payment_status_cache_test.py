@@ -0,0 +1,69 @@
+import time
+import caching
+from services.payment_service import PaymentGateway, PaymentStatusCache
+
+#Only statuses that can no longer change are cached
+def test_only_terminal_statuses_are_cached():
+    cache = PaymentStatusCache()
+    cache.put("txn_1", {"status": "completed"})
+    cache.put("txn_2", {"status": "refunded"})
+    cache.put("txn_3", {"status": "pending"})
+    cache.put("txn_4", {"status": "not_found"})
+
+    assert cache.get("txn_1")['status'] == "completed"
+    assert cache.get("txn_2")['status'] == "refunded"
+    assert cache.get("txn_3") is None
+    assert cache.get("txn_4") is None
+
+#Statuses expire after the TTL
+def test_cached_status_expires(monkeypatch):
+    cache = PaymentStatusCache(ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(caching.time, 'monotonic', lambda: now[0])
+
+    cache.put("txn_1", {"status": "completed"})
+    now[0] += 59
+    assert cache.get("txn_1") is not None
+    now[0] += 2
+    assert cache.get("txn_1") is None
+
+#The least recently used transaction is dropped when the cache is full
+def test_cache_is_bounded():
+    cache = PaymentStatusCache(max_size=2)
+    cache.put("txn_1", {"status": "completed"})
+    cache.put("txn_2", {"status": "completed"})
+    cache.get("txn_1")
+    cache.put("txn_3", {"status": "completed"})
+
+    assert cache.get("txn_2") is None
+    assert cache.get("txn_1") is not None
+    assert cache.stats()['size'] == 2
+
+#Many transactions are checked in parallel, then answered from the cache
+def test_verify_many():
+    gateway = PaymentGateway(status_cache=PaymentStatusCache())
+    transaction_ids = [f"txn_123456_{i}" for i in range(10)] + ["bad_id", "txn_123456_0"]
+
+    start = time.monotonic()
+    statuses = gateway.verify_many(transaction_ids, max_workers=10)
+    elapsed = time.monotonic() - start
+
+    assert list(statuses) == [f"txn_123456_{i}" for i in range(10)] + ["bad_id"]
+    assert statuses["txn_123456_3"]['status'] == "completed"
+    assert statuses["bad_id"]['status'] == "not_found"
+    #11 checks of 0.3 s each: about 0.6 s in parallel instead of 3.3 s one by one
+    assert elapsed < 1.5
+
+    start = time.monotonic()
+    statuses = gateway.verify_many([f"txn_123456_{i}" for i in range(10)])
+    assert time.monotonic() - start < 0.1
+    assert gateway.status_cache.stats()['hits'] == 10
+
+#A refund evicts the cached status so the next check asks the gateway
+def test_refund_evicts_cached_status():
+    gateway = PaymentGateway(status_cache=PaymentStatusCache())
+    gateway.verify_payment_status("txn_123456_1")
+    assert gateway.status_cache.get("txn_123456_1") is not None
+
+    gateway.refund_payment("txn_123456_1", 5.0)
+    assert gateway.status_cache.get("txn_123456_1") is None
@@ -0,0 +1,81 @@
+import sqlite3
+import pytest
+from datetime import datetime, timedelta
+import database
+from database import (
+    borrow_book, get_book_by_isbn, get_patron_borrowed_books, get_patron_borrow_count,
+    get_patron_borrowing_history, insert_book, return_book
+)
+
+#Use a fresh database file so the schema (and its indexes) come from init_database
+@pytest.fixture
+def traced_queries(db_path, monkeypatch):
+    database.init_database()
+
+    #Record every statement the helpers send to SQLite
+    statements = []
+    original_get_db_connection = database.get_db_connection
+
+    def traced_get_db_connection():
+        conn = original_get_db_connection()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(database, 'get_db_connection', traced_get_db_connection)
+    return statements
+
+#Get the query plan of the statements that touch borrow_records
+def borrow_record_plans(statements):
+    conn = sqlite3.connect(database.DATABASE)
+    plans = []
+    for sql in list(statements):
+        if 'borrow_records' in sql and not sql.strip().upper().startswith(('CREATE', 'PRAGMA')):
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+            plans.append((sql, [row[3] for row in rows]))
+    conn.close()
+    return plans
+
+def assert_no_borrow_records_scan(statements):
+    plans = borrow_record_plans(statements)
+    assert plans
+    for sql, details in plans:
+        for detail in details:
+            #"SCAN br" or "SCAN borrow_records" means a full table scan
+            assert not detail.startswith(('SCAN br', 'SCAN borrow_records')), (sql, details)
+
+def test_borrowed_books_uses_index(traced_queries):
+    get_patron_borrowed_books("123456")
+    assert_no_borrow_records_scan(traced_queries)
+
+def test_borrow_count_uses_index(traced_queries):
+    get_patron_borrow_count("123456")
+    assert_no_borrow_records_scan(traced_queries)
+
+def test_borrowing_history_uses_index(traced_queries):
+    get_patron_borrowing_history("123456")
+    assert_no_borrow_records_scan(traced_queries)
+
+#The open-loan count inside borrow_book's UPDATE
+def test_borrow_book_uses_index(traced_queries):
+    insert_book("Test Book", "Test Author", "1234567890123", 1, 1)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    traced_queries.clear()
+    borrow_book("123456", book_id, datetime.now(), datetime.now() + timedelta(days=14))
+    assert_no_borrow_records_scan(traced_queries)
+
+#The oldest open loan looked up when a book is returned
+def test_return_book_uses_index(traced_queries):
+    insert_book("Test Book", "Test Author", "1234567890123", 1, 1)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    borrow_book("123456", book_id, datetime.now(), datetime.now() + timedelta(days=14))
+    traced_queries.clear()
+    outcome, _ = return_book("123456", book_id, datetime.now(), lambda due_date, return_date: 0.0)
+    assert outcome == database.RETURNED
+    assert_no_borrow_records_scan(traced_queries)
+
+#The open-loan queries should use the partial index
+def test_open_loans_use_partial_index(traced_queries):
+    get_patron_borrow_count("123456")
+    plans = borrow_record_plans(traced_queries)
+    assert any('idx_borrow_records_open_loans' in detail
+               for _, details in plans for detail in details)
@@ -0,0 +1,119 @@
+import asyncio
+import sqlite3
+import pytest
+import database
+from database import get_all_books, get_book_by_isbn, get_db_connection, get_patron_borrow_count, insert_book, transaction
+
+#Use a fresh database file for every test
+@pytest.fixture
+def app(fresh_app):
+    insert_book("Test Book", "Test Author", "1234567890123", 2, 2)
+    return fresh_app
+
+#Count the connections checked out of the pool
+@pytest.fixture
+def acquired(app, monkeypatch):
+    pool = database.get_pool()
+    calls = []
+    original_acquire = pool.acquire
+
+    def counting_acquire():
+        calls.append(1)
+        return original_acquire()
+
+    monkeypatch.setattr(pool, 'acquire', counting_acquire)
+    return calls
+
+#A borrow or a return is one connection, however many helpers it calls
+def test_one_connection_per_request(app, acquired):
+    client = app.test_client()
+    book_id = get_book_by_isbn("1234567890123")['id']
+    acquired.clear()
+
+    response = client.post('/borrow', data={'patron_id': "123456", 'book_id': book_id})
+    assert response.status_code == 302
+    assert len(acquired) == 1
+
+    acquired.clear()
+    response = client.post('/return', data={'patron_id': "123456", 'book_id': book_id})
+    assert response.status_code == 200
+    assert len(acquired) == 1
+
+    #Both were committed
+    assert get_patron_borrow_count("123456") == 0
+    assert get_book_by_isbn("1234567890123")['available_copies'] == 2
+
+#Pages that never touch the database never take a connection
+def test_no_connection_without_database_work(app, acquired):
+    response = app.test_client().get('/return')
+    assert response.status_code == 200
+    assert acquired == []
+
+#An error in the view rolls back everything the request wrote
+def test_error_rolls_back_request(app):
+    @app.route('/add-then-fail')
+    def add_then_fail():
+        insert_book("Lost Book", "Test Author", "9999999999999", 1, 1)
+        raise RuntimeError("view failed")
+
+    response = app.test_client().get('/add-then-fail')
+    assert response.status_code == 500
+    assert get_book_by_isbn("9999999999999") is None
+    assert database.get_pool().idle_count() >= 1
+
+#A failed transaction() block only undoes itself, the rest of the request is kept
+def test_transaction_is_savepoint_in_request(app):
+    @app.route('/add-two')
+    def add_two():
+        insert_book("Kept Book", "Test Author", "1111111111111", 1, 1)
+        with pytest.raises(RuntimeError):
+            with transaction() as conn:
+                conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) VALUES ('Undone Book', 'Test Author', '2222222222222', 1, 1)")
+                raise RuntimeError("block failed")
+        return 'ok'
+
+    assert app.test_client().get('/add-two').status_code == 200
+    titles = [book['title'] for book in get_all_books()]
+    assert "Kept Book" in titles
+    assert "Undone Book" not in titles
+
+#Returning a book that is not borrowed leaves the copies alone
+def test_return_not_borrowed(app):
+    book_id = get_book_by_isbn("1234567890123")['id']
+    response = app.test_client().post('/return', data={'patron_id': "123456", 'book_id': book_id})
+    assert response.status_code == 200
+    assert get_book_by_isbn("1234567890123")['available_copies'] == 2
+
+#rollback() cannot throw away the request's work; `with conn:` undoes only its block
+def test_scoped_rollback_and_with_block(app):
+    @app.route('/partial-undo')
+    def partial_undo():
+        conn = get_db_connection()
+        insert_book("Kept Book", "Test Author", "1111111111111", 1, 1)
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.rollback()
+        with pytest.raises(RuntimeError):
+            with conn:
+                conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) VALUES ('Undone Book', 'Test Author', '2222222222222', 1, 1)")
+                raise RuntimeError("block failed")
+        return 'ok'
+
+    assert app.test_client().get('/partial-undo').status_code == 200
+    titles = [book['title'] for book in get_all_books()]
+    assert "Kept Book" in titles
+    assert "Undone Book" not in titles
+
+#Threads that inherit the request context get connections of their own
+def test_threads_do_not_share_request_connection(app):
+    seen = []
+
+    @app.route('/threaded')
+    def threaded():
+        seen.append(type(get_db_connection()))
+        other = asyncio.run(asyncio.to_thread(get_db_connection))
+        seen.append(type(other))
+        other.close()
+        return 'ok'
+
+    assert app.test_client().get('/threaded').status_code == 200
+    assert seen == [database.ScopedConnection, database.PooledConnection]
@@ -0,0 +1,100 @@
+import sqlite3
+import pytest
+import database
+from app import create_app
+from database import SCHEMA_VERSION, get_all_books, get_db_connection, get_schema_version, init_database
+
+def table_names():
+    conn = get_db_connection()
+    names = {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    return names
+
+def current_version():
+    conn = get_db_connection()
+    version = get_schema_version(conn)
+    conn.close()
+    return version
+
+#A new database gets every table at the latest version
+def test_new_database(db_path):
+    init_database()
+
+    assert current_version() == SCHEMA_VERSION
+    assert {'books', 'borrow_records', 'payments', 'jobs', 'catalog_version', 'schema_version'} <= table_names()
+
+#Once the schema is current, startup is a single version check
+def test_startup_fast_path(db_path, monkeypatch):
+    init_database()
+
+    statements = []
+    original_get_db_connection = database.get_db_connection
+
+    def traced_get_db_connection():
+        conn = original_get_db_connection()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(database, 'get_db_connection', traced_get_db_connection)
+    init_database()
+
+    queries = [sql for sql in statements if not sql.startswith(('PRAGMA', 'SELECT 1'))]
+    assert queries == ['SELECT version FROM schema_version']
+
+#A database from before schema versioning is upgraded in place
+def test_legacy_database_is_migrated(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, author TEXT NOT NULL,
+            isbn TEXT UNIQUE NOT NULL, total_copies INTEGER NOT NULL, available_copies INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE borrow_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, patron_id TEXT NOT NULL, book_id INTEGER NOT NULL,
+            borrow_date TEXT NOT NULL, due_date TEXT NOT NULL, return_date TEXT
+        )
+    ''')
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) VALUES ('Old Book', 'Old Author', '1234567890123', 1, 1)")
+    conn.commit()
+    conn.close()
+
+    init_database()
+
+    assert current_version() == SCHEMA_VERSION
+    assert [book['title'] for book in get_all_books()] == ['Old Book']
+    conn = get_db_connection()
+    assert 'late_fee' in [row['name'] for row in conn.execute('PRAGMA table_info(borrow_records)')]
+    #The existing book was added to the search index
+    assert conn.execute("SELECT rowid FROM books_fts WHERE books_fts MATCH 'Old'").fetchone() is not None
+    conn.close()
+
+#Only the migrations newer than the stored version run
+def test_pending_migrations_run(db_path):
+    init_database()
+    conn = get_db_connection()
+    conn.execute('DROP TABLE jobs')
+    conn.execute('UPDATE schema_version SET version = 5')
+    conn.commit()
+    conn.close()
+
+    init_database()
+
+    assert 'jobs' in table_names()
+    assert current_version() == SCHEMA_VERSION
+
+#Sample data is only added when asked for
+def test_sample_data_only_when_requested(db_path, monkeypatch):
+    monkeypatch.delenv('LIBRARY_SAMPLE_DATA', raising=False)
+    create_app()
+    assert get_all_books() == []
+
+    create_app({'LOAD_SAMPLE_DATA': True})
+    assert len(get_all_books()) == 3
+
+def test_sample_data_from_environment(db_path, monkeypatch):
+    monkeypatch.setenv('LIBRARY_SAMPLE_DATA', '1')
+    app = create_app()
+    assert app.config['LOAD_SAMPLE_DATA'] is True
+    assert len(get_all_books()) == 3
@@ -0,0 +1,47 @@
+import database
+from app import create_app
+from server import LibraryServer, build_options, default_workers
+
+#Worker count comes from WEB_CONCURRENCY when it is set
+def test_default_workers(monkeypatch):
+    monkeypatch.setenv('WEB_CONCURRENCY', '3')
+    assert default_workers() == 3
+    monkeypatch.delenv('WEB_CONCURRENCY')
+    assert default_workers() >= 3
+
+def test_build_options():
+    options = build_options('127.0.0.1:8000', workers=4, threads=8, max_requests=500)
+
+    assert options['bind'] == '127.0.0.1:8000'
+    assert options['workers'] == 4
+    assert options['threads'] == 8
+    assert options['worker_class'] == 'gthread'
+    assert options['preload_app'] is True
+    assert options['max_requests'] == 500
+    assert options['max_requests_jitter'] == 50
+
+    assert build_options(workers=2, threads=1)['worker_class'] == 'sync'
+
+#The options become gunicorn settings
+def test_server_config():
+    server = LibraryServer(build_options('127.0.0.1:8000', workers=4, threads=8, preload=False, timeout=60))
+
+    assert server.cfg.bind == ['127.0.0.1:8000']
+    assert server.cfg.workers == 4
+    assert server.cfg.threads == 8
+    assert server.cfg.preload_app is False
+    assert server.cfg.timeout == 60
+
+#Loading the app leaves no open SQLite connection to be inherited by the forked workers
+def test_load_closes_connections():
+    app = LibraryServer(build_options(workers=1)).load()
+
+    assert 'api.metrics_api' in app.view_functions
+    assert database._pool is None
+
+#The serve command is registered with the flask CLI
+def test_serve_command_help():
+    result = create_app().test_cli_runner().invoke(args=['serve', '--help'])
+    assert result.exit_code == 0
+    assert '--workers' in result.output
+    assert '--preload / --no-preload' in result.output